@@ -1,14 +1,21 @@
 import json
 import traceback
 import datetime
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import boto3
-from botocore.exceptions import NoCredentialsError
-from flask import Flask, request, jsonify
+from botocore.exceptions import ClientError, NoCredentialsError
+from flask import Flask, Response, redirect, request, jsonify
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
+import tempfile
 from s3_client import s3
+import timeline_store
+import common_path  # puts ../../common (shared modules) on the import path
+from work_queue import AGGREGATE_REBUILD_PREFIX, WORK_QUEUE_PATH, WORK_QUEUES, WorkQueue
 
 S3_BUCKET = "cs14-2-recordingtool"
 
@@ -18,12 +25,281 @@ S3_INPUT_FOLDER = 'recording_results/'
 
 S3_OUTPUT_FOLDER = 'Output/'
 
+RECORDING_FIELDS = ['recordedScreen', 'recordedCamera', 'recordedAudio']
+
+# Direct-to-S3 multipart uploads: S3 requires parts of at least 5 MiB
+# (except the last one) and allows at most 10000 parts per object.
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+PRESIGNED_URL_EXPIRES = 3600
+
+# Ranged playback: open-ended requests ("bytes=0-") are answered with at most
+# this many bytes, so every seek in the player costs one small S3 ranged GET.
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_MAX_RANGE = 2 * 1024 * 1024
+
+# Bulk deletion: DeleteObjects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+DELETE_WORKERS = 8
+# Deleting sessions asks the analysis workers on this queue to rebuild the project aggregates
+AGGREGATE_WORK_QUEUE = os.environ.get('AGGREGATE_WORK_QUEUE', 'analysis')
+
+# Heatmap gallery: listings are cached per project for a short time and served in pages
+HEATMAP_IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+HEATMAP_THUMBNAIL_SUFFIX = '_thumb'
+HEATMAP_CACHE_TTL = 30
+HEATMAP_PAGE_SIZE = 50
+HEATMAP_MAX_PAGE_SIZE = 500
+
+# Cursor trajectories (sceneN/cursor_trajectory.npy, one record per frame) and
+# keyboard focus boxes (sceneN/focus_boxes.npy) are downloaded into this folder
+# and memory-mapped from there; each copy keeps the ETag it was downloaded
+# with in <file><TRAJECTORY_ETAG_SUFFIX>, so a re-analyzed session is fetched again
+TRAJECTORY_FILENAME = 'cursor_trajectory.npy'
+TRAJECTORY_FIELDS = ('frame', 'time', 'x', 'y', 'intensity')
+FOCUS_BOXES_FILENAME = 'focus_boxes.npy'
+FOCUS_BOX_FIELDS = ('frame', 'time', 'x', 'y', 'w', 'h')
+TRAJECTORY_CACHE_DIR = os.environ.get('TRAJECTORY_CACHE_DIR',
+                                      os.path.join(tempfile.gettempdir(), 'smp_trajectories'))
+TRAJECTORY_ETAG_SUFFIX = '.etag'
+
+# Timeline queries: sessions are ingested into this SQLite store on first use
+TIMELINE_DB = os.environ.get('TIMELINE_DB', os.path.join(TRAJECTORY_CACHE_DIR, 'timelines.sqlite3'))
+TIMELINE_MAX_POINTS = 5000
+
+
+def recording_base_prefix(project_name, uuid):
+    """S3 prefix holding every task of one participant session."""
+    return f"{S3_INPUT_FOLDER}{secure_filename(project_name)}/{secure_filename(uuid)}/"
+
+
+def save_user_metadata(base_prefix, first_name, last_name, email):
+    """Write the participant's user_data.json next to the recordings and return its key."""
+    metadata = {
+        "firstName": first_name,
+        "lastName": last_name,
+        "email": email,
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+    body = json.dumps(metadata, ensure_ascii=False, indent=2)
+    ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    filename = secure_filename(f"{ts}_user_data.json")
+    key = base_prefix + filename
+    s3.put_object(Bucket=S3_BUCKET, Key=key, Body=body, ContentType='application/json')
+    return key
+
+
+def upload_file_size(info):
+    """Size in bytes of a file announced to /upload/initiate, or None if it is missing or not a positive number."""
+    try:
+        size = int(info.get('size'))
+    except (TypeError, ValueError):
+        return None
+    return size if size > 0 else None
+
+
+def reported_parts(upload):
+    """Return {partNumber: etag} of an upload sent to /upload/complete, or None if it is malformed."""
+    parts = upload.get('parts')
+    if not isinstance(upload.get('uploadId'), str) or not upload['uploadId'] or not isinstance(parts, list):
+        return None
+    reported = {}
+    for part in parts:
+        if not isinstance(part, dict) or not isinstance(part.get('etag'), str):
+            return None
+        try:
+            reported[int(part['partNumber'])] = part['etag']
+        except (KeyError, TypeError, ValueError):
+            return None
+    return reported
+
+
+def list_uploaded_parts(key, upload_id):
+    """Return {PartNumber: ETag} for every part S3 has received for a multipart upload."""
+    parts = {}
+    marker = 0
+    while True:
+        response = s3.list_parts(Bucket=S3_BUCKET, Key=key, UploadId=upload_id,
+                                 PartNumberMarker=marker)
+        for part in response.get('Parts', []):
+            parts[part['PartNumber']] = part['ETag']
+        if not response.get('IsTruncated'):
+            return parts
+        marker = response['NextPartNumberMarker']
+
+
+def iter_key_batches(prefix, batch_size=DELETE_BATCH_SIZE):
+    """Yield the keys under a prefix in lists of at most batch_size, one listing page at a time."""
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix,
+                                   PaginationConfig={'PageSize': batch_size}):
+        keys = [obj['Key'] for obj in page.get('Contents', [])]
+        for start in range(0, len(keys), batch_size):
+            yield keys[start:start + batch_size]
+
+
+def delete_key_batch(keys):
+    """Delete up to 1000 keys with one DeleteObjects call and return (deleted, errors)."""
+    response = s3.delete_objects(Bucket=S3_BUCKET,
+                                 Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+    errors = [{'key': e.get('Key'), 'message': e.get('Message', e.get('Code'))}
+              for e in response.get('Errors', [])]
+    return len(keys) - len(errors), errors
+
+
+def delete_prefixes(prefixes):
+    """
+    Delete everything under the given prefixes with concurrent batched DeleteObjects calls
+
+    Yields:
+        dict: progress after each finished batch, then a final summary
+    """
+    listed = deleted = batches = 0
+    errors = []
+    try:
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+            futures = []
+            for prefix in prefixes:
+                for keys in iter_key_batches(prefix):
+                    listed += len(keys)
+                    futures.append(executor.submit(delete_key_batch, keys))
+            for future in as_completed(futures):
+                batch_deleted, batch_errors = future.result()
+                deleted += batch_deleted
+                errors.extend(batch_errors)
+                batches += 1
+                yield {'status': 'progress', 'listed': listed, 'deleted': deleted,
+                       'batches': batches, 'totalBatches': len(futures)}
+    except Exception as e:
+        traceback.print_exc()
+        errors.append({'key': None, 'message': str(e)})
+    yield {'status': 'error' if errors else 'success', 'listed': listed, 'deleted': deleted,
+           'batches': batches, 'errors': errors[:100]}
+
+
+def list_heatmap_keys(project_name):
+    """
+    List every heatmap image of a project, across all listing pages
+
+    Returns:
+        (sorted full-size image keys, {full-size key: thumbnail key})
+    """
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{S3_OUTPUT_FOLDER}{project_name}/"):
+        keys.extend(obj['Key'] for obj in page.get('Contents', [])
+                    if obj['Key'].lower().endswith(HEATMAP_IMAGE_EXTS))
+
+    # The analysis writes <name>_thumb.webp (or .jpg) next to each <name>.png
+    thumbnails = {}
+    full_keys = []
+    for key in keys:
+        base, _ = os.path.splitext(key)
+        if base.endswith(HEATMAP_THUMBNAIL_SUFFIX):
+            thumbnails[base[:-len(HEATMAP_THUMBNAIL_SUFFIX)]] = key
+        else:
+            full_keys.append(key)
+    return sorted(full_keys), {key: thumbnails[os.path.splitext(key)[0]]
+                               for key in full_keys if os.path.splitext(key)[0] in thumbnails}
+
+
+def heatmap_key_parts(key):
+    """Split Output/<project>/<uuid>/task_N/sceneK/<file> into (session, scene)."""
+    parts = key.split('/')
+    session = parts[2] if len(parts) > 3 else None
+    scene = next((part for part in parts[3:-1] if part.startswith('scene')), None)
+    return session, scene
+
+
+def load_cursor_trajectory(key, fields=TRAJECTORY_FIELDS, etag=None):
+    """
+    Memory-map a cursor trajectory, downloading it into TRAJECTORY_CACHE_DIR when the cached copy is missing or stale
+
+    Args:
+        key: S3 key of the .npy file
+        fields: Expected record fields (FOCUS_BOX_FIELDS for focus boxes)
+        etag: Current ETag of the object, if known (e.g. from a listing); without
+              it the cached copy is revalidated with a conditional GET
+
+    Returns:
+        Read-only structured array with the given fields, sorted by time
+    """
+    path = os.path.join(TRAJECTORY_CACHE_DIR, *key.split('/'))
+    cached_etag = None
+    if os.path.exists(path):
+        try:
+            with open(path + TRAJECTORY_ETAG_SUFFIX) as f:
+                cached_etag = f.read()
+        except FileNotFoundError:
+            pass
+    if cached_etag is None or etag != cached_etag:
+        try:
+            obj = s3.get_object(Bucket=S3_BUCKET, Key=key, **({'IfNoneMatch': cached_etag} if cached_etag else {}))
+        except ClientError as e:
+            if cached_etag is None or e.response.get('Error', {}).get('Code') not in ('304', 'NotModified'):
+                raise
+            obj = None
+        if obj is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: obj['Body'].read(STREAM_CHUNK_SIZE), b''):
+                    f.write(chunk)
+            # The ETag is written after the data, so a copy never claims to be newer than it is
+            os.replace(tmp_path, path)
+            with open(tmp_path, 'w') as f:
+                f.write(obj['ETag'])
+            os.replace(tmp_path, path + TRAJECTORY_ETAG_SUFFIX)
+    import numpy as np  # Only the trajectory endpoints need NumPy; keep it out of start-up
+    trajectory = np.load(path, mmap_mode='r')
+    if trajectory.dtype.names != fields:
+        raise ValueError(f"{key} does not hold {', '.join(fields)} records")
+    return trajectory
+
+
+def load_session_timelines(session_prefix):
+    """
+    Load the cursor trajectories and focus boxes of every scene of an analyzed session
+
+    Args:
+        session_prefix: Output/<project>/<uuid>/task_N/
+
+    Returns:
+        Dict mapping scene number to (trajectory or None, focus boxes or None)
+    """
+    scenes = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=session_prefix):
+        for obj in page.get('Contents', []):
+            parts = obj['Key'][len(session_prefix):].split('/')
+            if len(parts) != 2 or not parts[0].startswith('scene') or not parts[0][5:].isdigit():
+                continue
+            scene = int(parts[0][5:])
+            trajectory, focus_boxes = scenes.get(scene, (None, None))
+            if parts[1] == TRAJECTORY_FILENAME:
+                trajectory = load_cursor_trajectory(obj['Key'], etag=obj.get('ETag'))
+            elif parts[1] == FOCUS_BOXES_FILENAME:
+                focus_boxes = load_cursor_trajectory(obj['Key'], FOCUS_BOX_FIELDS, obj.get('ETag'))
+            else:
+                continue
+            scenes[scene] = (trajectory, focus_boxes)
+    return scenes
+
+
 def create_app(config_name='development'):
     app = Flask(__name__)
     # 测试时用的配置
     app.config['TESTING'] = (config_name == 'testing')
     app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET', 'cs14-2-recordingtool')
+    app.config['TIMELINE_DB'] = TIMELINE_DB
+    # Uploaded recordings are published to these work queues (None disables publishing)
+    app.config['WORK_QUEUE_PATH'] = None if app.config['TESTING'] else WORK_QUEUE_PATH
+    app.config['WORK_QUEUES'] = WORK_QUEUES
+    app.config['AGGREGATE_WORK_QUEUE'] = AGGREGATE_WORK_QUEUE
     CORS(app)
+    if not app.config['TESTING']:
+        # Build the S3 client while the first requests are still on their way
+        s3.warm_up()
 
     # API for projectTask
     @app.route('/api/projectTask/upload', methods=['POST'])
@@ -93,6 +369,46 @@ def create_app(config_name='development'):
             return f'Delete Failed: {str(e)}', 500
 
 
+    work_queues = {}
+    work_queue_lock = threading.Lock()
+
+    def work_queue():
+        """The work queue shared with the pipelines, or None if publishing is disabled."""
+        path = app.config['WORK_QUEUE_PATH']
+        if not path:
+            return None
+        with work_queue_lock:
+            if path not in work_queues:
+                work_queues[path] = WorkQueue(path)
+            return work_queues[path]
+
+    def publish_recording(saved_keys):
+        """Publish an uploaded screen recording to the work queues of the pipelines; returns the queues."""
+        key = saved_keys.get('recordedScreen')
+        if not app.config['WORK_QUEUE_PATH'] or not key:
+            return []
+        try:
+            queue = work_queue()
+            for name in app.config['WORK_QUEUES']:
+                queue.put(name, key)
+            return list(app.config['WORK_QUEUES'])
+        except Exception:
+            # The recording is saved; a backfill scan of the workers can still pick it up
+            traceback.print_exc()
+            return []
+
+    def publish_aggregate_rebuild(project_name, task_index):
+        """Ask the analysis workers to rebuild the aggregates of a project (or one task); returns True if queued."""
+        if not app.config['WORK_QUEUE_PATH']:
+            return False
+        target = f"{project_name}/" + (f"task_{task_index}" if task_index else '')
+        try:
+            work_queue().put(app.config['AGGREGATE_WORK_QUEUE'], AGGREGATE_REBUILD_PREFIX + target)
+            return True
+        except Exception:
+            traceback.print_exc()
+            return False
+
     # API for recording result
     @app.route('/api/recording/upload', methods=['POST'])
     def upload_recording():
@@ -107,10 +423,10 @@ def create_app(config_name='development'):
             # task_title = form.get('taskTile')
             task_index = form.get('taskIndex')
 
-            base_prefix = f"recording_results/{secure_filename(project_name)}/{secure_filename(uuid)}/"
+            base_prefix = recording_base_prefix(project_name, uuid)
             recording_prefix = base_prefix + f"task_{task_index}/"
             saved_keys = {}
-            for field in ['recordedScreen', 'recordedCamera', 'recordedAudio']:
+            for field in RECORDING_FIELDS:
                 file = files.get(field)
                 if file and task_index is not None:
                     name = secure_filename(file.filename)
@@ -118,32 +434,210 @@ def create_app(config_name='development'):
                     s3.upload_fileobj(file, S3_BUCKET, key)
                     saved_keys[field] = key
             if first_name or last_name or email:
-                metadata = {
-                    "firstName": first_name,
-                    "lastName": last_name,
-                    "email": email,
-                    "timestamp": datetime.datetime.now().isoformat()
-                }
-                body = json.dumps(metadata, ensure_ascii=False, indent=2)
-                ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-                filename = secure_filename(f"{ts}_user_data.json")
-                key = base_prefix + filename
-                s3.put_object(Bucket=S3_BUCKET, Key=key, Body=body, ContentType='application/json')
-                saved_keys['metadata'] = key
-            return jsonify({"status": "success", "keys": saved_keys}), 200
+                saved_keys['metadata'] = save_user_metadata(base_prefix, first_name, last_name, email)
+            queued = publish_recording(saved_keys)
+            return jsonify({"status": "success", "keys": saved_keys, "queued": queued}), 200
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    # Direct-to-S3 upload: the browser PUTs each part to a presigned URL,
+    # so recording bytes never pass through this process.
+    @app.route('/api/recording/upload/initiate', methods=['POST'])
+    def initiate_recording_upload():
+        try:
+            body = request.get_json(silent=True) or {}
+            project_name = str(body.get('projectName', '')).strip()
+            uuid = str(body.get('uuid', ''))
+            task_index = body.get('taskIndex')
+            files = body.get('files') or {}
+            if not project_name or not uuid or task_index is None:
+                return jsonify({"status": "error", "message": "Missing projectName, uuid or taskIndex"}), 400
+            if not isinstance(files, dict):
+                return jsonify({"status": "error", "message": "files must map fields to file info"}), 400
+
+            recording_prefix = recording_base_prefix(project_name, uuid) + f"task_{task_index}/"
+            # Check every file before creating any multipart upload, so a bad
+            # request leaves no upload behind
+            files_to_upload = {}
+            for field in RECORDING_FIELDS:
+                info = files.get(field)
+                if not info:
+                    continue
+                if not isinstance(info, dict):
+                    return jsonify({"status": "error", "message": f"Invalid file info for {field}"}), 400
+                name = secure_filename(str(info.get('filename', '')))
+                size = upload_file_size(info)
+                if not name or size is None:
+                    return jsonify({"status": "error", "message": f"Invalid file info for {field}"}), 400
+                part_count = max(1, -(-size // MULTIPART_PART_SIZE))
+                if part_count > MULTIPART_MAX_PARTS:
+                    return jsonify({"status": "error", "message": f"{field} is too large"}), 400
+                files_to_upload[field] = (recording_prefix + name, part_count, info.get('contentType', 'video/webm'))
+
+            uploads = {}
+            for field, (key, part_count, content_type) in files_to_upload.items():
+                upload = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=content_type)
+                upload_id = upload['UploadId']
+                parts = [
+                    {
+                        'partNumber': number,
+                        'url': s3.generate_presigned_url(
+                            'upload_part',
+                            Params={'Bucket': S3_BUCKET, 'Key': key,
+                                    'UploadId': upload_id, 'PartNumber': number},
+                            ExpiresIn=PRESIGNED_URL_EXPIRES
+                        )
+                    }
+                    for number in range(1, part_count + 1)
+                ]
+                uploads[field] = {'key': key, 'uploadId': upload_id,
+                                  'partSize': MULTIPART_PART_SIZE, 'parts': parts}
+            return jsonify({"status": "success", "uploads": uploads}), 200
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    @app.route('/api/recording/upload/complete', methods=['POST'])
+    def complete_recording_upload():
+        try:
+            body = request.get_json(silent=True) or {}
+            project_name = str(body.get('projectName', '')).strip()
+            uuid = str(body.get('uuid', ''))
+            task_index = body.get('taskIndex')
+            uploads = body.get('uploads') or {}
+            if not project_name or not uuid or task_index is None:
+                return jsonify({"status": "error", "message": "Missing projectName, uuid or taskIndex"}), 400
+            if not isinstance(uploads, dict):
+                return jsonify({"status": "error", "message": "uploads must map fields to uploads"}), 400
+
+            base_prefix = recording_base_prefix(project_name, uuid)
+            recording_prefix = base_prefix + f"task_{task_index}/"
+            # Verify every upload against what S3 actually received before completing any of them
+            completions = {}
+            for field, upload in uploads.items():
+                key = upload.get('key') if isinstance(upload, dict) else None
+                reported = reported_parts(upload) if isinstance(key, str) else None
+                if field not in RECORDING_FIELDS or reported is None or not key.startswith(recording_prefix):
+                    return jsonify({"status": "error", "message": f"Invalid upload for {field}"}), 400
+                received = list_uploaded_parts(key, upload['uploadId'])
+                if not reported or reported != received:
+                    missing = sorted(set(reported) - set(received))
+                    return jsonify({"status": "error",
+                                    "message": f"Parts of {field} do not match the uploaded data",
+                                    "missingParts": missing}), 409
+                completions[field] = (key, upload['uploadId'], received)
+
+            saved_keys = {}
+            for field, (key, upload_id, received) in completions.items():
+                s3.complete_multipart_upload(
+                    Bucket=S3_BUCKET, Key=key, UploadId=upload_id,
+                    MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': received[number]}
+                                               for number in sorted(received)]}
+                )
+                saved_keys[field] = key
+
+            first_name = str(body.get('firstName', '')).strip()
+            last_name = str(body.get('lastName', '')).strip()
+            email = str(body.get('email', ''))
+            if first_name or last_name or email:
+                saved_keys['metadata'] = save_user_metadata(base_prefix, first_name, last_name, email)
+            queued = publish_recording(saved_keys)
+            return jsonify({"status": "success", "keys": saved_keys, "queued": queued}), 200
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify({"status": "error", "message": str(e)}), 500
+
+    @app.route('/api/recording/upload/abort', methods=['POST'])
+    def abort_recording_upload():
+        try:
+            body = request.get_json(silent=True) or {}
+            for upload in (body.get('uploads') or {}).values():
+                if upload.get('key', '').startswith(S3_INPUT_FOLDER):
+                    s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=upload['key'],
+                                              UploadId=upload['uploadId'])
+            return jsonify({"status": "success"}), 200
         except Exception as e:
             traceback.print_exc()
             return jsonify({"status": "error", "message": str(e)}), 500
 
     @app.route('/api/recording/get_recording', methods=['GET'])
     def get_recording():
-        # to do
-        return
+        project_name = request.args.get('project', '').strip()
+        uuid = request.args.get('uuid', '')
+        task_index = request.args.get('task', '')
+        file_name = secure_filename(request.args.get('file', 'screen.webm'))
+        if not project_name or not uuid or not task_index or not file_name:
+            return 'Missing project, uuid, task or file', 400
+        key = recording_base_prefix(project_name, uuid) + f"task_{secure_filename(task_index)}/{file_name}"
+
+        try:
+            # Let S3 serve the bytes (and the Range requests) itself
+            if request.args.get('redirect'):
+                url = s3.generate_presigned_url('get_object', Params={'Bucket': S3_BUCKET, 'Key': key},
+                                                ExpiresIn=PRESIGNED_URL_EXPIRES)
+                return redirect(url, 302)
+
+            head = s3.head_object(Bucket=S3_BUCKET, Key=key)
+            size = head['ContentLength']
+            content_type = head.get('ContentType', 'video/webm')
+            headers = {'Accept-Ranges': 'bytes'}
+            # Multi-range requests are answered with the whole recording (a
+            # server may ignore Range), rather than a multipart/byteranges body
+            if request.range is None or len(request.range.ranges) > 1:
+                obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
+                status, length = 200, size
+            else:
+                byte_range = request.range.range_for_length(size)
+                if byte_range is None:
+                    return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+                start, stop = byte_range
+                if request.range.ranges[0][1] is None:
+                    stop = min(stop, start + STREAM_MAX_RANGE)
+                obj = s3.get_object(Bucket=S3_BUCKET, Key=key, Range=f'bytes={start}-{stop - 1}')
+                status, length = 206, stop - start
+                headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+            headers['Content-Length'] = str(length)
+
+            body = obj['Body']
+            chunks = iter(lambda: body.read(STREAM_CHUNK_SIZE), b'')
+            return Response(chunks, status=status, headers=headers, content_type=content_type,
+                            direct_passthrough=True)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return f'Recording {key} not found', 404
+            return f'Read Failed: {str(e)}', 500
+        except Exception as e:
+            return f'Read Failed: {str(e)}', 500
 
     @app.route('/api/recording/delete_recording', methods=['DELETE'])
     def delete_recording():
-        # to do
-        return
+        project_name = secure_filename(request.args.get('project', '').strip())
+        uuid = secure_filename(request.args.get('uuid', ''))
+        task_index = secure_filename(request.args.get('task', ''))
+        if not project_name:
+            return 'Missing project name to delete', 400
+        if task_index and not uuid:
+            return 'Missing uuid for the task to delete', 400
+
+        # Scope: whole project, one participant, or one task of a participant
+        relative = f"{project_name}/"
+        if uuid:
+            relative += f"{uuid}/"
+            if task_index:
+                relative += f"task_{task_index}/"
+        prefixes = [S3_INPUT_FOLDER + relative, S3_OUTPUT_FOLDER + relative]
+
+        def lines():
+            # Progress is streamed as one JSON object per line. The project
+            # aggregates summed the deleted sessions, so once a participant or
+            # task is gone they are rebuilt (a deleted project takes its
+            # aggregates with it)
+            for progress in delete_prefixes(prefixes):
+                if progress['status'] != 'progress' and uuid:
+                    progress['aggregate_rebuild'] = publish_aggregate_rebuild(project_name, task_index)
+                yield json.dumps(progress) + '\n'
+        return Response(lines(), status=200, mimetype='application/x-ndjson')
 
     # API for visualization
     @app.route('/api/visualization/get_project_list', methods=['GET'])
@@ -157,20 +651,175 @@ def create_app(config_name='development'):
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    # {project_name: (expires_at, sorted image keys, thumbnail keys)}
+    heatmap_cache = {}
+    heatmap_cache_lock = threading.Lock()
+
+    def cached_heatmap_keys(project_name):
+        now = time.monotonic()
+        with heatmap_cache_lock:
+            cached = heatmap_cache.get(project_name)
+            if cached and cached[0] > now:
+                return cached[1], cached[2]
+        keys, thumbnails = list_heatmap_keys(project_name)
+        with heatmap_cache_lock:
+            heatmap_cache[project_name] = (now + HEATMAP_CACHE_TTL, keys, thumbnails)
+        return keys, thumbnails
+
+    def presigned_image_url(key):
+        return s3.generate_presigned_url('get_object', Params={'Bucket': S3_BUCKET, 'Key': key},
+                                         ExpiresIn=PRESIGNED_URL_EXPIRES)
+
     @app.route('/api/visualization/get_heatmap_list/<project_name>', methods=['GET'])
     def get_output_result(project_name):
         try:
-            prefix = f"{S3_OUTPUT_FOLDER}{project_name}/"
-            response = s3.list_objects_v2(Bucket=S3_BUCKET, Prefix=prefix)
-            images = [
-                {
-                    'url': f"https://{S3_BUCKET}.s3.amazonaws.com/{obj['Key']}",
-                    'name': obj['Key'].split('/')[-1]
-                }
-                for obj in response.get('Contents', [])
-                if obj['Key'].lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))
-            ]
-            return jsonify(images), 200
+            session = request.args.get('session')
+            scene = request.args.get('scene')
+            if scene and not scene.startswith('scene'):
+                scene = f"scene{scene}"
+            cursor = request.args.get('cursor')
+            limit = min(max(request.args.get('limit', HEATMAP_PAGE_SIZE, type=int), 1), HEATMAP_MAX_PAGE_SIZE)
+
+            keys, thumbnails = cached_heatmap_keys(project_name)
+            if session or scene:
+                keys = [key for key in keys
+                        if (not session or heatmap_key_parts(key)[0] == session)
+                        and (not scene or heatmap_key_parts(key)[1] == scene)]
+            # The cursor is the last key of the previous page
+            start = bisect_right(keys, cursor) if cursor else 0
+            page = keys[start:start + limit]
+
+            images = []
+            for key in page:
+                key_session, key_scene = heatmap_key_parts(key)
+                full_url = presigned_image_url(key)
+                images.append({
+                    # The gallery grid shows 'url'; the preview opens 'fullUrl'
+                    'url': presigned_image_url(thumbnails[key]) if key in thumbnails else full_url,
+                    'fullUrl': full_url,
+                    'name': key.split('/')[-1],
+                    'key': key,
+                    'session': key_session,
+                    'scene': key_scene
+                })
+            next_cursor = page[-1] if start + limit < len(keys) else None
+            return jsonify({'images': images, 'nextCursor': next_cursor}), 200
+        except NoCredentialsError:
+            return jsonify({"error": "S3 credentials not found"}), 500
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/api/visualization/get_cursor_trajectory/<project_name>', methods=['GET'])
+    def get_cursor_trajectory(project_name):
+        uuid = secure_filename(request.args.get('uuid', ''))
+        task_index = secure_filename(request.args.get('task', ''))
+        scene = secure_filename(request.args.get('scene', ''))
+        if not uuid or not task_index or not scene:
+            return jsonify({"error": "Missing uuid, task or scene"}), 400
+        if not scene.startswith('scene'):
+            scene = f"scene{scene}"
+        key = (f"{S3_OUTPUT_FOLDER}{secure_filename(project_name)}/{uuid}/"
+               f"task_{task_index}/{scene}/{TRAJECTORY_FILENAME}")
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+
+        try:
+            trajectory = load_cursor_trajectory(key)
+            # Only the records in [start, end] are read from the mapped file
+            times = trajectory['time']
+            first = 0 if start is None else int(times.searchsorted(start, side='left'))
+            last = len(trajectory) if end is None else int(times.searchsorted(end, side='right'))
+            records = trajectory[first:last]
+            result = {field: records[field].tolist() for field in TRAJECTORY_FIELDS}
+            result['count'] = len(records)
+            return jsonify(result), 200
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return jsonify({"error": f"Trajectory {key} not found"}), 404
+            return jsonify({"error": str(e)}), 500
+        except NoCredentialsError:
+            return jsonify({"error": "S3 credentials not found"}), 500
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # One store connection per request thread; ingestion is serialized
+    timeline_local = threading.local()
+    timeline_ingest_lock = threading.Lock()
+
+    def timeline_connection():
+        path = app.config['TIMELINE_DB']
+        if getattr(timeline_local, 'path', None) != path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            timeline_local.conn = timeline_store.connect(path)
+            timeline_local.path = path
+        return timeline_local.conn
+
+    def timeline_query_args(project_name):
+        """Parse the session, time range, scene and region of a timeline request; ingest the session if needed."""
+        uuid = secure_filename(request.args.get('uuid', ''))
+        task_index = secure_filename(request.args.get('task', ''))
+        if not uuid or not task_index:
+            return None, (jsonify({"error": "Missing uuid or task"}), 400)
+        corners = [request.args.get(name, type=int) for name in ('x0', 'y0', 'x1', 'y1')]
+        if any(value is not None for value in corners) and None in corners:
+            return None, (jsonify({"error": "A region needs x0, y0, x1 and y1"}), 400)
+        scene = request.args.get('scene', '')
+        if scene.startswith('scene'):
+            scene = scene[5:]
+
+        name = f"{secure_filename(project_name)}/{uuid}/task_{task_index}"
+        conn = timeline_connection()
+        session = timeline_store.session_id(conn, name)
+        # refresh=1 ingests the session again; the listing's ETags replace cached trajectories that changed
+        if session is None or request.args.get('refresh'):
+            with timeline_ingest_lock:
+                session = timeline_store.session_id(conn, name)
+                if session is None or request.args.get('refresh'):
+                    scenes = load_session_timelines(f"{S3_OUTPUT_FOLDER}{name}/")
+                    if not scenes:
+                        return None, (jsonify({"error": f"No cursor or focus timelines for {name}"}), 404)
+                    session = timeline_store.ingest_session(conn, name, scenes)
+        return {
+            'conn': conn,
+            'session': session,
+            'start': request.args.get('start', type=float),
+            'end': request.args.get('end', type=float),
+            'region': tuple(corners) if corners[0] is not None else None,
+            'scene': int(scene) if scene.isdigit() else None
+        }, None
+
+    @app.route('/api/visualization/timeline/<project_name>/cursor', methods=['GET'])
+    def get_cursor_timeline(project_name):
+        try:
+            query, error = timeline_query_args(project_name)
+            if error:
+                return error
+            max_points = min(max(request.args.get('max_points', TIMELINE_MAX_POINTS, type=int), 1),
+                             TIMELINE_MAX_POINTS)
+            rows, total = timeline_store.query_cursor(query['conn'], query['session'], query['start'], query['end'],
+                                                      query['region'], query['scene'], max_points)
+            columns = list(zip(*rows)) or [()] * 6
+            result = {name: list(column) for name, column in
+                      zip(('time', 'frame', 'scene', 'x', 'y', 'intensity'), columns)}
+            result['count'] = len(rows)
+            result['total'] = total
+            return jsonify(result), 200
+        except NoCredentialsError:
+            return jsonify({"error": "S3 credentials not found"}), 500
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.route('/api/visualization/timeline/<project_name>/focus', methods=['GET'])
+    def get_focus_timeline(project_name):
+        try:
+            query, error = timeline_query_args(project_name)
+            if error:
+                return error
+            rows = timeline_store.query_focus_regions(query['conn'], query['session'], query['start'],
+                                                      query['end'], query['region'], query['scene'])
+            regions = [{'x': x, 'y': y, 'w': w, 'h': h, 'frames': frames, 'firstTime': first, 'lastTime': last}
+                       for x, y, w, h, frames, first, last in rows]
+            return jsonify({'regions': regions}), 200
         except NoCredentialsError:
             return jsonify({"error": "S3 credentials not found"}), 500
         except Exception as e:
@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sys
+
+# The modules shared with the pipelines (work queue, S3 client) live in <repo>/common;
+# importing this module puts that folder on the import path
+COMMON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'common')
+if COMMON_DIR not in sys.path:
+    sys.path.append(COMMON_DIR)
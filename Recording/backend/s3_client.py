@@ -1,9 +1,11 @@
-import boto3
+import common_path  # puts ../../common (shared modules) on the import path
+from lazy_client import LazyClient
 
-# The access credentials for S3
-s3 = boto3.client(
+# The access credentials for S3; the client is created on the first request,
+# or in the background by s3.warm_up() while the app starts serving
+s3 = LazyClient(
     's3',
     aws_access_key_id='your-key',
     aws_secret_access_key='your-key',
     region_name='your-region'  # region
-)
\ No newline at end of file
+)
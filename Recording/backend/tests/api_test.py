@@ -1,6 +1,8 @@
 import io
 import json
 
+import numpy as np
+
 payload = {
         "projectName": "Test Project Task",
         "taskNumber": 1,
@@ -176,9 +178,398 @@ def test_upload_recording_1(client):
 
     assert isinstance(keys['metadata'], str)
 
+# Test for: /api/recording/upload/initiate and /api/recording/upload/complete
+def test_presigned_upload_recording_1(client, dummy_s3):
+    screen = b'screen-data' * 10
+    resp = client.post('/api/recording/upload/initiate', json={
+        'projectName': 'P',
+        'uuid': 'u456',
+        'taskIndex': 1,
+        'files': {'recordedScreen': {'filename': 'screen.webm', 'size': len(screen)}}
+    })
+    assert resp.status_code == 200
+    upload = resp.get_json()['uploads']['recordedScreen']
+    assert upload['key'] == 'recording_results/P/u456/task_1/screen.webm'
+    assert len(upload['parts']) == 1
+    assert upload['parts'][0]['url'].startswith('https://')
+
+    # Browser PUTs the bytes straight to S3
+    etag = dummy_s3.upload_part('test-bucket', upload['key'], upload['uploadId'], 1, screen)['ETag']
+    resp = client.post('/api/recording/upload/complete', json={
+        'projectName': 'P',
+        'uuid': 'u456',
+        'taskIndex': 1,
+        'firstName': 'Alice',
+        'email': 'a@b.com',
+        'uploads': {'recordedScreen': {'key': upload['key'], 'uploadId': upload['uploadId'],
+                                       'parts': [{'partNumber': 1, 'etag': etag}]}}
+    })
+    assert resp.status_code == 200
+    keys = resp.get_json()['keys']
+    assert keys['recordedScreen'] == upload['key']
+    assert dummy_s3.storage[upload['key']] == screen
+    assert json.loads(dummy_s3.storage[keys['metadata']])['firstName'] == 'Alice'
+
+def test_presigned_upload_recording_2(client, dummy_s3):
+    resp = client.post('/api/recording/upload/initiate', json={
+        'projectName': 'P',
+        'uuid': 'u789',
+        'taskIndex': 2,
+        'files': {'recordedAudio': {'filename': 'audio.webm', 'size': 20 * 1024 * 1024}}
+    })
+    upload = resp.get_json()['uploads']['recordedAudio']
+    assert len(upload['parts']) == 3
+
+    # Only the first part reached S3, so completion must be refused
+    etag = dummy_s3.upload_part('test-bucket', upload['key'], upload['uploadId'], 1, b'part-1')['ETag']
+    parts = [{'partNumber': 1, 'etag': etag}, {'partNumber': 2, 'etag': '"x"'}, {'partNumber': 3, 'etag': '"y"'}]
+    resp = client.post('/api/recording/upload/complete', json={
+        'projectName': 'P',
+        'uuid': 'u789',
+        'taskIndex': 2,
+        'uploads': {'recordedAudio': {'key': upload['key'], 'uploadId': upload['uploadId'], 'parts': parts}}
+    })
+    assert resp.status_code == 409
+    assert resp.get_json()['missingParts'] == [2, 3]
+    assert upload['key'] not in dummy_s3.storage
+
+    resp = client.post('/api/recording/upload/initiate', json={'projectName': 'P'})
+    assert resp.status_code == 400
+
+    # Missing or non-numeric sizes are rejected, not a server error
+    for info in ({'filename': 'audio.webm'}, {'filename': 'audio.webm', 'size': 'big'},
+                 {'filename': 'audio.webm', 'size': None}, {'filename': 'audio.webm', 'size': -1}, 'audio.webm'):
+        resp = client.post('/api/recording/upload/initiate', json={
+            'projectName': 'P', 'uuid': 'u789', 'taskIndex': 2, 'files': {'recordedAudio': info}})
+        assert resp.status_code == 400, info
+    resp = client.post('/api/recording/upload/initiate', json={
+        'projectName': 'P', 'uuid': 'u789', 'taskIndex': 2, 'files': ['audio.webm']})
+    assert resp.status_code == 400
+
+    # A bad file after a good one: no multipart upload is left behind
+    pending = dict(dummy_s3.uploads)
+    resp = client.post('/api/recording/upload/initiate', json={
+        'projectName': 'P', 'uuid': 'u789', 'taskIndex': 2,
+        'files': {'recordedScreen': {'filename': 'screen.webm', 'size': 1024},
+                  'recordedAudio': {'filename': 'audio.webm', 'size': 'big'}}})
+    assert resp.status_code == 400
+    assert dummy_s3.uploads == pending
+
+# Malformed completion requests are rejected, not a server error
+def test_presigned_upload_recording_4(client, dummy_s3):
+    resp = client.post('/api/recording/upload/initiate', json={
+        'projectName': 'P', 'uuid': 'u789', 'taskIndex': 2,
+        'files': {'recordedAudio': {'filename': 'audio.webm', 'size': 1024}}})
+    upload = resp.get_json()['uploads']['recordedAudio']
+    etag = dummy_s3.upload_part('test-bucket', upload['key'], upload['uploadId'], 1, b'part-1')['ETag']
+    key, upload_id = upload['key'], upload['uploadId']
+
+    for uploads in ([{'key': key, 'uploadId': upload_id}],
+                    {'recordedAudio': key},
+                    {'recordedAudio': {'key': key, 'parts': [{'partNumber': 1, 'etag': etag}]}},
+                    {'recordedAudio': {'key': key, 'uploadId': upload_id, 'parts': [{'etag': etag}]}},
+                    {'recordedAudio': {'key': key, 'uploadId': upload_id, 'parts': [{'partNumber': 1}]}},
+                    {'recordedAudio': {'key': key, 'uploadId': upload_id, 'parts': [{'partNumber': 'one', 'etag': etag}]}},
+                    {'recordedAudio': {'key': key, 'uploadId': upload_id, 'parts': ['1']}},
+                    {'recordedAudio': {'key': key, 'uploadId': upload_id, 'parts': {'1': etag}}},
+                    {'recordedAudio': {'key': 7, 'uploadId': upload_id, 'parts': [{'partNumber': 1, 'etag': etag}]}}):
+        resp = client.post('/api/recording/upload/complete', json={
+            'projectName': 'P', 'uuid': 'u789', 'taskIndex': 2, 'uploads': uploads})
+        assert resp.status_code == 400, uploads
+
+    resp = client.post('/api/recording/upload/complete', json={
+        'projectName': 'P', 'uuid': 'u789', 'taskIndex': 2,
+        'uploads': {'recordedAudio': {'key': key, 'uploadId': upload_id, 'parts': [{'partNumber': 1, 'etag': etag}]}}})
+    assert resp.status_code == 200
+
+def test_presigned_upload_recording_3(app, client, dummy_s3, tmp_path):
+    from work_queue import WorkQueue
+    app.config['WORK_QUEUE_PATH'] = str(tmp_path / 'queue.sqlite3')
+    app.config['WORK_QUEUES'] = ('analysis', 'preprocessing')
+
+    def upload_screen():
+        resp = client.post('/api/recording/upload/initiate', json={
+            'projectName': 'P', 'uuid': 'u321', 'taskIndex': 1,
+            'files': {'recordedScreen': {'filename': 'screen.webm', 'size': 11}}
+        })
+        upload = resp.get_json()['uploads']['recordedScreen']
+        etag = dummy_s3.upload_part('test-bucket', upload['key'], upload['uploadId'], 1, b'screen-data')['ETag']
+        return client.post('/api/recording/upload/complete', json={
+            'projectName': 'P', 'uuid': 'u321', 'taskIndex': 1,
+            'uploads': {'recordedScreen': {'key': upload['key'], 'uploadId': upload['uploadId'],
+                                           'parts': [{'partNumber': 1, 'etag': etag}]}}
+        }).get_json()
+
+    # Every pipeline's queue gets the new recording, once however often it is uploaded before processing
+    assert upload_screen()['queued'] == ['analysis', 'preprocessing']
+    upload_screen()
+    queue = WorkQueue(app.config['WORK_QUEUE_PATH'])
+    for name in ('analysis', 'preprocessing'):
+        assert queue.receive(name).body == 'recording_results/P/u321/task_1/screen.webm'
+        assert queue.receive(name) is None
+
+# Test for: /api/recording/get_recording
+def test_get_recording_1(client, dummy_s3):
+    video = bytes(range(256)) * 40
+    dummy_s3.storage['recording_results/P/u123/task_1/screen.webm'] = video
+    query = {'project': 'P', 'uuid': 'u123', 'task': '1', 'file': 'screen.webm'}
+
+    resp = client.get('/api/recording/get_recording', query_string=query)
+    assert resp.status_code == 200
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert resp.data == video
+
+    resp = client.get('/api/recording/get_recording', query_string=query, headers={'Range': 'bytes=100-199'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 100-199/{len(video)}'
+    assert resp.data == video[100:200]
+    assert dummy_s3.ranged_reads[-1] == 'bytes=100-199'
+
+    resp = client.get('/api/recording/get_recording', query_string=query, headers={'Range': f'bytes={len(video)}-'})
+    assert resp.status_code == 416
+
+    # Several ranges: the whole recording
+    resp = client.get('/api/recording/get_recording', query_string=query, headers={'Range': 'bytes=0-99,200-299'})
+    assert resp.status_code == 200
+    assert 'Content-Range' not in resp.headers
+    assert resp.data == video
+
+    resp = client.get('/api/recording/get_recording', query_string={**query, 'redirect': 1})
+    assert resp.status_code == 302
+
+    resp = client.get('/api/recording/get_recording', query_string={**query, 'task': '9'})
+    assert resp.status_code == 404
+    resp = client.get('/api/recording/get_recording', query_string={'project': 'P'})
+    assert resp.status_code == 400
+
+# Test for: /api/recording/delete_recording
+def test_delete_recording_1(client, dummy_s3):
+    for i in range(2500):
+        dummy_s3.storage[f'recording_results/Pilot/u{i % 5}/task_1/chunk_{i}.webm'] = b'x'
+    dummy_s3.storage['Output/Pilot/u0/task_1/scene1/mousecursor.png'] = b'png'
+    dummy_s3.storage['Output/Pilot/u1/task_1/scene1/mousecursor.png'] = b'png'
+    dummy_s3.storage['recording_results/Pilot2/u0/task_1/screen.webm'] = b'keep'
+
+    resp = client.delete('/api/recording/delete_recording', query_string={'project': 'Pilot', 'uuid': 'u0'})
+    assert resp.status_code == 200
+    lines = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert lines[-1]['status'] == 'success'
+    assert lines[-1]['deleted'] == 501
+    assert 'Output/Pilot/u1/task_1/scene1/mousecursor.png' in dummy_s3.storage
+
+    calls = dummy_s3.delete_calls
+    resp = client.delete('/api/recording/delete_recording', query_string={'project': 'Pilot'})
+    lines = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert lines[-1]['deleted'] == 2001
+    assert lines[-2]['status'] == 'progress'
+    assert dummy_s3.delete_calls - calls == 3
+    assert not any(k.startswith(('recording_results/Pilot/', 'Output/Pilot/')) for k in dummy_s3.storage)
+    assert 'recording_results/Pilot2/u0/task_1/screen.webm' in dummy_s3.storage
+
+    resp = client.delete('/api/recording/delete_recording', query_string={'project': 'Pilot', 'task': '1'})
+    assert resp.status_code == 400
+
+# Deleting a participant or a task has the analysis workers rebuild the project aggregates without it
+def test_delete_recording_2(app, client, dummy_s3, tmp_path):
+    from work_queue import WorkQueue
+    app.config['WORK_QUEUE_PATH'] = str(tmp_path / 'queue.sqlite3')
+    dummy_s3.storage['Output/Pilot/u0/task_1/scene1/mousecursor.npz'] = b'npz'
+
+    resp = client.delete('/api/recording/delete_recording', query_string={'project': 'Pilot', 'uuid': 'u0'})
+    assert json.loads(resp.data.decode().splitlines()[-1])['aggregate_rebuild'] is True
+    client.delete('/api/recording/delete_recording', query_string={'project': 'Pilot', 'uuid': 'u1', 'task': '2'})
+    resp = client.delete('/api/recording/delete_recording', query_string={'project': 'Pilot'})
+    assert 'aggregate_rebuild' not in json.loads(resp.data.decode().splitlines()[-1])
+
+    queue = WorkQueue(app.config['WORK_QUEUE_PATH'])
+    assert queue.receive('analysis').body == 'aggregate-rebuild:Pilot/'
+    assert queue.receive('analysis').body == 'aggregate-rebuild:Pilot/task_2'
+    assert queue.receive('analysis') is None
+
 ############################################################################
 
 # Test for: /api/visualization/get_project_list
 
 
-# Test for: /api/visualization/get_heatmap_list/<project_name>
\ No newline at end of file
+# Test for: /api/visualization/get_heatmap_list/<project_name>
+def test_get_heatmap_list_1(client, dummy_s3):
+    for uuid in ('u1', 'u2'):
+        for scene in range(1, 4):
+            prefix = f'Output/Gallery/{uuid}/task_1/scene{scene}/'
+            dummy_s3.storage[prefix + 'mousecursor.png'] = b'png'
+            dummy_s3.storage[prefix + 'keyboard.png'] = b'png'
+    dummy_s3.storage['Output/Gallery/u1/task_1/scene1/cursor_data.json'] = b'{}'
+
+    resp = client.get('/api/visualization/get_heatmap_list/Gallery', query_string={'limit': 5})
+    assert resp.status_code == 200
+    first = resp.get_json()
+    assert len(first['images']) == 5
+    assert first['nextCursor'] == first['images'][-1]['key']
+    assert not first['images'][0]['url'].startswith('https://cs14-2-recordingtool.s3.amazonaws.com/')
+
+    calls = dummy_s3.list_calls
+    resp = client.get('/api/visualization/get_heatmap_list/Gallery',
+                      query_string={'limit': 10, 'cursor': first['nextCursor']})
+    second = resp.get_json()
+    assert len(second['images']) == 7
+    assert second['nextCursor'] is None
+    assert dummy_s3.list_calls == calls
+    keys = [image['key'] for image in first['images'] + second['images']]
+    assert len(set(keys)) == 12
+
+    resp = client.get('/api/visualization/get_heatmap_list/Gallery', query_string={'session': 'u2', 'scene': '3'})
+    images = resp.get_json()['images']
+    assert sorted(image['name'] for image in images) == ['keyboard.png', 'mousecursor.png']
+    assert all(image['session'] == 'u2' and image['scene'] == 'scene3' for image in images)
+
+def test_get_heatmap_list_2(client, dummy_s3):
+    prefix = 'Output/Thumbs/u1/task_1/scene1/'
+    dummy_s3.storage[prefix + 'mousecursor.png'] = b'png'
+    dummy_s3.storage[prefix + 'mousecursor_thumb.webp'] = b'webp'
+    dummy_s3.storage[prefix + 'keyboard.png'] = b'png'
+
+    resp = client.get('/api/visualization/get_heatmap_list/Thumbs')
+    images = {image['name']: image for image in resp.get_json()['images']}
+    assert sorted(images) == ['keyboard.png', 'mousecursor.png']
+    assert 'mousecursor_thumb.webp' in images['mousecursor.png']['url']
+    assert images['mousecursor.png']['fullUrl'].split('?')[0].endswith('mousecursor.png')
+    assert images['keyboard.png']['url'] == images['keyboard.png']['fullUrl']
+
+# Test for: /api/visualization/get_cursor_trajectory/<project_name>
+def test_get_cursor_trajectory_1(client, dummy_s3, tmp_path, monkeypatch):
+    import app as backend_app
+    monkeypatch.setattr(backend_app, 'TRAJECTORY_CACHE_DIR', str(tmp_path))
+    trajectory = np.zeros(300, dtype=[('frame', '<i4'), ('time', '<f4'), ('x', '<i2'), ('y', '<i2'),
+                                      ('intensity', '<f4')])
+    trajectory['frame'] = np.arange(300)
+    trajectory['time'] = trajectory['frame'] / 30.0
+    trajectory['x'] = np.arange(300) * 2
+    buffer = io.BytesIO()
+    np.save(buffer, trajectory)
+    key = 'Output/Traj/u1/task_1/scene2/cursor_trajectory.npy'
+    dummy_s3.storage[key] = buffer.getvalue()
+
+    resp = client.get('/api/visualization/get_cursor_trajectory/Traj',
+                      query_string={'uuid': 'u1', 'task': '1', 'scene': '2', 'start': 1.0, 'end': 2.0})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['count'] == 31
+    assert data['frame'][0] == 30 and data['frame'][-1] == 60
+    assert data['x'][:2] == [60, 62]
+
+    # Later requests map the downloaded copy once S3 confirms it is current
+    not_modified = dummy_s3.not_modified
+    resp = client.get('/api/visualization/get_cursor_trajectory/Traj',
+                      query_string={'uuid': 'u1', 'task': '1', 'scene': 'scene2'})
+    assert resp.get_json()['count'] == 300
+    assert dummy_s3.not_modified == not_modified + 1
+
+    # A re-analyzed session replaces the cached copy, a deleted one is gone
+    buffer = io.BytesIO()
+    np.save(buffer, trajectory[:150])
+    dummy_s3.storage[key] = buffer.getvalue()
+    resp = client.get('/api/visualization/get_cursor_trajectory/Traj',
+                      query_string={'uuid': 'u1', 'task': '1', 'scene': 'scene2'})
+    assert resp.get_json()['count'] == 150
+    del dummy_s3.storage[key]
+    resp = client.get('/api/visualization/get_cursor_trajectory/Traj',
+                      query_string={'uuid': 'u1', 'task': '1', 'scene': 'scene2'})
+    assert resp.status_code == 404
+
+    resp = client.get('/api/visualization/get_cursor_trajectory/Traj', query_string={'uuid': 'u1'})
+    assert resp.status_code == 400
+
+# Test for: /api/visualization/timeline/<project_name>/cursor and /focus
+def test_timeline_1(app, client, dummy_s3, tmp_path, monkeypatch):
+    import app as backend_app
+    monkeypatch.setattr(backend_app, 'TRAJECTORY_CACHE_DIR', str(tmp_path))
+    app.config['TIMELINE_DB'] = str(tmp_path / 'timelines.sqlite3')
+    prefix = 'Output/Timeline/u1/task_2/'
+    for scene, frames in ((1, range(0, 150)), (2, range(150, 300))):
+        trajectory = np.zeros(len(frames), dtype=[('frame', '<i4'), ('time', '<f4'), ('x', '<i2'), ('y', '<i2'),
+                                                  ('intensity', '<f4')])
+        trajectory['frame'] = frames
+        trajectory['time'] = trajectory['frame'] / 30.0
+        trajectory['x'] = trajectory['frame']
+        trajectory['y'] = 100
+        focus = np.zeros(len(frames) // 10, dtype=[('frame', '<i4'), ('time', '<f4'), ('x', '<i2'), ('y', '<i2'),
+                                                   ('w', '<i2'), ('h', '<i2')])
+        focus['frame'] = list(frames)[::10]
+        focus['time'] = focus['frame'] / 30.0
+        focus['x'], focus['y'], focus['w'], focus['h'] = 40 * scene, 70, 260, 30
+        for name, array in (('cursor_trajectory.npy', trajectory), ('focus_boxes.npy', focus)):
+            buffer = io.BytesIO()
+            np.save(buffer, array)
+            dummy_s3.storage[f'{prefix}scene{scene}/{name}'] = buffer.getvalue()
+
+    resp = client.get('/api/visualization/timeline/Timeline/cursor',
+                      query_string={'uuid': 'u1', 'task': '2', 'start': 4.0, 'end': 6.0})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['count'] == data['total'] == 61
+    assert data['frame'][0] == 120 and data['frame'][-1] == 180
+    assert set(data['scene']) == {1, 2}
+
+    # Region queries; the session is only ingested once
+    calls = dummy_s3.list_calls
+    resp = client.get('/api/visualization/timeline/Timeline/cursor',
+                      query_string={'uuid': 'u1', 'task': '2', 'x0': 10, 'y0': 0, 'x1': 19, 'y1': 200})
+    assert resp.get_json()['frame'] == list(range(10, 20))
+    resp = client.get('/api/visualization/timeline/Timeline/cursor',
+                      query_string={'uuid': 'u1', 'task': '2', 'max_points': 30})
+    assert resp.get_json()['count'] == 30 and resp.get_json()['total'] == 300
+    assert dummy_s3.list_calls == calls
+
+    resp = client.get('/api/visualization/timeline/Timeline/focus',
+                      query_string={'uuid': 'u1', 'task': '2', 'start': 0.0, 'end': 6.0})
+    regions = resp.get_json()['regions']
+    assert [(region['x'], region['frames']) for region in regions] == [(40, 15), (80, 4)]
+    region = {'uuid': 'u1', 'task': '2', 'x0': 310, 'y0': 90, 'x1': 330, 'y1': 120}
+    resp = client.get('/api/visualization/timeline/Timeline/focus', query_string=region)
+    assert [region['x'] for region in resp.get_json()['regions']] == [80]
+    resp = client.get('/api/visualization/timeline/Timeline/focus', query_string=dict(region, scene='scene1'))
+    assert resp.get_json()['regions'] == []
+
+    # refresh=1 ingests the session again from the current trajectories
+    trajectory = np.load(io.BytesIO(dummy_s3.storage[f'{prefix}scene1/cursor_trajectory.npy']))
+    trajectory['y'] = 50
+    buffer = io.BytesIO()
+    np.save(buffer, trajectory)
+    dummy_s3.storage[f'{prefix}scene1/cursor_trajectory.npy'] = buffer.getvalue()
+    query = {'uuid': 'u1', 'task': '2', 'scene': '1', 'start': 1.0, 'end': 1.0}
+    assert client.get('/api/visualization/timeline/Timeline/cursor', query_string=query).get_json()['y'] == [100]
+    resp = client.get('/api/visualization/timeline/Timeline/cursor', query_string=dict(query, refresh=1))
+    assert resp.get_json()['y'] == [50]
+
+    resp = client.get('/api/visualization/timeline/Timeline/cursor', query_string={'uuid': 'u9', 'task': '2'})
+    assert resp.status_code == 404
+    resp = client.get('/api/visualization/timeline/Timeline/cursor',
+                      query_string={'uuid': 'u1', 'task': '2', 'x0': 1})
+    assert resp.status_code == 400
+
+# Thinned region queries keep every n-th matching position, however the cursor moved
+def test_timeline_store_thinning_1():
+    import timeline_store
+    conn = timeline_store.connect(':memory:')
+    trajectory = np.zeros(300, dtype=[('frame', '<i4'), ('time', '<f4'), ('x', '<i2'), ('y', '<i2'),
+                                      ('intensity', '<f4')])
+    trajectory['frame'] = np.arange(300)
+    trajectory['time'] = trajectory['frame'] / 30.0
+    # The cursor sweeps x from 0 to 19 again and again: frames 20k, 20k+1, 20k+2 are in the region
+    trajectory['x'] = trajectory['frame'] % 20
+    session = timeline_store.ingest_session(conn, 'P/u1/task_1', {1: (trajectory, None)})
+
+    rows, total = timeline_store.query_cursor(conn, session, region=(0, 0, 2, 10), max_points=9)
+    assert total == 45
+    assert [row[1] for row in rows] == [frame for frame in range(300) if frame % 20 <= 2][::5]
+
+# The S3 client is only created when it is first used
+def test_s3_client_1(dummy_s3):
+    from lazy_client import LazyClient
+    lazy = LazyClient('s3', region_name='test-region')
+    assert lazy._client is None
+    dummy_s3.storage['LazyClient/a.json'] = b'{}'
+    assert lazy.list_objects(Bucket='test-bucket', Prefix='LazyClient/')['Contents'] == [{'Key': 'LazyClient/a.json'}]
+    assert lazy.client() is dummy_s3
+    lazy.warm_up().join()
+    assert lazy.client() is dummy_s3
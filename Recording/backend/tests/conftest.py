@@ -11,6 +11,11 @@ import boto3
 class DummyS3:
     def __init__(self):
         self.storage = {}
+        self.uploads = {}
+        self.ranged_reads = []
+        self.list_calls = 0
+        self.delete_calls = 0
+        self.not_modified = 0
 
     def upload_fileobj(self, fileobj, Bucket, key):
         fileobj.seek(0)
@@ -29,16 +34,117 @@ class DummyS3:
         keys = [k for k in self.storage if k.startswith(Prefix)]
         return {'Contents': [{'Key': k} for k in keys]}
 
-    def get_object(self, Bucket, Key):
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None, MaxKeys=1000, ContinuationToken=None):
+        keys = sorted(k for k in self.storage if k.startswith(Prefix))
+        prefixes = []
+        if Delimiter:
+            grouped = []
+            for k in keys:
+                rest = k[len(Prefix):]
+                if Delimiter in rest:
+                    common = Prefix + rest.split(Delimiter)[0] + Delimiter
+                    if common not in prefixes:
+                        prefixes.append(common)
+                else:
+                    grouped.append(k)
+            keys = grouped
+        # Like S3, the continuation token marks a key position, so deleting listed keys is safe
+        remaining = [k for k in keys if ContinuationToken is None or k > ContinuationToken]
+        page = remaining[:MaxKeys]
+        response = {'Contents': [{'Key': k, 'ETag': self.etag(k)} for k in page], 'KeyCount': len(page),
+                    'IsTruncated': len(remaining) > MaxKeys}
+        if prefixes:
+            response['CommonPrefixes'] = [{'Prefix': p} for p in prefixes]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        self.list_calls += 1
+        return response
+
+    def get_paginator(self, operation):
+        dummy = self
+
+        class Paginator:
+            def paginate(self, PaginationConfig=None, **kwargs):
+                page_size = (PaginationConfig or {}).get('PageSize', 1000)
+                token = None
+                while True:
+                    page = getattr(dummy, operation)(MaxKeys=page_size, ContinuationToken=token, **kwargs)
+                    yield page
+                    if not page['IsTruncated']:
+                        return
+                    token = page['NextContinuationToken']
+
+        return Paginator()
+
+    def delete_objects(self, Bucket, Delete):
+        assert len(Delete['Objects']) <= 1000
+        for obj in Delete['Objects']:
+            self.storage.pop(obj['Key'], None)
+        self.delete_calls += 1
+        return {}
+
+    def etag(self, key):
+        import hashlib
+        return f'"{hashlib.md5(self.storage[key]).hexdigest()}"'
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None):
         import io
+        from botocore.exceptions import ClientError
         data = self.storage.get(Key)
         if data is None:
-            raise KeyError(f"{Key} not found in DummyS3")
-        return {'Body': io.BytesIO(data)}
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+        if IfNoneMatch == self.etag(Key):
+            self.not_modified += 1
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1]
+        self.ranged_reads.append(Range)
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ETag': self.etag(Key)}
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        if Key not in self.storage:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ContentLength': len(self.storage[Key]), 'ContentType': 'video/webm'}
 
     def delete_object(self, Bucket, Key):
         self.storage.pop(Key, None)
 
+    # Multipart uploads: upload_part stands in for the browser's PUT to a presigned URL
+    def create_multipart_upload(self, Bucket, Key, ContentType=None):
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {'Key': Key, 'Parts': {}}
+        return {'UploadId': upload_id}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600):
+        params = Params or {}
+        query = '&'.join(f"{k}={v}" for k, v in params.items() if k not in ('Bucket', 'Key'))
+        return f"https://dummy-s3/{params.get('Key', '')}?method={ClientMethod}&{query}"
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        import hashlib
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        self.uploads[UploadId]['Parts'][PartNumber] = (etag, Body)
+        return {'ETag': etag}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0, MaxParts=1000):
+        parts = self.uploads[UploadId]['Parts']
+        numbers = sorted(n for n in parts if n > PartNumberMarker)
+        page = numbers[:MaxParts]
+        response = {'Parts': [{'PartNumber': n, 'ETag': parts[n][0]} for n in page],
+                    'IsTruncated': len(numbers) > MaxParts}
+        if response['IsTruncated']:
+            response['NextPartNumberMarker'] = page[-1]
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)['Parts']
+        self.storage[Key] = b''.join(parts[p['PartNumber']][1] for p in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
 _dummy_s3 = DummyS3()
 boto3.client = lambda *args, **kwargs: _dummy_s3
 
@@ -53,3 +159,7 @@ def s3_bucket_env():
 @pytest.fixture
 def app():
     return create_app(config_name='testing')
+
+@pytest.fixture
+def dummy_s3():
+    return _dummy_s3
@@ -0,0 +1,178 @@
+import sqlite3
+import time
+
+# Cursor positions and keyboard focus boxes of every ingested session. Both
+# tables are clustered on (session, time), so a time range of one session is
+# a single contiguous index range scan.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    ingested_at REAL NOT NULL,
+    cursor_rows INTEGER NOT NULL,
+    focus_rows INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cursor (
+    session_id INTEGER NOT NULL,
+    time REAL NOT NULL,
+    frame INTEGER NOT NULL,
+    scene INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    intensity REAL NOT NULL,
+    PRIMARY KEY (session_id, time, frame)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS focus (
+    session_id INTEGER NOT NULL,
+    time REAL NOT NULL,
+    frame INTEGER NOT NULL,
+    scene INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    w INTEGER NOT NULL,
+    h INTEGER NOT NULL,
+    PRIMARY KEY (session_id, time, frame, x, y, w, h)
+) WITHOUT ROWID;
+"""
+
+
+def connect(path):
+    """Open (and create if needed) a timeline store."""
+    conn = sqlite3.connect(path, timeout=30)
+    # WAL lets request threads read while a session is being ingested
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def session_id(conn, name):
+    """Row id of an ingested session, or None if it has not been ingested."""
+    row = conn.execute('SELECT id FROM sessions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+def ingest_session(conn, name, scenes):
+    """
+    Replace the timelines of one session
+
+    Args:
+        conn: Store connection
+        name: Session name, e.g. <project>/<uuid>/task_N
+        scenes: Dict mapping scene number to (cursor trajectory, focus boxes);
+                either may be None. Trajectories are structured arrays with
+                frame, time, x, y, intensity fields, focus boxes with frame,
+                time, x, y, w, h (see analysis/trajectory.py)
+
+    Returns:
+        The session's row id
+    """
+    cursor_rows = focus_rows = 0
+    with conn:
+        old_id = session_id(conn, name)
+        if old_id is not None:
+            conn.execute('DELETE FROM cursor WHERE session_id = ?', (old_id,))
+            conn.execute('DELETE FROM focus WHERE session_id = ?', (old_id,))
+            conn.execute('DELETE FROM sessions WHERE id = ?', (old_id,))
+        new_id = conn.execute('INSERT INTO sessions (name, ingested_at, cursor_rows, focus_rows) VALUES (?, ?, 0, 0)',
+                              (name, time.time())).lastrowid
+        for scene, (trajectory, focus_boxes) in scenes.items():
+            if trajectory is not None and len(trajectory):
+                conn.executemany(
+                    'INSERT OR REPLACE INTO cursor VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    ((new_id, t, frame, scene, x, y, intensity) for frame, t, x, y, intensity in zip(
+                        trajectory['frame'].tolist(), trajectory['time'].tolist(), trajectory['x'].tolist(),
+                        trajectory['y'].tolist(), trajectory['intensity'].tolist()))
+                )
+                cursor_rows += len(trajectory)
+            if focus_boxes is not None and len(focus_boxes):
+                conn.executemany(
+                    'INSERT OR IGNORE INTO focus VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    ((new_id, t, frame, scene, x, y, w, h) for frame, t, x, y, w, h in zip(
+                        focus_boxes['frame'].tolist(), focus_boxes['time'].tolist(), focus_boxes['x'].tolist(),
+                        focus_boxes['y'].tolist(), focus_boxes['w'].tolist(), focus_boxes['h'].tolist()))
+                )
+                focus_rows += len(focus_boxes)
+        conn.execute('UPDATE sessions SET cursor_rows = ?, focus_rows = ? WHERE id = ?',
+                     (cursor_rows, focus_rows, new_id))
+    return new_id
+
+
+def _time_filter(session, start, end, scene):
+    clauses, params = ['session_id = ?'], [session]
+    if start is not None:
+        clauses.append('time >= ?')
+        params.append(start)
+    if end is not None:
+        clauses.append('time <= ?')
+        params.append(end)
+    if scene is not None:
+        clauses.append('scene = ?')
+        params.append(scene)
+    return clauses, params
+
+
+def query_cursor(conn, session, start=None, end=None, region=None, scene=None, max_points=None):
+    """
+    Cursor positions of a session in a time range, optionally inside a region
+
+    Args:
+        conn: Store connection
+        session: Session row id
+        start: First time in seconds (None for the start of the session)
+        end: Last time in seconds (None for the end of the session)
+        region: Optional (x0, y0, x1, y1) rectangle the cursor must be in
+        scene: Optional scene number
+        max_points: Return at most about this many positions, evenly spaced in time
+
+    Returns:
+        (rows, total): rows of (time, frame, scene, x, y, intensity) in time
+        order, and the number of matching positions before thinning
+    """
+    clauses, params = _time_filter(session, start, end, scene)
+    if region is not None:
+        clauses.append('x BETWEEN ? AND ? AND y BETWEEN ? AND ?')
+        params += [region[0], region[2], region[1], region[3]]
+    where = ' AND '.join(clauses)
+    total = conn.execute(f'SELECT COUNT(*) FROM cursor WHERE {where}', params).fetchone()[0]
+    if max_points and total > max_points:
+        # Every step-th of the matching positions: numbering them after the
+        # filters keeps the spacing even when a region or scene leaves gaps
+        rows = conn.execute(
+            'SELECT time, frame, scene, x, y, intensity FROM ('
+            '  SELECT time, frame, scene, x, y, intensity, ROW_NUMBER() OVER (ORDER BY time, frame) - 1 AS n'
+            f'  FROM cursor WHERE {where}'
+            ') WHERE n % ? = 0 ORDER BY time',
+            params + [-(-total // max_points)]).fetchall()
+    else:
+        rows = conn.execute(f'SELECT time, frame, scene, x, y, intensity FROM cursor WHERE {where} ORDER BY time',
+                            params).fetchall()
+    return rows, total
+
+
+def query_focus_regions(conn, session, start=None, end=None, region=None, scene=None):
+    """
+    Keyboard focus regions of a session in a time range, optionally overlapping a region
+
+    Args:
+        conn: Store connection
+        session: Session row id
+        start: First time in seconds (None for the start of the session)
+        end: Last time in seconds (None for the end of the session)
+        region: Optional (x0, y0, x1, y1) rectangle the focus boxes must overlap
+        scene: Optional scene number
+
+    Returns:
+        Rows of (x, y, w, h, frames, first_time, last_time), one per distinct
+        focus box, most frequent first
+    """
+    clauses, params = _time_filter(session, start, end, scene)
+    if region is not None:
+        clauses.append('x <= ? AND x + w >= ? AND y <= ? AND y + h >= ?')
+        params += [region[2], region[0], region[3], region[1]]
+    where = ' AND '.join(clauses)
+    return conn.execute(
+        f'SELECT x, y, w, h, COUNT(DISTINCT frame), MIN(time), MAX(time) FROM focus WHERE {where} '
+        'GROUP BY x, y, w, h ORDER BY COUNT(DISTINCT frame) DESC, MIN(time)',
+        params
+    ).fetchall()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+
+import numpy as np
+
+from screen_hash import screen_signature
+
+# Raw heatmap accumulators are written next to the rendered heatmaps as
+# sceneN/<kind><ACCUMULATOR_SUFFIX>, so sessions can later be summed into
+# project-level aggregates (see aggregate.py) without decoding any video
+ACCUMULATOR_SUFFIX = '.npz'
+ACCUMULATOR_VERSION = 1
+# Heatmaps are stored as float16 scaled so their peak lands here: float16
+# keeps about three significant digits, plenty for a heatmap, and scaling
+# keeps long sessions' sums from overflowing its range (65504)
+FLOAT16_PEAK = 60000.0
+
+
+def accumulator_path(scene_folder, kind):
+    """Path of the accumulator of one heatmap kind in a scene folder."""
+    return os.path.join(scene_folder, kind + ACCUMULATOR_SUFFIX)
+
+
+def save_accumulator(path, heatmap_data, background, frames, sessions=1, session_ids=()):
+    """
+    Save an unnormalized heatmap with everything needed to align and render it later
+
+    The alignment key is the frame size plus the screen signature (perceptual
+    hash and thumbnail, see screen_hash.py) of the background, so the same
+    screen seen by different participants can be matched.
+
+    Args:
+        heatmap_data: float32 heatmap (sum over every accumulated frame)
+        background: Background frame the heatmap is rendered over (BGR or grayscale)
+        frames: Number of video frames accumulated into the heatmap
+        sessions: Number of sessions summed into the heatmap
+        session_ids: Ids of the sessions summed into an aggregate heatmap, stored
+                     in the same file so a merge is recorded with its result
+
+    Returns:
+        path
+    """
+    peak = float(heatmap_data.max()) if heatmap_data.size else 0.0
+    scale = peak / FLOAT16_PEAK if peak > 0 else 1.0
+    screen_hash, thumbnail = screen_signature(background)
+
+    # np.savez adds .npz to names without it, so the temporary name keeps the suffix
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        version=np.int64(ACCUMULATOR_VERSION),
+        heatmap=(heatmap_data / scale).astype(np.float16),
+        scale=np.float64(scale),
+        background=background,
+        frame_size=np.array(heatmap_data.shape[:2], dtype=np.int64),
+        screen_hash=np.uint64(screen_hash),
+        thumbnail=thumbnail,
+        frames=np.int64(frames),
+        sessions=np.int64(sessions),
+        session_ids=np.array(list(session_ids), dtype=str)
+    )
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_accumulator(path, heatmap=True):
+    """
+    Load an accumulator written by save_accumulator
+
+    Args:
+        path: Path to the .npz file
+        heatmap: Also decompress the heatmap and background (False reads only
+                 the alignment key and counters)
+
+    Returns:
+        Dict with frame_size, signature, frames, sessions and session_ids
+        (plus heatmap as float32 and background), or None if the file is
+        missing or was written by another format version
+    """
+    try:
+        with np.load(path) as data:
+            if int(data['version']) != ACCUMULATOR_VERSION:
+                print(f"Warning: Skipping {path}, accumulator version {int(data['version'])}")
+                return None
+            accumulator = {
+                'frame_size': tuple(int(v) for v in data['frame_size']),
+                'signature': (int(data['screen_hash']), data['thumbnail']),
+                'frames': int(data['frames']),
+                'sessions': int(data['sessions']),
+                'session_ids': tuple(str(i) for i in data['session_ids']) if 'session_ids' in data.files else ()
+            }
+            if heatmap:
+                accumulator['heatmap'] = data['heatmap'].astype(np.float32) * np.float32(data['scale'])
+                accumulator['background'] = data['background']
+    except (OSError, KeyError, ValueError):
+        return None
+    return accumulator
+
+
+def merge_accumulators(total, accumulator):
+    """
+    Add one accumulator into a running total (the total keeps its own background)
+
+    Sessions are counted by id where the accumulators have ids, so several
+    scenes of one session that show the same screen count as one session.
+
+    Args:
+        total: Accumulator dict from load_accumulator, or None for an empty total
+        accumulator: Accumulator dict from load_accumulator with the same frame size
+
+    Returns:
+        The merged accumulator dict
+    """
+    if total is None:
+        return dict(accumulator)
+    if total['frame_size'] != accumulator['frame_size']:
+        raise ValueError(f"Cannot merge a {accumulator['frame_size']} heatmap into a {total['frame_size']} one")
+    merged = dict(total)
+    merged['heatmap'] = total['heatmap'] + accumulator['heatmap']
+    merged['frames'] = total['frames'] + accumulator['frames']
+    new_ids = [i for i in accumulator['session_ids'] if i not in total['session_ids']]
+    merged['session_ids'] = total['session_ids'] + tuple(new_ids)
+    merged['sessions'] = total['sessions'] + (len(new_ids) if accumulator['session_ids'] else accumulator['sessions'])
+    return merged
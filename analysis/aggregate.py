@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import getpass
+import json
+import os
+import re
+import shutil
+import sys
+from datetime import datetime
+
+from accumulators import accumulator_path, load_accumulator, merge_accumulators, save_accumulator
+from analyse_m_s import (SCENE_HEATMAP_KINDS, render_keyboard_focus_heatmap, render_mouse_cursor_heatmap,
+                         save_thumbnail)
+from screen_hash import SCREEN_HASH_MAX_DISTANCE, hash_distance, same_screen
+
+# A project aggregate folder holds AGGREGATE_INDEX plus one sceneN folder per
+# distinct screen with the summed accumulators and their rendered heatmaps
+AGGREGATE_INDEX = 'aggregate.json'
+AGGREGATE_VERSION = 1
+
+
+def load_aggregate_index(aggregate_dir):
+    """
+    Read the index of a project aggregate
+
+    Args:
+        aggregate_dir: Aggregate folder (it may not exist yet)
+
+    Returns:
+        Dict with the merged session ids and one entry per aggregate screen
+    """
+    try:
+        with open(os.path.join(aggregate_dir, AGGREGATE_INDEX)) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {'version': AGGREGATE_VERSION, 'sessions': [], 'screens': []}
+    if index.get('version') != AGGREGATE_VERSION:
+        raise ValueError(f"Unsupported aggregate version {index.get('version')} in {aggregate_dir}")
+    return index
+
+
+def write_aggregate_index(aggregate_dir, index):
+    """Atomically replace the index of a project aggregate."""
+    path = os.path.join(aggregate_dir, AGGREGATE_INDEX)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def find_aggregate_screen(aggregate_dir, index, accumulator):
+    """
+    Find the aggregate screen a session accumulator belongs to
+
+    Screens must have the same frame size and matching signatures (see
+    screen_hash.same_screen). The hash stored in the index rules out most
+    screens before any accumulator is opened.
+
+    Returns:
+        The screen's index entry, or None for a screen not seen before
+    """
+    screen_hash = accumulator['signature'][0]
+    for screen in index['screens']:
+        if tuple(screen['frame_size']) != accumulator['frame_size']:
+            continue
+        if hash_distance(int(screen['screen_hash'], 16), screen_hash) > SCREEN_HASH_MAX_DISTANCE:
+            continue
+        for kind in screen['frames']:
+            stored = load_accumulator(accumulator_path(os.path.join(aggregate_dir, screen['scene']), kind),
+                                      heatmap=False)
+            if stored is not None:
+                if same_screen(stored['signature'], accumulator['signature']):
+                    return screen
+                break
+    return None
+
+
+def candidate_screens(index, session_dir):
+    """
+    Aggregate screens a session may be merged into, judged from the index alone
+
+    A screen is a candidate when it has the frame size and a perceptual hash
+    close to the background of one of the session's scenes. Only the
+    accumulators of these screens are needed to merge the session (see
+    find_aggregate_screen), so a remote aggregate can be fetched in part.
+
+    Returns:
+        List of index entries of the screens
+    """
+    signatures = []
+    for scene_folder in session_scene_folders(session_dir):
+        for kind in SCENE_HEATMAP_KINDS:
+            accumulator = load_accumulator(accumulator_path(scene_folder, kind), heatmap=False)
+            if accumulator is not None:
+                signatures.append((accumulator['frame_size'], accumulator['signature'][0]))
+                break
+    return [screen for screen in index['screens']
+            if any(tuple(screen['frame_size']) == frame_size
+                   and hash_distance(int(screen['screen_hash'], 16), screen_hash) <= SCREEN_HASH_MAX_DISTANCE
+                   for frame_size, screen_hash in signatures)]
+
+
+def session_scene_folders(session_dir):
+    """sceneN folders of a session output folder, in scene order."""
+    folders = [name for name in os.listdir(session_dir)
+               if re.fullmatch(r'scene\d+', name) and os.path.isdir(os.path.join(session_dir, name))]
+    return [os.path.join(session_dir, name) for name in sorted(folders, key=lambda name: int(name[5:]))]
+
+
+def update_project_aggregate(aggregate_dir, session_dir, session_id, timestamp, user):
+    """
+    Add one analyzed session to a project aggregate
+
+    Only the session's own accumulators and the aggregate's running totals
+    of the screens it visited are read, so the cost does not grow with the
+    number of sessions already merged and no video is decoded. Every total
+    stores the ids of the sessions merged into it, so merging the same
+    session twice is a no-op, even when an earlier merge stopped after
+    writing some totals but before the index, which is written last.
+
+    Args:
+        aggregate_dir: Aggregate folder (created if needed)
+        session_dir: Output folder of process_video_with_scenes for the session
+        session_id: Unique id of the session, e.g. <project>/<uuid>/task_N
+        timestamp: Current timestamp string
+        user: Current username
+
+    Returns:
+        List of the aggregate sceneN folders that changed (empty if the session was already merged)
+    """
+    os.makedirs(aggregate_dir, exist_ok=True)
+    index = load_aggregate_index(aggregate_dir)
+    if session_id in index['sessions']:
+        print(f"Session {session_id} is already in the aggregate, skipping")
+        return []
+
+    # {aggregate folder: (index entry, {kind: merged accumulator})}
+    totals = {}
+    # (folder, kind) totals that already held the session before this merge
+    merged_before = set()
+    for scene_folder in session_scene_folders(session_dir):
+        accumulators = {}
+        for kind in SCENE_HEATMAP_KINDS:
+            accumulator = load_accumulator(accumulator_path(scene_folder, kind))
+            if accumulator is not None:
+                accumulators[kind] = accumulator
+        if not accumulators:
+            print(f"No accumulators in {scene_folder}, skipping")
+            continue
+
+        first = next(iter(accumulators.values()))
+        screen = find_aggregate_screen(aggregate_dir, index, first)
+        if screen is None:
+            screen = {
+                'scene': new_screen_folder(aggregate_dir, index),
+                'frame_size': list(first['frame_size']),
+                'screen_hash': f"{first['signature'][0]:016x}",
+                'sessions': 0,
+                'frames': {},
+                'images': {}
+            }
+            index['screens'].append(screen)
+        folder = os.path.join(aggregate_dir, screen['scene'])
+        os.makedirs(folder, exist_ok=True)
+        totals.setdefault(folder, (screen, {}))
+
+        for kind, accumulator in accumulators.items():
+            path = accumulator_path(folder, kind)
+            stored = load_accumulator(path)
+            if kind not in totals[folder][1] and stored is not None and session_id in stored['session_ids']:
+                merged_before.add((folder, kind))
+            if (folder, kind) in merged_before:
+                totals[folder][1][kind] = stored
+                continue
+            # A session counts once per screen, even if several of its scenes matched it
+            accumulator['session_ids'] = (session_id,)
+            total = merge_accumulators(stored, accumulator)
+            save_accumulator(path, total['heatmap'], total['background'], total['frames'], total['sessions'],
+                             total['session_ids'])
+            totals[folder][1][kind] = total
+        print(f"Merged {os.path.basename(scene_folder)} of {session_id} into aggregate {screen['scene']}")
+
+    for folder, (screen, kinds) in totals.items():
+        screen['sessions'] = max(total['sessions'] for total in kinds.values())
+        screen['frames'].update({kind: total['frames'] for kind, total in kinds.items()})
+        for kind, total in kinds.items():
+            image = render_aggregate_heatmap(kind, total, folder, screen['sessions'], timestamp, user)
+            screen['images'][kind] = {key: os.path.relpath(value, aggregate_dir).replace(os.sep, '/')
+                                      for key, value in image.items() if key in ('full', 'thumbnail')}
+
+    index['sessions'].append(session_id)
+    write_aggregate_index(aggregate_dir, index)
+    return list(totals)
+
+
+def new_screen_folder(aggregate_dir, index):
+    """Name of the folder of a new aggregate screen: the next sceneN not in the index or on disk."""
+    used = {screen['scene'] for screen in index['screens']}
+    n = len(index['screens']) + 1
+    while f"scene{n}" in used or os.path.exists(os.path.join(aggregate_dir, f"scene{n}")):
+        n += 1
+    return f"scene{n}"
+
+
+def rebuild_project_aggregate(aggregate_dir, sessions, timestamp, user):
+    """
+    Build a project aggregate from scratch, e.g. after a session was deleted
+
+    Merged totals cannot give a deleted session's heatmaps back exactly (they
+    are stored as float16), so the remaining sessions are summed again from
+    their own accumulators; this costs one merge per remaining session.
+
+    Args:
+        aggregate_dir: Aggregate folder (its contents are replaced)
+        sessions: (session_dir, session_id) pairs of the remaining sessions
+        timestamp: Current timestamp string
+        user: Current username
+
+    Returns:
+        The new index
+    """
+    shutil.rmtree(aggregate_dir, ignore_errors=True)
+    os.makedirs(aggregate_dir)
+    for session_dir, session_id in sessions:
+        update_project_aggregate(aggregate_dir, session_dir, session_id, timestamp, user)
+    index = load_aggregate_index(aggregate_dir)
+    write_aggregate_index(aggregate_dir, index)
+    return index
+
+
+def render_aggregate_heatmap(kind, total, folder, sessions, timestamp, user):
+    """
+    Render a project-level heatmap over the background of the first session that showed the screen
+
+    Returns:
+        save_thumbnail() result
+    """
+    if kind == 'mousecursor':
+        path = render_mouse_cursor_heatmap(total['heatmap'], total['background'], folder, timestamp, user)
+    else:
+        path = render_keyboard_focus_heatmap(total['heatmap'], total['background'], folder,
+                                             f"{sessions} sessions, {total['frames']} frames", timestamp, user)
+    return save_thumbnail(path)
+
+
+def main():
+    """Merge session output folders into a project aggregate: aggregate.py AGGREGATE_DIR SESSION_DIR..."""
+    if len(sys.argv) < 3:
+        print("Usage: aggregate.py AGGREGATE_DIR SESSION_DIR [SESSION_DIR...]")
+        sys.exit(1)
+    aggregate_dir = sys.argv[1]
+    timestamp = datetime.utcnow().strftime("%Y-%m-%d")
+    user = getpass.getuser()
+    for session_dir in sys.argv[2:]:
+        update_project_aggregate(aggregate_dir, session_dir, os.path.abspath(session_dir), timestamp, user)
+
+
+if __name__ == "__main__":
+    main()
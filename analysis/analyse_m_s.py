@@ -11,10 +11,34 @@ import time
 import cv2
 import numpy as np
 import os
-import matplotlib.pyplot as plt
 from datetime import datetime
 import json
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from accumulators import accumulator_path, save_accumulator
+from cursor_tracker import CursorHeatTracker
+from frame_ring import RingClosed, SharedFrameRing
+from heatmap_render import render_colorbar_heatmap, render_overlay_heatmap
+import common_path  # puts ../common (shared modules) on the import path
+from instrumentation import current_span, span
+from scene_scores import load_scene_scores, segment_scene_scores, write_scene_boundaries
+from screen_hash import group_screens, screen_signature
+from trajectory import (CURSOR_JSON_EXPORT, FOCUS_BOX_DTYPE, FOCUS_BOXES_FILENAME, TRAJECTORY_FILENAME,
+                        TrajectoryBuilder, export_trajectory_json, focus_box_records, save_trajectory)
+from frame_source import (PrefetchStats, get_video_properties, iter_color_frames, iter_gray_frames,
+                          read_color_frame, read_gray_frame)
+
+
+# Gallery thumbnails written next to every heatmap image
+THUMBNAIL_MAX_WIDTH = 320
+THUMBNAIL_QUALITY = 80
+
+# How process_video_with_scenes runs the per-scene heatmap analyzers:
+# 'serial' runs them one after another, each decoding the scene itself;
+# 'shared_memory' decodes the video once into a shared-memory frame ring and
+# runs every analyzer in its own process on that ring
+EXECUTION_MODE = os.environ.get('ANALYSIS_EXECUTION_MODE', 'serial')
+SCENE_HEATMAP_KINDS = ('mousecursor', 'keyboard')
 
 
 # In[ ]:
@@ -24,6 +48,9 @@ def detect_scene_changes(video_path, threshold=22.0, min_scene_duration=100):
     """
     Detect scene changes in a video using frame differencing.
     
+    The per-frame scores are cached next to the video (see scene_scores.py),
+    so later runs with other parameters do not decode the video again.
+    
     Args:
         video_path: Path to the video file
         threshold: Threshold for scene change detection (higher = fewer scenes)
@@ -32,83 +59,28 @@ def detect_scene_changes(video_path, threshold=22.0, min_scene_duration=100):
     Returns:
         List of scene boundaries [(start_frame, end_frame), ...]
     """
-    # Initialize video capture
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
+    # Get video properties
+    properties = get_video_properties(video_path)
+    if properties is None:
         print(f"Error: Could not open video at {video_path}")
         return []
-    
-    # Get video properties
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = properties['total_frames']
+    fps = properties['fps']
     
     print(f"Scene detection: analyzing {total_frames} frames, FPS: {fps}")
     
-    # Variables for scene detection
-    scene_boundaries = []
-    scene_scores = []
-    current_scene_start = 0
-    
-    # Read first frame
-    ret, prev_frame = cap.read()
-    if not ret:
+    # Difference between every pair of consecutive frames
+    scene_scores = load_scene_scores(video_path)
+    if scene_scores is None:
         print("Error: Failed to read the first frame")
-        cap.release()
         return []
     
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    frame_count = 1
-    
-    # Process frames
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            # Add the final scene boundary
-            if frame_count - current_scene_start >= min_scene_duration:
-                scene_boundaries.append((current_scene_start, frame_count - 1))
-            break
-            
-        # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Calculate absolute difference and mean
-        frame_diff = cv2.absdiff(gray, prev_gray)
-        mean_diff = np.mean(frame_diff)
-        scene_scores.append(mean_diff)
-        
-        # Detect scene change
-        if mean_diff > threshold and frame_count - current_scene_start >= min_scene_duration:
-            scene_boundaries.append((current_scene_start, frame_count - 1))
-            current_scene_start = frame_count
-            
-        # Update for next iteration
-        prev_gray = gray
-        frame_count += 1
-        
-        # Show progress
-        if frame_count % 100 == 0:
-            print(f"Scene detection: processed {frame_count}/{total_frames} frames ({frame_count/total_frames*100:.1f}%)")
-    
-    # Release resources
-    cap.release()
+    # Split into scenes; the final scene must also be long enough
+    scene_boundaries = segment_scene_scores(scene_scores, threshold, min_scene_duration,
+                                            min_final_duration=min_scene_duration)
     
     print(f"Scene detection complete. Found {len(scene_boundaries)} scenes.")
     
-    # Plot the scene scores for visualization
-    plt.figure(figsize=(12, 4))
-    plt.plot(scene_scores)
-    plt.axhline(y=threshold, color='r', linestyle='-', label=f'Threshold ({threshold})')
-    plt.title('Scene Change Detection Scores')
-    plt.xlabel('Frame Number')
-    plt.ylabel('Difference Score')
-    plt.legend()
-    
-    # Mark scene boundaries
-    for start, end in scene_boundaries:
-        plt.axvline(x=start, color='g', linestyle='--', alpha=0.5)
-    
-    plt.tight_layout()
-    
     return scene_boundaries
 
 # =======================
@@ -149,17 +121,44 @@ def scene_process_frame_difference(background_frame, gray_frame, fgbg):
     return fg_mask_thresh
 
 
-def scene_find_valid_contours(contours, min_area=100):
-    """Filter contours based on minimum area."""
-    return [contour for contour in contours if cv2.contourArea(contour) > min_area]
+def scene_find_valid_regions(fg_mask_thresh, min_area=100):
+    """
+    Find the outer contours of the foreground and keep those enclosing more than min_area.
+    
+    Only external contours are taken (RETR_EXTERNAL), so a region's area is
+    the area its outline encloses: a hollow focus ring counts with its
+    interior, and anything nested inside a region is part of that region.
+    
+    Returns:
+        (boxes, areas): int array of (x, y, w, h) bounding boxes and float array of contour areas
+    """
+    contours, _ = cv2.findContours(fg_mask_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    areas = np.array([cv2.contourArea(contour) for contour in contours], dtype=np.float64)
+    valid = np.flatnonzero(areas > min_area)
+    boxes = np.array([cv2.boundingRect(contours[i]) for i in valid], dtype=np.int32).reshape(-1, 4)
+    return boxes, areas[valid]
+
+
+def scene_create_box_accumulator(frame_height, frame_width):
+    """Create the 2-D difference array that collects heatmap rectangles."""
+    return np.zeros((frame_height + 1, frame_width + 1), dtype=np.int32)
 
 
-def scene_draw_bounding_boxes(frame, contours, heatmap_data):
-    """Draw bounding boxes around contours and update heatmap."""
-    for contour in contours:
-        x, y, w, h = cv2.boundingRect(contour)
-        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        heatmap_data[y:y+h, x:x+w] += 1  # Accumulate motion in heatmap
+def scene_accumulate_boxes(box_accumulator, boxes):
+    """Add +1 over every (x, y, w, h) box by touching only the four corners of each."""
+    if len(boxes) == 0:
+        return
+    x, y, w, h = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    np.add.at(box_accumulator, (y, x), 1)
+    np.add.at(box_accumulator, (y, x + w), -1)
+    np.add.at(box_accumulator, (y + h, x), -1)
+    np.add.at(box_accumulator, (y + h, x + w), 1)
+
+
+def scene_integrate_boxes(box_accumulator):
+    """Integrate the difference array into the per-pixel heatmap (once per scene)."""
+    heatmap_data = box_accumulator.cumsum(axis=0).cumsum(axis=1)[:-1, :-1]
+    return heatmap_data.astype(np.float32)
 
 def process_video_with_scene_detection(video_path, output_base_dir, video_name=None, 
                                       scene_threshold=30.0, min_scene_duration=10):
@@ -193,14 +192,7 @@ def process_video_with_scene_detection(video_path, output_base_dir, video_name=N
     os.makedirs(scenes_dir, exist_ok=True)
     
     scenes_data_path = os.path.join(scenes_dir, "scene_boundaries.json")
-    with open(scenes_data_path, 'w') as f:
-        json.dump({
-            'video_info': {
-                'path': video_path,
-                'total_scenes': len(scene_boundaries)
-            },
-            'scene_boundaries': [{"start_frame": start, "end_frame": end} for start, end in scene_boundaries]
-        }, f, indent=2)
+    write_scene_boundaries(scenes_data_path, video_path, scene_threshold, min_scene_duration, scene_boundaries)
     
     # Get video info for timing calculations
     cap = cv2.VideoCapture(video_path)
@@ -273,48 +265,38 @@ def process_scene_mouse_cursor(video_path, output_dir, start_frame, end_frame):
         start_frame: First frame of the scene
         end_frame: Last frame of the scene
     """
-    # Initialize video capture
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
+    # Get video properties
+    properties = get_video_properties(video_path)
+    if properties is None:
         print(f"Error: Could not open video at {video_path}")
         return None
-    
-    # Get video properties
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_width, frame_height = properties['width'], properties['height']
+    fps = properties['fps']
     
     # Initialize variables for cursor tracking
-    cursor_positions = []
-    heat_map = np.zeros((frame_height, frame_width), dtype=np.float32)
+    cursor_positions = TrajectoryBuilder(end_frame - start_frame + 1)
     
     # Parameters
     diff_threshold = 20
     heat_decay = 0.85
     blur_kernel = (21, 21)
+    heat_tracker = CursorHeatTracker((frame_height, frame_width), heat_decay, blur_kernel)
     
     # Create video writer for visualization
     output_video_path = os.path.join(output_dir, 'cursor_tracking.mp4')
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = cv2.VideoWriter(output_video_path, fourcc, fps, (frame_width, frame_height))
     
-    # Skip to start frame
-    frame_count = 0
-    while frame_count < start_frame:
-        ret = cap.grab()  # Faster than read() for skipping
-        if not ret:
-            print(f"Error: Could not skip to frame {start_frame}")
-            cap.release()
-            return None
-        frame_count += 1
-    
-    # Read first frame of scene
-    ret, prev_frame = cap.read()
-    if not ret:
+    # Color frames of the scene, decoded ahead; the first one only seeds the difference
+    decode_stats = PrefetchStats()
+    frames = iter_color_frames(video_path, start_frame, end_frame + 1, stats=decode_stats)
+    first = next(frames, None)
+    if first is None:
         print("Error: Failed to read the first frame of scene")
-        cap.release()
+        out.release()
         return None
     
+    frame_count, prev_frame = first
     prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
     prev_gray = cv2.GaussianBlur(prev_gray, (5, 5), 0)
     
@@ -325,11 +307,7 @@ def process_scene_mouse_cursor(video_path, output_dir, start_frame, end_frame):
     print(f"Processing scene frames {start_frame}-{end_frame} for mouse cursor...")
     
     # Process frames in scene
-    while frame_count <= end_frame:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
+    for _, frame in frames:
         # Convert to grayscale and apply blur
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         gray = cv2.GaussianBlur(gray, (5, 5), 0)
@@ -338,14 +316,8 @@ def process_scene_mouse_cursor(video_path, output_dir, start_frame, end_frame):
         frame_diff = cv2.absdiff(gray, prev_gray)
         _, thresh = cv2.threshold(frame_diff, diff_threshold, 255, cv2.THRESH_BINARY)
         
-        # Update heat map with decay
-        heat_map = heat_map * heat_decay + thresh.astype(np.float32)
-        
-        # Apply Gaussian blur to consolidate cursor activity
-        heat_map_blurred = cv2.GaussianBlur(heat_map, blur_kernel, 0)
-        
-        # Find the hottest point
-        _, max_val, _, max_loc = cv2.minMaxLoc(heat_map_blurred)
+        # Update the decayed, blurred heat map and find the hottest point
+        max_val, max_loc = heat_tracker.update(thresh)
         
         # Apply temporal filtering with previous cursor
         current_cursor = max_loc
@@ -363,14 +335,7 @@ def process_scene_mouse_cursor(video_path, output_dir, start_frame, end_frame):
                 )
         
         # Store cursor position
-        cursor_positions.append({
-            'global_frame': frame_count,
-            'scene_frame': scene_frame_count,
-            'time': frame_count / fps,
-            'x': current_cursor[0],
-            'y': current_cursor[1],
-            'intensity': float(max_val)
-        })
+        cursor_positions.append(frame_count, frame_count / fps, current_cursor[0], current_cursor[1], max_val)
         
         # Update previous cursor
         prev_cursor = current_cursor
@@ -396,59 +361,31 @@ def process_scene_mouse_cursor(video_path, output_dir, start_frame, end_frame):
             print(f"Processed {scene_frame_count}/{total_scene_frames} scene frames ({scene_frame_count/total_scene_frames*100:.1f}%)")
     
     # Release resources
-    cap.release()
     out.release()
+    print(f"Frame prefetch: {decode_stats.summary()}")
     
     # Generate heatmap
-    heatmap_data = np.zeros((frame_height, frame_width), dtype=np.float32)
-    
-    # Add cursor positions to heatmap
-    for pos in cursor_positions:
-        x, y = int(pos['x']), int(pos['y'])
-        # Skip if outside bounds
-        if x < 0 or x >= frame_width or y < 0 or y >= frame_height:
-            continue
-            
-        # Add weighted point to heatmap
-        intensity = max(1.0, pos['intensity'] / 50.0)  # Normalize intensity
-        cv2.circle(heatmap_data, (x, y), 10, intensity, -1)
-    
-    # Apply Gaussian blur
-    heatmap_data = cv2.GaussianBlur(heatmap_data, (31, 31), 0)
-    
-    # Save cursor data to JSON
-    cursor_data_path = os.path.join(output_dir, "cursor_data.json")
-    with open(cursor_data_path, 'w') as f:
-        json.dump({
-            'video_info': {
-                'path': video_path,
-                'scene_start_frame': start_frame,
-                'scene_end_frame': end_frame,
-                'scene_frames': scene_frame_count
-            },
-            'cursor_positions': cursor_positions
-        }, f, indent=2)
+    trajectory = cursor_positions.array()
+    heatmap_data = cursor_heatmap_from_trajectory(trajectory, frame_width, frame_height)
+    
+    # Save cursor data as a binary trajectory, and optionally in the old JSON layout
+    save_trajectory(os.path.join(output_dir, TRAJECTORY_FILENAME), trajectory)
+    if CURSOR_JSON_EXPORT:
+        export_trajectory_json(trajectory, os.path.join(output_dir, "cursor_data.json"), {
+            'path': video_path,
+            'scene_start_frame': start_frame,
+            'scene_end_frame': end_frame,
+            'scene_frames': scene_frame_count
+        })
     
     # Save heatmap
-    plt.figure(figsize=(frame_width/100, frame_height/100))
-    plt.axis('off')
-    plt.tight_layout(pad=0)
-    plt.imshow(heatmap_data, cmap='jet', interpolation='bilinear')
-    cbar = plt.colorbar()
-    cbar.set_label('Cursor Intensity')
-    
-    # Save as image
-    heatmap_path = os.path.join(output_dir, "heatmap.png")
-    plt.savefig(heatmap_path, bbox_inches='tight', pad_inches=0, dpi=100)
-    plt.close()
+    render_colorbar_heatmap(os.path.join(output_dir, "heatmap.png"), heatmap_data, 'jet',
+                            label='Cursor Intensity')
     
     # Also save a heatmap overlay
-    cap = cv2.VideoCapture(video_path)
-    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-    ret, first_frame = cap.read()
-    cap.release()
+    first_frame = read_color_frame(video_path, start_frame)
     
-    if ret:
+    if first_frame is not None:
         # Convert heatmap to color
         heatmap_norm = cv2.normalize(heatmap_data, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
         heatmap_color = cv2.applyColorMap(heatmap_norm, cv2.COLORMAP_JET)
@@ -477,43 +414,29 @@ def process_scene_screen_reader(video_path, output_dir, start_frame, end_frame,
         end_frame: Last frame of the scene
     """
     # Initialize video
-    cap = scene_initialize_video(video_path)
-    frame_width, frame_height, frame_rate, _ = scene_get_video_properties(cap)
+    properties = get_video_properties(video_path)
+    if properties is None:
+        print(f"Unable to open video file: {video_path}")
+        return None
+    frame_width, frame_height = properties['width'], properties['height']
     total_area_threshold = frame_width * frame_height * total_area_threshold_ratio
 
     # Heatmap and background initialization
-    heatmap_data = np.zeros((frame_height, frame_width), dtype=np.float32)
+    box_accumulator = scene_create_box_accumulator(frame_height, frame_width)
     fgbg = cv2.createBackgroundSubtractorMOG2()
     background_initialized = False
     first_window_background = None
     prev_gray = None
-    frame_count = 0
     scene_frame_count = 0
     selected_frame_number = None
 
-    # Skip to start frame
-    while frame_count < start_frame:
-        ret = cap.grab()  # Faster than read() for skipping
-        if not ret:
-            print(f"Error: Could not skip to frame {start_frame}")
-            cap.release()
-            return None
-        frame_count += 1
-
     print(f"Processing scene frames {start_frame}-{end_frame} for screen reader focus...")
 
-    # Process frames in scene
-    while frame_count <= end_frame:
-        # Read video frame
-        ret, frame = cap.read()
-        if not ret:
-            break
-
+    # Process grayscale frames in scene
+    decode_stats = PrefetchStats()
+    for frame_count, gray_frame in iter_gray_frames(video_path, start_frame, end_frame, stats=decode_stats):
         scene_frame_count += 1
 
-        # Convert to grayscale
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
         # Detect stable frame using optical flow
         if prev_gray is not None and not background_initialized:
             avg_motion = scene_detect_stable_frame(prev_gray, gray_frame, motion_threshold)
@@ -527,34 +450,23 @@ def process_scene_screen_reader(video_path, output_dir, start_frame, end_frame,
 
         # Skip processing until background is ready
         if not background_initialized:
-            frame_count += 1
             continue
 
         # Process frame difference
         fg_mask_thresh = scene_process_frame_difference(first_window_background, gray_frame, fgbg)
 
-        # Find contours
-        contours, _ = cv2.findContours(fg_mask_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Filter valid contours
-        valid_contours = scene_find_valid_contours(contours)
-
-        # Count regions and compute total area
-        region_count = len(valid_contours)
-        total_area = sum(cv2.contourArea(contour) for contour in valid_contours)
+        # Find regions large enough to count
+        boxes, areas = scene_find_valid_regions(fg_mask_thresh)
 
         # Skip frame if it exceeds thresholds
-        if region_count > region_count_threshold or total_area > total_area_threshold:
-            frame_count += 1
+        if len(boxes) > region_count_threshold or areas.sum() > total_area_threshold:
             continue
 
-        # Draw bounding boxes and update heatmap
-        scene_draw_bounding_boxes(frame, valid_contours, heatmap_data)
-        
-        frame_count += 1
+        # Update heatmap
+        scene_accumulate_boxes(box_accumulator, boxes)
 
-    # Release resources
-    cap.release()
+    print(f"Frame prefetch: {decode_stats.summary()}")
+    heatmap_data = scene_integrate_boxes(box_accumulator)
 
     # Save heatmap
     video_name = os.path.splitext(os.path.basename(video_path))[0]
@@ -572,29 +484,25 @@ def save_scene_heatmap(heatmap_data, background_frame, output_dir, scene_name, f
     heatmap_norm = cv2.normalize(heatmap_data, None, 0, 255, cv2.NORM_MINMAX)
     heatmap_uint8 = np.uint8(heatmap_norm)
 
-    # Plot and save heatmap
-    plt.figure(figsize=(12, 8))
-    plt.imshow(heatmap_uint8, cmap='coolwarm', interpolation='nearest', vmin=0, vmax=255)
-    plt.colorbar()
-    plt.title(f"Frequency Heatmap for {scene_name}")
-
-    # Overlay initial background for context
-    plt.imshow(background_frame, cmap='gray', alpha=0.3)
-    plt.axis('off')
-
-    # Save to file
+    # Plot and save heatmap, with the initial background overlaid for context
     os.makedirs(output_dir, exist_ok=True)
-    plt.savefig(os.path.join(output_dir, f"heatmap.png"))
-    plt.close()
+    render_overlay_heatmap(os.path.join(output_dir, "heatmap.png"), heatmap_uint8, background_frame,
+                           f"Frequency Heatmap for {scene_name}")
 
 
 # In[ ]:
 
 def process_video_with_scenes(video_path, output_dir, timestamp, user, 
-                            scene_threshold=22.0, min_scene_duration=10):
+                            scene_threshold=22.0, min_scene_duration=10, execution_mode=None,
+                            dedupe_screens=True):
     """
     Process a video with scene detection or as a single scene
     
+    Scenes showing the same screen (participants flipping back and forth
+    between pages) are grouped by a perceptual hash of their background
+    frame. Each distinct screen gets one sceneN folder, with heatmaps
+    accumulated over all of its visits.
+    
     Args:
         video_path: Path to the video
         output_dir: Directory to save outputs
@@ -602,10 +510,15 @@ def process_video_with_scenes(video_path, output_dir, timestamp, user,
         user: Current username
         scene_threshold: Threshold for scene detection
         min_scene_duration: Minimum scene duration in frames
+        execution_mode: 'serial' or 'shared_memory' (see EXECUTION_MODE), None for the default
+        dedupe_screens: Group revisited screens (False gives every scene its own folder)
     
     Returns:
         True if processing was successful
     """
+    if execution_mode is None:
+        execution_mode = EXECUTION_MODE
+    
     try:
         # Try to detect scenes
         print("Attempting scene detection...")
@@ -627,110 +540,396 @@ def process_video_with_scenes(video_path, output_dir, timestamp, user,
         cap.release()
         scenes = [(0, total_frames-1)]
     
-    # Process each scene
-    print(f"Processing {len(scenes)} scene(s)...")
-    for i, (start_frame, end_frame) in enumerate(scenes):
-        scene_number = i + 1
-        scene_folder = os.path.join(output_dir, f"scene{scene_number}")
-        os.makedirs(scene_folder, exist_ok=True)
-        
-        print(f"Processing scene {scene_number}/{len(scenes)}: frames {start_frame}-{end_frame}")
-        
-        # Calculate the middle frame of this scene
-        middle_frame = start_frame + (end_frame - start_frame) // 2
-        print(f"  Using middle frame {middle_frame} as background")
-        
-        # Generate heatmaps for this scene
-        try:
-            # Generate mouse cursor heatmap (using original method)
-            print(f"  Generating mouse cursor heatmap...")
-            generate_mouse_cursor_heatmap_original(
-                video_path, scene_folder, start_frame, end_frame, timestamp, user, middle_frame
-            )
+    write_scene_boundaries(os.path.join(output_dir, "scene_boundaries.json"), video_path,
+                           scene_threshold, min_scene_duration, scenes)
+    
+    # Group revisits of the same screen
+    if dedupe_screens:
+        screens = group_scenes_by_screen(video_path, scenes)
+    else:
+        screens = [[i] for i in range(len(scenes))]
+    
+    # Process each distinct screen
+    print(f"Processing {len(scenes)} scene(s) showing {len(screens)} distinct screen(s)...")
+    screen_folders = []
+    for n in range(len(screens)):
+        screen_folder = os.path.join(output_dir, f"scene{n + 1}")
+        os.makedirs(screen_folder, exist_ok=True)
+        screen_folders.append(screen_folder)
+    
+    if execution_mode == 'shared_memory':
+        screen_images = process_scenes_shared_memory(video_path, screen_folders, scenes, screens, timestamp, user)
+    else:
+        screen_images = []
+        for n, visits in enumerate(screens):
+            visit_ranges = [scenes[i] for i in visits]
+            print(f"Processing scene {n + 1}/{len(screens)}: frames {format_frame_ranges(visit_ranges)}")
             
-            # Generate keyboard focus heatmap
-            print(f"  Generating keyboard focus heatmap...")
-            generate_keyboard_focus_heatmap(
-                video_path, scene_folder, start_frame, end_frame, timestamp, user, middle_frame
-            )
-        except Exception as e:
-            print(f"Error processing scene {scene_number}: {str(e)}")
-            # Continue with next scene
+            # Generate heatmaps for this screen
+            images = {}
+            try:
+                for kind in SCENE_HEATMAP_KINDS:
+                    print(f"  Generating {kind} heatmap...")
+                    heatmap_data = None
+                    trajectories = []
+                    for start_frame, end_frame in visit_ranges:
+                        heatmap_data = add_heatmaps(
+                            heatmap_data, accumulate_scene_heatmap(kind, video_path, start_frame, end_frame,
+                                                                   trajectories=trajectories)
+                        )
+                    save_screen_trajectory(kind, screen_folders[n], trajectories)
+                    image = render_screen_heatmap(kind, heatmap_data, video_path, screen_folders[n],
+                                                  visit_ranges, timestamp, user)
+                    if image:
+                        images[kind] = image
+            except Exception as e:
+                print(f"Error processing scene {n + 1}: {str(e)}")
+                # Continue with next scene
+            screen_images.append(images)
+    
+    manifest_scenes = []
+    for n, (visits, images) in enumerate(zip(screens, screen_images)):
+        start_frame, end_frame = scenes[visits[0]]
+        manifest_scenes.append({
+            'scene': f"scene{n + 1}",
+            'start_frame': int(start_frame),
+            'end_frame': int(end_frame),
+            'visits': [{'start_frame': int(scenes[i][0]), 'end_frame': int(scenes[i][1])} for i in visits],
+            'images': images
+        })
+        for key, filename in (('trajectory', TRAJECTORY_FILENAME), ('focus_boxes', FOCUS_BOXES_FILENAME)):
+            if os.path.exists(os.path.join(screen_folders[n], filename)):
+                manifest_scenes[-1][key] = f"scene{n + 1}/{filename}"
     
+    write_session_manifest(output_dir, video_path, timestamp, user, manifest_scenes)
     return True
 
-def detect_scenes(video_path, threshold=22.0, min_duration=10):
+def group_scenes_by_screen(video_path, scenes):
     """
-    Basic scene detection based on frame differences
+    Group scenes that show the same screen by the perceptual hash and thumbnail of their middle frame
     
     Args:
         video_path: Path to the video
-        threshold: Threshold for scene change detection
-        min_duration: Minimum scene duration in frames
+        scenes: List of (start_frame, end_frame) tuples
     
     Returns:
-        List of (start_frame, end_frame) tuples for each scene
+        List of screens, each a list of scene indices in order of first appearance
     """
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise Exception(f"Could not open video: {video_path}")
+    with span('screen_grouping', scenes=len(scenes)) as stage:
+        signatures = []
+        for start_frame, end_frame in scenes:
+            background = read_gray_frame(video_path, start_frame + (end_frame - start_frame) // 2)
+            signatures.append(screen_signature(background))
+        screens = group_screens(signatures)
+        stage.set(screens=len(screens))
+    return screens
+
+def format_frame_ranges(ranges):
+    """Format [(start, end), ...] as 'start-end, start-end'."""
+    return ', '.join(f"{start}-{end}" for start, end in ranges)
+
+def add_heatmaps(total, heatmap_data):
+    """Sum heatmaps of several visits, skipping visits that produced none."""
+    if heatmap_data is None:
+        return total
+    return heatmap_data if total is None else total + heatmap_data
+
+def accumulate_scene_heatmap(kind, video_path, start_frame, end_frame, frames=None, trajectories=None):
+    """
+    Build the unnormalized heatmap of one scene, with the scene's middle frame as background
     
-    # Get video properties
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    Args:
+        kind: 'mousecursor' or 'keyboard'
+        video_path: Path to the video
+        start_frame: First frame of the scene
+        end_frame: Last frame of the scene
+        frames: Optional iterable of (frame_index, gray_frame), see scene_heatmap_frame_range
+        trajectories: Optional list the scene's timeline (cursor trajectory or focus boxes) is appended to
     
-    # Read first frame
-    ret, prev_frame = cap.read()
-    if not ret:
-        cap.release()
-        raise Exception("Could not read first frame")
+    Returns:
+        float32 heatmap, or None if the scene could not be read
+    """
+    if kind == 'mousecursor':
+        with span('cursor_tracking', start_frame=int(start_frame), end_frame=int(end_frame),
+                  frames=int(end_frame - start_frame + 1)):
+            return accumulate_mouse_cursor_heatmap(video_path, start_frame, end_frame, frames, trajectories)
     
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
+    with span('focus_tracking', start_frame=int(start_frame), end_frame=int(end_frame),
+              frames=int(end_frame - start_frame + 1)):
+        middle_frame = start_frame + (end_frame - start_frame) // 2
+        print(f"  Using frame {middle_frame} as background for keyboard focus")
+        first_window_background = read_gray_frame(video_path, middle_frame)
+        if first_window_background is None:
+            print(f"Error: Could not read background frame {middle_frame}")
+            return None
+        return accumulate_keyboard_focus_heatmap(video_path, start_frame, end_frame, first_window_background, frames,
+                                                 trajectories)
+
+def save_screen_trajectory(kind, scene_folder, trajectories):
+    """Write the cursor trajectory or focus boxes of all visits to a screen (nothing if no visit produced one)."""
+    if not trajectories:
+        return None
+    filename = TRAJECTORY_FILENAME if kind == 'mousecursor' else FOCUS_BOXES_FILENAME
+    return save_trajectory(os.path.join(scene_folder, filename), np.concatenate(trajectories))
+
+def render_screen_heatmap(kind, heatmap_data, video_path, scene_folder, visits, timestamp, user):
+    """
+    Render the heatmap of a screen over the middle frame of its first visit, plus its thumbnail
     
-    scene_boundaries = []
-    current_scene_start = 0
-    frame_count = 1
+    The unnormalized heatmap and its background are also saved as
+    <kind>.npz (see accumulators.py) for project-level aggregation.
     
-    print(f"Analyzing {total_frames} frames for scene detection...")
+    Args:
+        kind: 'mousecursor' or 'keyboard'
+        heatmap_data: Sum of the accumulate_scene_heatmap results of all visits
+        video_path: Path to the video
+        scene_folder: Folder to save the heatmap
+        visits: List of (start_frame, end_frame) tuples of the screen's scenes
+        timestamp: Current timestamp string
+        user: Current username
     
-    # Process frames
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    Returns:
+        save_thumbnail() result plus the accumulator path, or None if no heatmap was generated
+    """
+    if heatmap_data is None:
+        return None
+    with span('render', kind=kind, visits=len(visits)):
+        start_frame, end_frame = visits[0]
+        middle_frame = start_frame + (end_frame - start_frame) // 2
+        if kind == 'mousecursor':
+            background = read_color_frame(video_path, middle_frame)
+            if background is None:
+                print(f"Error: Could not read background frame {middle_frame}")
+                return None
+            path = render_mouse_cursor_heatmap(heatmap_data, background, scene_folder, timestamp, user)
+        else:
+            background = read_gray_frame(video_path, middle_frame)
+            if background is None:
+                print(f"Error: Could not read background frame {middle_frame}")
+                return None
+            path = render_keyboard_focus_heatmap(heatmap_data, background, scene_folder,
+                                                 f"Scene frames {format_frame_ranges(visits)}", timestamp, user)
+        image = save_thumbnail(path)
+        image['accumulator'] = save_accumulator(accumulator_path(scene_folder, kind), heatmap_data, background,
+                                                frames=sum(end - start + 1 for start, end in visits))
+        return image
+
+def scene_heatmap_frame_range(kind, start_frame, end_frame):
+    """Frames a heatmap analyzer reads for a scene (the cursor tracker also differences the next frame)."""
+    if kind == 'mousecursor':
+        return start_frame, end_frame + 1
+    return start_frame, end_frame
+
+def process_scenes_shared_memory(video_path, screen_folders, scenes, screens, timestamp, user):
+    """
+    Generate all screen heatmaps with one decoder and one process per heatmap kind
+    
+    This process decodes the video once into a SharedFrameRing; every
+    analyzer process reads the frames zero-copy from shared memory.
+    
+    Args:
+        video_path: Path to the video
+        screen_folders: Output folder of every screen
+        scenes: List of (start_frame, end_frame) tuples covering the video in order
+        screens: Scene indices of every screen, see group_scenes_by_screen
+        timestamp: Current timestamp string
+        user: Current username
+    
+    Returns:
+        List with the images dict of every screen, as in the serial mode
+    """
+    properties = get_video_properties(video_path)
+    if properties is None:
+        print(f"Error: Could not open video at {video_path}")
+        return [{} for _ in screens]
+    last_frame = max(scene_heatmap_frame_range(kind, *scenes[-1])[1] for kind in SCENE_HEATMAP_KINDS)
+    
+    ring = SharedFrameRing.create((properties['height'], properties['width']), readers=len(SCENE_HEATMAP_KINDS))
+    print(f"Running {len(SCENE_HEATMAP_KINDS)} analyzer processes on a shared frame ring ({ring.capacity} frames)")
+    try:
+        with ProcessPoolExecutor(max_workers=len(SCENE_HEATMAP_KINDS)) as executor:
+            futures = [
+                executor.submit(process_scenes_from_ring, kind, ring.spec, reader_id, video_path,
+                                screen_folders, scenes, screens, timestamp, user)
+                for reader_id, kind in enumerate(SCENE_HEATMAP_KINDS)
+            ]
+            # Never wait on an analyzer that exited (even if it crashed before
+            # detaching), and stop decoding once none is left
+            def analyzers_done():
+                for reader_id, future in enumerate(futures):
+                    if future.done():
+                        ring.reader(reader_id).detach()
+                return all(future.done() for future in futures)
+            
+            decode_stats = PrefetchStats()
+            failed = False
+            with span('ring_decode', frames=0) as stage:
+                try:
+                    for _, gray in iter_gray_frames(video_path, 0, last_frame, stats=decode_stats):
+                        ring.write(gray, should_abort=analyzers_done)
+                        stage.add(frames=1)
+                except RingClosed:
+                    pass
+                except Exception as e:
+                    print(f"Error decoding video for the frame ring: {str(e)}")
+                    failed = True
+                ring.finish(failed)
+                stage.set(decode_seconds=round(decode_stats.decode_time, 6),
+                          stall_seconds=round(ring.writer_stall_time, 6))
+            print(f"Frame ring: decoder waited {ring.writer_stall_time:.2f}s for analyzers; "
+                  f"frame prefetch: {decode_stats.summary()}")
+            
+            screen_images = [{} for _ in screens]
+            for kind, future in zip(SCENE_HEATMAP_KINDS, futures):
+                try:
+                    for n, image in future.result().items():
+                        screen_images[n][kind] = image
+                except Exception as e:
+                    print(f"Error in {kind} analyzer process: {str(e)}")
+    finally:
+        ring.close()
+        ring.unlink()
+    return screen_images
+
+def process_scenes_from_ring(kind, ring_spec, reader_id, video_path, screen_folders, scenes, screens, timestamp, user):
+    """
+    Analyzer process of process_scenes_shared_memory: generate one heatmap kind for every screen
+    
+    Scenes are read from the ring in video order; a screen's heatmap is
+    rendered once its last visit has been accumulated.
+    
+    Returns:
+        Dict mapping screen index to the save_thumbnail() result
+    """
+    ring = SharedFrameRing.attach(ring_spec)
+    reader = ring.reader(reader_id)
+    screen_of_scene = {i: n for n, visits in enumerate(screens) for i in visits}
+    heatmaps = {}
+    trajectories = {}
+    images = {}
+    try:
+        for i, (start_frame, end_frame) in enumerate(scenes):
+            n = screen_of_scene[i]
+            print(f"Scene {n + 1}/{len(screens)}: accumulating {kind} heatmap (frames {start_frame}-{end_frame})")
+            try:
+                frames = reader.frames(*scene_heatmap_frame_range(kind, start_frame, end_frame))
+                heatmaps[n] = add_heatmaps(heatmaps.get(n),
+                                           accumulate_scene_heatmap(kind, video_path, start_frame, end_frame, frames,
+                                                                    trajectories.setdefault(n, [])))
+                if i == screens[n][-1]:
+                    save_screen_trajectory(kind, screen_folders[n], trajectories.pop(n))
+                    image = render_screen_heatmap(kind, heatmaps.pop(n), video_path, screen_folders[n],
+                                                  [scenes[j] for j in screens[n]], timestamp, user)
+                    if image:
+                        images[n] = image
+            except Exception as e:
+                print(f"Error processing scene {n + 1} ({kind}): {str(e)}")
+                # Continue with next scene
+        print(f"{kind} analyzer waited {reader.stall_time:.2f}s for frames")
+    finally:
+        reader.detach()
+        ring.close()
+    return images
+
+def save_thumbnail(image_path, max_width=THUMBNAIL_MAX_WIDTH, quality=THUMBNAIL_QUALITY):
+    """
+    Save a compact gallery thumbnail next to a full-size heatmap image
+    
+    Args:
+        image_path: Path to the full-size image
+        max_width: Maximum thumbnail width in pixels (aspect ratio is kept)
+        quality: WebP/JPEG quality (0-100)
+    
+    Returns:
+        Dict with the full-size and thumbnail paths and sizes
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        print(f"Warning: Could not read {image_path} for thumbnail")
+        return {'full': image_path}
+    
+    height, width = image.shape[:2]
+    if width > max_width:
+        thumb_height = max(1, round(height * max_width / width))
+        thumbnail = cv2.resize(image, (max_width, thumb_height), interpolation=cv2.INTER_AREA)
+    else:
+        thumbnail = image
+    
+    # Prefer WebP, fall back to JPEG when OpenCV is built without WebP support
+    base_path = os.path.splitext(image_path)[0]
+    thumbnail_path = f"{base_path}_thumb.webp"
+    try:
+        saved = cv2.imwrite(thumbnail_path, thumbnail, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    except cv2.error:
+        saved = False
+    if not saved:
+        thumbnail_path = f"{base_path}_thumb.jpg"
+        cv2.imwrite(thumbnail_path, thumbnail, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    
+    return {
+        'full': image_path,
+        'thumbnail': thumbnail_path,
+        'width': width,
+        'height': height,
+        'thumbnail_width': thumbnail.shape[1],
+        'thumbnail_height': thumbnail.shape[0]
+    }
+
+def write_session_manifest(output_dir, video_path, timestamp, user, scenes):
+    """Write manifest.json listing every scene's heatmaps and thumbnails of one session."""
+    # Image paths are stored relative to the session folder, matching the S3 layout
+    for scene in scenes:
+        for entry in scene['images'].values():
+            for key in ('full', 'thumbnail', 'accumulator'):
+                if key in entry:
+                    entry[key] = os.path.relpath(entry[key], output_dir).replace(os.sep, '/')
+    
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(manifest_path, 'w') as f:
+        json.dump({
+            'video': os.path.basename(video_path),
+            'generated': timestamp,
+            'user': user,
+            'scenes': scenes
+        }, f, indent=2)
+    return manifest_path
+
+def detect_scenes(video_path, threshold=22.0, min_duration=10, hist_threshold=None):
+    """
+    Basic scene detection based on frame differences
+    
+    Args:
+        video_path: Path to the video
+        threshold: Threshold for scene change detection
+        min_duration: Minimum scene duration in frames
+        hist_threshold: Optional histogram distance (0-1) a scene change must also exceed
+    
+    Returns:
+        List of (start_frame, end_frame) tuples for each scene
+    """
+    with span('scene_detection') as stage:
+        properties = get_video_properties(video_path)
+        if properties is None:
+            raise Exception(f"Could not open video: {video_path}")
         
-        # Calculate difference
-        frame_diff = cv2.absdiff(gray, prev_gray)
-        avg_diff = np.mean(frame_diff)
+        # Difference between every pair of consecutive frames, decoded once per video
+        scene_scores = load_scene_scores(video_path)
+        if scene_scores is None:
+            raise Exception("Could not read first frame")
         
-        # Detect scene change
-        if avg_diff > threshold and (frame_count - current_scene_start) >= min_duration:
-            scene_boundaries.append((current_scene_start, frame_count - 1))
-            current_scene_start = frame_count
-            
-            # Show progress periodically
-            if len(scene_boundaries) % 5 == 0:
-                print(f"  Detected {len(scene_boundaries)} scenes so far at frame {frame_count}/{total_frames}")
+        print(f"Segmenting {len(scene_scores) + 1} frames into scenes...")
         
-        prev_gray = gray
-        frame_count += 1
+        # Split into scenes; a final scene of a single frame is dropped
+        scene_boundaries = segment_scene_scores(scene_scores, threshold, min_duration, min_final_duration=2,
+                                                hist_threshold=hist_threshold)
         
-        # Show progress periodically
-        if frame_count % 500 == 0:
-            print(f"  Analyzed {frame_count}/{total_frames} frames ({frame_count/total_frames*100:.1f}%)")
-    
-    # Add the final scene
-    if current_scene_start < frame_count - 1:
-        scene_boundaries.append((current_scene_start, frame_count - 1))
-    
-    cap.release()
-    print(f"Detected {len(scene_boundaries)} scenes")
+        print(f"Detected {len(scene_boundaries)} scenes")
+        stage.set(frames=len(scene_scores) + 1, scenes=len(scene_boundaries))
     
     return scene_boundaries
 
-def generate_mouse_cursor_heatmap_original(video_path, scene_folder, start_frame, end_frame, timestamp, user, background_frame=None):
+def generate_mouse_cursor_heatmap_original(video_path, scene_folder, start_frame, end_frame, timestamp, user, background_frame=None,
+                                           frames=None):
     """
     Generate mouse cursor heatmap using the original approach from 5703combined.ipynb
     
@@ -742,59 +941,70 @@ def generate_mouse_cursor_heatmap_original(video_path, scene_folder, start_frame
         timestamp: Current timestamp string
         user: Current username
         background_frame: Frame to use as background (if None, will be calculated)
+        frames: Optional iterable of (frame_index, gray_frame) for frames start_frame..end_frame+1,
+                e.g. from a shared frame ring; decoded from video_path if None
     
     Returns:
         Path to the generated heatmap
     """
-    # Initialize video capture
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error: Could not open video at {video_path}")
+    # Set the default background frame if not provided
+    if background_frame is None:
+        background_frame = start_frame + (end_frame - start_frame) // 2
+    
+    # Get the color background frame first (only the overlay needs color)
+    first_frame = read_color_frame(video_path, background_frame)
+    if first_frame is None:
+        print(f"Error: Could not read background frame {background_frame}")
+        return None
+    
+    heatmap_data = accumulate_mouse_cursor_heatmap(video_path, start_frame, end_frame, frames)
+    if heatmap_data is None:
         return None
+    return render_mouse_cursor_heatmap(heatmap_data, first_frame, scene_folder, timestamp, user)
+
+def accumulate_mouse_cursor_heatmap(video_path, start_frame, end_frame, frames=None, trajectories=None):
+    """
+    Track the mouse cursor through a scene and build its (unnormalized) heatmap
     
+    Heatmaps of several visits to the same screen can be summed before rendering.
+    
+    Args:
+        video_path: Path to the video
+        start_frame: Starting frame of the scene
+        end_frame: Ending frame of the scene
+        frames: Optional iterable of (frame_index, gray_frame) for frames start_frame..end_frame+1
+        trajectories: Optional list the scene's cursor trajectory (see trajectory.py) is appended to
+    
+    Returns:
+        float32 heatmap of the video frame size, or None if the scene cannot be read
+    """
     # Get video properties
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
+    properties = get_video_properties(video_path)
+    if properties is None:
+        print(f"Error: Could not open video at {video_path}")
+        return None
+    frame_width, frame_height = properties['width'], properties['height']
+    fps = properties['fps']
     
     # Initialize variables for cursor tracking
-    cursor_positions = []
-    heat_map = np.zeros((frame_height, frame_width), dtype=np.float32)
+    cursor_positions = TrajectoryBuilder(end_frame - start_frame + 1)
     
     # Parameters - from original code
     diff_threshold = 20
     heat_decay = 0.85
     blur_kernel = (21, 21)
-    
-    # Set the default background frame if not provided
-    if background_frame is None:
-        background_frame = start_frame + (end_frame - start_frame) // 2
-    
-    # Get the background frame first
-    background_img = None
-    cap.set(cv2.CAP_PROP_POS_FRAMES, background_frame)
-    ret, background_img = cap.read()
-    if not ret:
-        print(f"Error: Could not read background frame {background_frame}")
-        cap.release()
-        return None
-    
-    # Save background image
-    first_frame = background_img.copy()
-    
-    # Now reset and skip to start frame
-    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-    frame_count = start_frame
-    
-    # Read first frame of scene
-    ret, prev_frame = cap.read()
-    if not ret:
+    heat_tracker = CursorHeatTracker((frame_height, frame_width), heat_decay, blur_kernel)
+    
+    # Grayscale frames of the scene; the first one only seeds the difference
+    decode_stats = PrefetchStats()
+    if frames is None:
+        frames = iter_gray_frames(video_path, start_frame, end_frame + 1, stats=decode_stats)
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
         print("Error: Failed to read the first frame of scene")
-        cap.release()
         return None
-    
-    # Convert to grayscale
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
+    frame_count, prev_gray = first
     prev_gray = cv2.GaussianBlur(prev_gray, (5, 5), 0)
     
     # Previous cursor position for continuity
@@ -804,27 +1014,16 @@ def generate_mouse_cursor_heatmap_original(video_path, scene_folder, start_frame
     print(f"  Processing scene frames {start_frame}-{end_frame} for mouse cursor...")
     scene_frame_count = 0
     
-    while frame_count <= end_frame:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Convert to grayscale and apply blur
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    for _, gray in frames:
+        # Apply blur
         gray = cv2.GaussianBlur(gray, (5, 5), 0)
         
         # Calculate absolute difference
         frame_diff = cv2.absdiff(gray, prev_gray)
         _, thresh = cv2.threshold(frame_diff, diff_threshold, 255, cv2.THRESH_BINARY)
         
-        # Update heat map with decay
-        heat_map = heat_map * heat_decay + thresh.astype(np.float32)
-        
-        # Apply Gaussian blur to consolidate cursor activity
-        heat_map_blurred = cv2.GaussianBlur(heat_map, blur_kernel, 0)
-        
-        # Find the hottest point
-        _, max_val, _, max_loc = cv2.minMaxLoc(heat_map_blurred)
+        # Update the decayed, blurred heat map and find the hottest point
+        max_val, max_loc = heat_tracker.update(thresh)
         
         # Apply temporal filtering with previous cursor
         current_cursor = max_loc
@@ -842,13 +1041,7 @@ def generate_mouse_cursor_heatmap_original(video_path, scene_folder, start_frame
                 )
         
         # Store cursor position
-        cursor_positions.append({
-            'frame': frame_count,
-            'time': (frame_count - start_frame) / fps,
-            'x': current_cursor[0],
-            'y': current_cursor[1],
-            'intensity': float(max_val)
-        })
+        cursor_positions.append(frame_count, frame_count / fps, current_cursor[0], current_cursor[1], max_val)
         
         # Update previous cursor
         prev_cursor = current_cursor
@@ -863,27 +1056,62 @@ def generate_mouse_cursor_heatmap_original(video_path, scene_folder, start_frame
             total_scene_frames = end_frame - start_frame + 1
             print(f"    Processed {scene_frame_count}/{total_scene_frames} scene frames ({scene_frame_count/total_scene_frames*100:.1f}%)")
     
-    # Release resources
-    cap.release()
-    
+    if decode_stats.frames:
+        print(f"  Frame prefetch: {decode_stats.summary()}")
+        current_span().set(decode_seconds=round(decode_stats.decode_time, 6),
+                           decode_wait_seconds=round(decode_stats.consumer_stall_time, 6))
     print("  Generating mouse cursor heatmap visualization...")
-    # Generate heatmap data from cursor positions
+    trajectory = cursor_positions.array()
+    if trajectories is not None:
+        trajectories.append(trajectory)
+    return cursor_heatmap_from_trajectory(trajectory, frame_width, frame_height)
+
+def cursor_heatmap_from_trajectory(trajectory, frame_width, frame_height):
+    """
+    Build the (unnormalized) mouse cursor heatmap of a trajectory - original implementation
+    
+    Args:
+        trajectory: Cursor trajectory array (see trajectory.py)
+        frame_width: Video frame width
+        frame_height: Video frame height
+    
+    Returns:
+        float32 heatmap of the video frame size
+    """
     heatmap_data = np.zeros((frame_height, frame_width), dtype=np.float32)
     
     # Add cursor positions to heatmap
-    for pos in cursor_positions:
-        x, y = int(pos['x']), int(pos['y'])
+    for x, y, intensity in zip(trajectory['x'].tolist(), trajectory['y'].tolist(),
+                               trajectory['intensity'].tolist()):
         # Skip if outside bounds
         if x < 0 or x >= frame_width or y < 0 or y >= frame_height:
             continue
             
-        # Add weighted point to heatmap - original implementation
-        intensity = max(1.0, pos['intensity'] / 50.0)  # Normalize intensity
+        # Add weighted point to heatmap
+        intensity = max(1.0, intensity / 50.0)  # Normalize intensity
         cv2.circle(heatmap_data, (x, y), 10, intensity, -1)
     
-    # Apply Gaussian blur to smooth - original implementation
+    # Apply Gaussian blur to smooth
     heatmap_data = cv2.GaussianBlur(heatmap_data, (31, 31), 0)
     
+    return heatmap_data
+
+def render_mouse_cursor_heatmap(heatmap_data, first_frame, scene_folder, timestamp, user):
+    """
+    Render a mouse cursor heatmap as a color overlay on a background frame
+    
+    Args:
+        heatmap_data: Heatmap from accumulate_mouse_cursor_heatmap
+        first_frame: BGR background frame
+        scene_folder: Folder to save the heatmap
+        timestamp: Current timestamp string
+        user: Current username
+    
+    Returns:
+        Path to the generated heatmap
+    """
+    frame_height = heatmap_data.shape[0]
+    
     # Save a heatmap overlay on the first frame - exactly as in original code
     # Convert heatmap to color
     heatmap_norm = cv2.normalize(heatmap_data, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
@@ -908,7 +1136,8 @@ def generate_mouse_cursor_heatmap_original(video_path, scene_folder, start_frame
     
     return mousecursor_path
 
-def generate_keyboard_focus_heatmap(video_path, scene_folder, start_frame, end_frame, timestamp, user, background_frame=None):
+def generate_keyboard_focus_heatmap(video_path, scene_folder, start_frame, end_frame, timestamp, user, background_frame=None,
+                                    frames=None):
     """
     Generate screen reader (keyboard) focus heatmap for a specific scene
     
@@ -920,130 +1149,141 @@ def generate_keyboard_focus_heatmap(video_path, scene_folder, start_frame, end_f
         timestamp: Current timestamp
         user: Current username
         background_frame: Frame to use as background (if None, will use middle frame)
+        frames: Optional iterable of (frame_index, gray_frame) for frames start_frame..end_frame,
+                e.g. from a shared frame ring; decoded from video_path if None
     
     Returns:
         Path to the generated heatmap
     """
-    # Initialize video
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Unable to open video file: {video_path}")
-        return None
-    
-    # Get video properties
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    frame_rate = int(cap.get(cv2.CAP_PROP_FPS))
-    
     # Set the default background frame if not provided
     if background_frame is None:
         background_frame = start_frame + (end_frame - start_frame) // 2
     
     print(f"  Using frame {background_frame} as background for keyboard focus")
     
-    # Get the background frame first
-    first_window_background = None
-    cap.set(cv2.CAP_PROP_POS_FRAMES, background_frame)
-    ret, background_img = cap.read()
-    if not ret:
+    # Get the grayscale background frame first
+    first_window_background = read_gray_frame(video_path, background_frame)
+    if first_window_background is None:
         print(f"Error: Could not read background frame {background_frame}")
-        cap.release()
         return None
     
-    # Convert background to grayscale
-    first_window_background = cv2.cvtColor(background_img, cv2.COLOR_BGR2GRAY)
+    heatmap_data = accumulate_keyboard_focus_heatmap(video_path, start_frame, end_frame,
+                                                     first_window_background, frames)
+    if heatmap_data is None:
+        return None
+    return render_keyboard_focus_heatmap(heatmap_data, first_window_background, scene_folder,
+                                         f"Scene frames {start_frame}-{end_frame}", timestamp, user)
+
+def accumulate_keyboard_focus_heatmap(video_path, start_frame, end_frame, first_window_background, frames=None,
+                                      focus_timelines=None):
+    """
+    Track keyboard focus regions through a scene and build its (unnormalized) heatmap
+    
+    Heatmaps of several visits to the same screen can be summed before rendering.
+    
+    Args:
+        video_path: Path to the video
+        start_frame: Starting frame of the scene
+        end_frame: Ending frame of the scene
+        first_window_background: Grayscale background frame of the scene
+        frames: Optional iterable of (frame_index, gray_frame) for frames start_frame..end_frame
+        focus_timelines: Optional list the scene's focus boxes (see trajectory.py) are appended to
+    
+    Returns:
+        float32 heatmap of the video frame size, or None if the video cannot be opened
+    """
+    # Get video properties
+    properties = get_video_properties(video_path)
+    if properties is None:
+        print(f"Unable to open video file: {video_path}")
+        return None
+    frame_width, frame_height = properties['width'], properties['height']
+    fps = properties['fps']
     
     # Initialize for frame processing
-    heatmap_data = np.zeros((frame_height, frame_width), dtype=np.float32)
+    box_accumulator = scene_create_box_accumulator(frame_height, frame_width)
+    focus_boxes = TrajectoryBuilder(dtype=FOCUS_BOX_DTYPE)
     fgbg = cv2.createBackgroundSubtractorMOG2()
     total_area_threshold_ratio = 0.5
     total_area_threshold = frame_width * frame_height * total_area_threshold_ratio
     region_count_threshold = 5
     
-    # Now reset and skip to start frame
-    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-    frame_count = start_frame
-    
     print(f"  Processing scene frames {start_frame}-{end_frame} for keyboard focus...")
     scene_frame_count = 0
     
-    # Process frames in scene
-    while frame_count <= end_frame:
-        # Read video frame
-        ret, frame = cap.read()
-        if not ret:
-            break
-
+    # Process grayscale frames in scene
+    decode_stats = PrefetchStats()
+    if frames is None:
+        frames = iter_gray_frames(video_path, start_frame, end_frame, stats=decode_stats)
+    for frame_count, gray_frame in frames:
         scene_frame_count += 1
-
-        # Convert to grayscale
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
         # Process frame difference with our fixed background
         frame_diff = cv2.absdiff(first_window_background, gray_frame)
         fg_mask = fgbg.apply(frame_diff)
         _, fg_mask_thresh = cv2.threshold(fg_mask, 150, 255, cv2.THRESH_BINARY)
 
-        # Find contours
-        contours, _ = cv2.findContours(fg_mask_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Filter valid contours
-        valid_contours = [contour for contour in contours if cv2.contourArea(contour) > 100]
-
-        # Count regions and compute total area
-        region_count = len(valid_contours)
-        total_area = sum(cv2.contourArea(contour) for contour in valid_contours)
+        # Find regions large enough to count
+        boxes, areas = scene_find_valid_regions(fg_mask_thresh)
 
         # Skip frame if it exceeds thresholds
-        if region_count > region_count_threshold or total_area > total_area_threshold:
-            frame_count += 1
+        if len(boxes) > region_count_threshold or areas.sum() > total_area_threshold:
             continue
 
         # Update heatmap with detected regions
-        for contour in valid_contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            heatmap_data[y:y+h, x:x+w] += 1
-        
-        frame_count += 1
+        scene_accumulate_boxes(box_accumulator, boxes)
+        focus_boxes.extend(focus_box_records(frame_count, frame_count / fps, boxes))
         
         # Show progress periodically
         if scene_frame_count % 100 == 0:
             total_scene_frames = end_frame - start_frame + 1
             print(f"    Processed {scene_frame_count}/{total_scene_frames} scene frames ({scene_frame_count/total_scene_frames*100:.1f}%)")
 
-    # Release resources
-    cap.release()
+    if decode_stats.frames:
+        print(f"  Frame prefetch: {decode_stats.summary()}")
+        current_span().set(decode_seconds=round(decode_stats.decode_time, 6),
+                           decode_wait_seconds=round(decode_stats.consumer_stall_time, 6))
+    if focus_timelines is not None:
+        focus_timelines.append(focus_boxes.array())
+    heatmap_data = scene_integrate_boxes(box_accumulator)
+    return heatmap_data
+
+def render_keyboard_focus_heatmap(heatmap_data, first_window_background, scene_folder, frames_label, timestamp, user):
+    """
+    Render a keyboard focus heatmap over a grayscale background frame
     
+    Args:
+        heatmap_data: Heatmap from accumulate_keyboard_focus_heatmap
+        first_window_background: Grayscale background frame
+        scene_folder: Folder to save the heatmap
+        frames_label: Frame ranges shown in the title
+        timestamp: Current timestamp string
+        user: Current username
+    
+    Returns:
+        Path to the generated heatmap
+    """
     # Normalize heatmap
     heatmap_norm = cv2.normalize(heatmap_data, None, 0, 255, cv2.NORM_MINMAX)
     heatmap_uint8 = np.uint8(heatmap_norm)
 
-    # Plot and save heatmap
-    plt.figure(figsize=(12, 8))
-    plt.imshow(heatmap_uint8, cmap='coolwarm', interpolation='nearest', vmin=0, vmax=255)  # Use coolwarm color map
-    plt.colorbar()
-    plt.title(f"Keyboard Focus Heatmap (Scene frames {start_frame}-{end_frame})")
-
-    # Overlay initial background for context
-    plt.imshow(first_window_background, cmap='gray', alpha=0.3)  # Reduce alpha to prevent hiding buttons
-    plt.axis('off')
-    
-    # Add timestamp and user info
-    plt.annotate(f"Generated: {timestamp}\nUser: {user}", xy=(0.01, 0.01), xycoords='figure fraction', 
-                color='white', backgroundcolor='black', fontsize=8)
-
-    # Save to file
-    keyboard_path = os.path.join(scene_folder, "keyboard.png")
-    plt.savefig(keyboard_path, bbox_inches='tight', pad_inches=0.1, dpi=100)
-    plt.close()
+    # Plot and save heatmap over the initial background, with timestamp and user info
+    keyboard_path = render_overlay_heatmap(os.path.join(scene_folder, "keyboard.png"), heatmap_uint8,
+                                           first_window_background, f"Keyboard Focus Heatmap ({frames_label})",
+                                           annotation=f"Generated: {timestamp}\nUser: {user}", tight=True)
     
     return keyboard_path
 
-def analyze_screen(video_path, output_dir, timestamp, user):
-    process_video_with_scenes(
-        video_path, output_dir, timestamp, user,
-        scene_threshold=22.0, min_scene_duration=10
-    )
+def analyze_screen(video_path, output_dir, timestamp, user, execution_mode=None):
+    if execution_mode is None:
+        execution_mode = EXECUTION_MODE
+    with span('analysis', video=os.path.basename(video_path), execution_mode=execution_mode) as stage:
+        properties = get_video_properties(video_path)
+        if properties is not None:
+            stage.set(frames=properties['total_frames'], width=properties['width'], height=properties['height'])
+        process_video_with_scenes(
+            video_path, output_dir, timestamp, user,
+            scene_threshold=22.0, min_scene_duration=10, execution_mode=execution_mode
+        )
     return output_dir
 
 
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import cv2
+import numpy as np
+
+
+class CursorHeatTracker:
+    """
+    Incrementally maintained, blurred motion heat map used to locate the mouse cursor.
+
+    The original tracking loop did, for every frame:
+
+        heat_map = heat_map * heat_decay + thresh
+        blurred = GaussianBlur(heat_map, blur_kernel)
+        max_val, max_loc = minMaxLoc(blurred)
+
+    The blur is linear, so the blurred map can be updated directly:
+
+        blurred = blurred * heat_decay + GaussianBlur(thresh)
+
+    and GaussianBlur(thresh) is only non-zero around the pixels that changed.
+    The decay is applied lazily through a global scale factor, the blur is run
+    only on the dirty regions of the frame, and because the stored map only
+    ever grows, the new maximum is either the previous maximum or lies inside
+    a dirty region. Per-frame cost therefore scales with the changed area
+    instead of the screen resolution, and the result matches the full-frame
+    computation up to floating point rounding.
+    """
+
+    # Fold the lazy decay factor back into the map before it gets this small
+    RENORMALIZE_BELOW = 1e-3
+    # Above this many separate dirty regions a single bounding box is cheaper
+    MAX_REGIONS = 16
+
+    def __init__(self, frame_shape, heat_decay=0.85, blur_kernel=(21, 21)):
+        """
+        Args:
+            frame_shape: (height, width) of the thresholded difference frames
+            heat_decay: Per-frame decay of the heat map
+            blur_kernel: Gaussian kernel (width, height) used to consolidate activity
+        """
+        self.height, self.width = frame_shape[:2]
+        self.heat_decay = heat_decay
+        self.blur_kernel = blur_kernel
+        # Pixels of the changed area within this margin feed the blur; twice
+        # the margin keeps reflected borders of a region filled with zeros
+        self.margin_x = 2 * (blur_kernel[0] // 2)
+        self.margin_y = 2 * (blur_kernel[1] // 2)
+
+        # Actual blurred heat = self._scale * self._blurred
+        self._blurred = np.zeros((self.height, self.width), dtype=np.float32)
+        self._scale = 1.0
+        self._max_loc = (0, 0)
+
+    def update(self, thresh):
+        """
+        Add one thresholded difference frame and return the hottest point
+
+        Args:
+            thresh: uint8 binary difference mask (0 or 255) of the current frame
+
+        Returns:
+            (max_val, max_loc) of the blurred heat map, as cv2.minMaxLoc reports them
+        """
+        self._scale *= self.heat_decay
+        if self._scale < self.RENORMALIZE_BELOW:
+            self._blurred *= self._scale
+            self._scale = 1.0
+
+        best_loc = self._max_loc
+        best_val = self._blurred[best_loc[1], best_loc[0]]
+        for x0, y0, x1, y1 in self._dirty_regions(thresh):
+            region = thresh[y0:y1, x0:x1].astype(np.float32)
+            blurred = cv2.GaussianBlur(region, self.blur_kernel, 0)
+            stored = self._blurred[y0:y1, x0:x1]
+            stored += blurred * (1.0 / self._scale)
+
+            _, region_val, _, region_loc = cv2.minMaxLoc(stored)
+            loc = (x0 + region_loc[0], y0 + region_loc[1])
+            # Ties resolve to the first pixel in row-major order, like minMaxLoc
+            if region_val > best_val or (region_val == best_val and (loc[1], loc[0]) < (best_loc[1], best_loc[0])):
+                best_val, best_loc = region_val, loc
+
+        self._max_loc = best_loc
+        return float(best_val) * self._scale, best_loc
+
+    def _dirty_regions(self, thresh):
+        """Return disjoint (x0, y0, x1, y1) boxes covering the changed pixels plus the blur margin."""
+        if not cv2.countNonZero(thresh):
+            return []
+
+        x, y, w, h = cv2.boundingRect(thresh)
+        boxes = [(x, y, x + w, y + h)]
+        # Split a large bounding box into its separate changed areas
+        if w * h > 16 * self.margin_x * self.margin_y:
+            contours, _ = cv2.findContours(thresh[y:y + h, x:x + w], cv2.RETR_EXTERNAL,
+                                           cv2.CHAIN_APPROX_SIMPLE)
+            if len(contours) <= 4 * self.MAX_REGIONS:
+                boxes = []
+                for contour in contours:
+                    cx, cy, cw, ch = cv2.boundingRect(contour)
+                    boxes.append((x + cx, y + cy, x + cx + cw, y + cy + ch))
+
+        regions = self._merge_regions([self._expand(box) for box in boxes])
+        if len(regions) > self.MAX_REGIONS:
+            return [self._expand((x, y, x + w, y + h))]
+        return regions
+
+    def _expand(self, box):
+        x0, y0, x1, y1 = box
+        return (max(0, x0 - self.margin_x), max(0, y0 - self.margin_y),
+                min(self.width, x1 + self.margin_x), min(self.height, y1 + self.margin_y))
+
+    @staticmethod
+    def _merge_regions(regions):
+        """Merge overlapping boxes until all of them are disjoint."""
+        merged = True
+        while merged and len(regions) > 1:
+            merged = False
+            result = []
+            for box in regions:
+                for i, other in enumerate(result):
+                    if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                        result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                     max(box[2], other[2]), max(box[3], other[3]))
+                        merged = True
+                        break
+                else:
+                    result.append(box)
+            regions = result
+        return regions
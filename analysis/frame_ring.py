@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Frame slots in the ring (one decoder, readers never lag further behind than this)
+RING_CAPACITY = 16
+
+# Control block layout (int64): written frames, stream state, then one released count per reader
+_WRITTEN, _STATE = 0, 1
+_HEADER = 2
+STATE_RUNNING, STATE_FINISHED, STATE_FAILED = 0, 1, 2
+# Released count of a reader that stopped consuming, so it never holds the writer back
+_DETACHED = np.iinfo(np.int64).max
+
+
+class RingClosed(Exception):
+    """Raised by a reader when the decoder failed before producing the requested frame."""
+
+
+def _wait(condition, should_abort=None):
+    """Poll condition() with a short, growing sleep; return the seconds spent waiting."""
+    started = time.perf_counter()
+    delay = 0.0001
+    while not condition():
+        if should_abort is not None and should_abort():
+            raise RingClosed("Waiting on the frame ring was aborted")
+        time.sleep(delay)
+        delay = min(delay * 2, 0.002)
+    return time.perf_counter() - started
+
+
+class SharedFrameRing:
+    """
+    Ring buffer of video frames in shared memory, filled by one decoder and read by several processes
+
+    Frames never pass through pickling: the decoder copies each frame into a
+    slot and readers get numpy views straight onto the shared memory.
+    Synchronization uses sequence numbers only. The decoder publishes how
+    many frames it has written, each reader publishes how many frames it has
+    released, and a slot is reused only once every reader has released the
+    frame in it.
+
+    The parent creates the ring, passes ring.spec to the worker processes,
+    which call SharedFrameRing.attach(spec), and unlinks it when done.
+    """
+
+    def __init__(self, spec, create=False):
+        self.spec = spec
+        self.frame_shape = tuple(spec['frame_shape'])
+        self.capacity = spec['capacity']
+        self.readers = spec['readers']
+        frame_bytes = int(np.prod(self.frame_shape))
+        control_bytes = (_HEADER + self.readers) * 8
+
+        if create:
+            self._shm = shared_memory.SharedMemory(create=True, size=control_bytes + self.capacity * frame_bytes)
+            self.spec = dict(spec, name=self._shm.name)
+        else:
+            self._shm = shared_memory.SharedMemory(name=spec['name'])
+
+        self._control = np.ndarray((_HEADER + self.readers,), dtype=np.int64, buffer=self._shm.buf)
+        self._slots = np.ndarray((self.capacity,) + self.frame_shape, dtype=np.uint8,
+                                 buffer=self._shm.buf, offset=control_bytes)
+        if create:
+            self._control[:] = 0
+        self.writer_stall_time = 0.0
+
+    @classmethod
+    def create(cls, frame_shape, readers, capacity=RING_CAPACITY):
+        """
+        Allocate a new ring
+
+        Args:
+            frame_shape: Shape of every frame, e.g. (height, width) for grayscale
+            readers: Number of reader processes that must see every frame
+            capacity: Number of frame slots (at least 3, readers keep two frames pinned)
+
+        Returns:
+            SharedFrameRing owning the shared memory block
+        """
+        spec = {'name': None, 'frame_shape': tuple(frame_shape), 'capacity': max(3, capacity),
+                'readers': readers}
+        return cls(spec, create=True)
+
+    @classmethod
+    def attach(cls, spec):
+        """Attach to a ring created in another process."""
+        return cls(spec)
+
+    def write(self, frame, should_abort=None):
+        """
+        Copy the next frame into the ring, waiting until every reader has released its slot
+
+        Args:
+            frame: Frame with the ring's frame shape
+            should_abort: Optional callable; waiting stops with RingClosed when it returns True
+        """
+        written = int(self._control[_WRITTEN])
+        readers = self._control[_HEADER:]
+        self.writer_stall_time += _wait(lambda: written - int(readers.min()) < self.capacity, should_abort)
+        self._slots[written % self.capacity] = frame
+        self._control[_WRITTEN] = written + 1
+
+    def finish(self, failed=False):
+        """Mark the end of the stream; readers see no frames past the last one written."""
+        self._control[_STATE] = STATE_FAILED if failed else STATE_FINISHED
+
+    def reader(self, reader_id):
+        """Return the RingReader for reader number reader_id."""
+        return RingReader(self, reader_id)
+
+    def close(self):
+        """Drop this process's mapping of the ring."""
+        self._control = None
+        self._slots = None
+        self._shm.close()
+
+    def unlink(self):
+        """Free the shared memory block (owner only, after all processes closed it)."""
+        self._shm.unlink()
+
+
+class RingReader:
+    """
+    One reader's view of a SharedFrameRing
+
+    Frames are addressed by sequence number (the n-th frame written). A frame
+    returned by get() stays valid until the reader releases it, and frames()
+    keeps the previous frame pinned, so analyzers that hold on to the last
+    frame for differencing can keep using the view.
+    """
+
+    def __init__(self, ring, reader_id):
+        self.ring = ring
+        self._slot = _HEADER + reader_id
+        self.stall_time = 0.0
+
+    def get(self, seq):
+        """
+        Return a read-only view of frame seq, waiting for the decoder if needed
+
+        Returns:
+            numpy view of the frame, or None if the stream ended before it
+        """
+        control = self.ring._control
+        if seq < int(control[self._slot]):
+            raise ValueError(f"Frame {seq} was already released")
+        self.stall_time += _wait(lambda: control[_WRITTEN] > seq or control[_STATE] != STATE_RUNNING)
+        if control[_WRITTEN] <= seq:
+            if control[_STATE] == STATE_FAILED:
+                raise RingClosed("The decoder failed before producing frame %d" % seq)
+            return None
+        view = self.ring._slots[seq % self.ring.capacity]
+        view = view.view()
+        view.flags.writeable = False
+        return view
+
+    def release_before(self, seq):
+        """Allow the decoder to reuse the slots of all frames before seq."""
+        control = self.ring._control
+        if seq > control[self._slot]:
+            control[self._slot] = seq
+
+    def frames(self, start, end):
+        """
+        Yield (seq, frame) for frames start..end (inclusive), stopping early at the end of the stream
+
+        Everything before the previous frame is released as the iteration advances.
+        """
+        for seq in range(start, end + 1):
+            self.release_before(seq - 1)
+            frame = self.get(seq)
+            if frame is None:
+                return
+            yield seq, frame
+
+    def detach(self):
+        """Stop taking part in the ring so the decoder never waits on this reader."""
+        self.ring._control[self._slot] = _DETACHED
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from seek_index import keyframe_before, load_seek_index
+
+# FFmpeg binary used for the grayscale decode pipe (override with FFMPEG_BIN)
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+# Frames decoded ahead of the analyzer by the prefetch thread (0 disables prefetching)
+PREFETCH_DEPTH = int(os.environ.get('PREFETCH_DEPTH', '8'))
+# How downscaled frames are sampled (see iter_gray_frames), as FFmpeg scale flags and OpenCV interpolation
+FFMPEG_SCALE_FLAGS = {'area': 'area', 'point': 'neighbor'}
+OPENCV_INTERPOLATION = {'area': cv2.INTER_AREA, 'point': cv2.INTER_NEAREST}
+# Seconds within which a decoded frame's timestamp matches a keyframe's in the seek index (rounded to microseconds)
+SEEK_TIME_TOLERANCE = 1e-4
+
+
+class PrefetchStats:
+    """
+    Counters collected by prefetch()
+
+    consumer_stall_time is the time the analyzer waited for a decoded frame
+    (decode is the bottleneck), producer_stall_time the time the decode
+    thread waited for room in the queue (processing is the bottleneck).
+    decode_time is the time the decode thread spent producing frames.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.decode_time = 0.0
+        self.consumer_stalls = 0
+        self.consumer_stall_time = 0.0
+        self.producer_stall_time = 0.0
+        self.queue_depth_total = 0
+        self.max_queue_depth = 0
+
+    @property
+    def mean_queue_depth(self):
+        return self.queue_depth_total / self.frames if self.frames else 0.0
+
+    def summary(self):
+        if not self.frames:
+            return "no frames prefetched"
+        return (f"{self.frames} frames, queue depth mean {self.mean_queue_depth:.1f} "
+                f"max {self.max_queue_depth}, decoding took {self.decode_time:.2f}s, "
+                f"analyzer waited {self.consumer_stall_time:.2f}s "
+                f"({self.consumer_stalls} stalls), decoder waited {self.producer_stall_time:.2f}s")
+
+
+def ffmpeg_available():
+    """Check whether the FFmpeg binary can be found."""
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+def get_video_properties(video_path):
+    """
+    Read basic video properties
+
+    Args:
+        video_path: Path to the video
+
+    Returns:
+        Dict with width, height, fps and total_frames, or None if the video cannot be opened
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    properties = {
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'fps': cap.get(cv2.CAP_PROP_FPS),
+        'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    }
+    cap.release()
+    return properties
+
+
+def prefetch(frames, depth=PREFETCH_DEPTH, stats=None):
+    """
+    Run a frame generator on a background thread, decoding up to depth frames ahead
+
+    OpenCV and pipe reads release the GIL, so decoding overlaps with the
+    analyzer's processing of the previous frames.
+
+    Args:
+        frames: Frame generator, e.g. from iter_gray_frames
+        depth: Maximum number of decoded frames waiting in the queue
+        stats: Optional PrefetchStats updated while iterating
+
+    Yields:
+        The items of frames, in order
+    """
+    if stats is None:
+        stats = PrefetchStats()
+    frame_queue = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            while True:
+                started = time.perf_counter()
+                item = next(frames, done)
+                stats.decode_time += time.perf_counter() - started
+                if item is done:
+                    break
+                waited = time.perf_counter()
+                while not stop.is_set():
+                    try:
+                        frame_queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                stats.producer_stall_time += time.perf_counter() - waited
+                if stop.is_set():
+                    return
+            frame_queue.put(done)
+        except Exception as e:
+            frame_queue.put(e)
+        finally:
+            frames.close()
+
+    producer = threading.Thread(target=produce, name='frame-prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            depth_now = frame_queue.qsize()
+            if depth_now == 0:
+                stats.consumer_stalls += 1
+            waited = time.perf_counter()
+            item = frame_queue.get()
+            stats.consumer_stall_time += time.perf_counter() - waited
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            stats.frames += 1
+            stats.queue_depth_total += depth_now
+            stats.max_queue_depth = max(stats.max_queue_depth, depth_now)
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue
+        while producer.is_alive():
+            try:
+                frame_queue.get_nowait()
+            except queue.Empty:
+                producer.join(0.1)
+
+
+def iter_gray_frames(video_path, start_frame=0, end_frame=None, use_ffmpeg=None,
+                     prefetch_depth=PREFETCH_DEPTH, stats=None, size=None, sampling='area'):
+    """
+    Yield 8-bit grayscale frames of a video
+
+    FFmpeg decodes straight to its 'gray' pixel format, so no BGR frame is
+    ever built or converted. Without FFmpeg, OpenCV decodes BGR frames and
+    converts them. Either way decoding starts at the keyframe before
+    start_frame (see seek_index.py) and only the frames from there to
+    start_frame are decoded and dropped.
+
+    Args:
+        video_path: Path to the video
+        start_frame: First frame to yield
+        end_frame: Last frame to yield (inclusive), None for the end of the video
+        use_ffmpeg: Force (True) or disable (False) the FFmpeg pipe, None to auto-detect
+        prefetch_depth: Frames decoded ahead on a background thread, 0 to decode inline
+        stats: Optional PrefetchStats collecting queue depth and stall times
+        size: Optional (width, height) to scale the frames down to
+              (FFmpeg scales inside its own pipeline, so only small frames are piped)
+        sampling: How frames are scaled to size: 'area' averages each block of
+                  pixels, 'point' keeps one pixel of each block (nearest neighbour)
+
+    Yields:
+        (frame_index, gray_frame) tuples
+    """
+    if use_ffmpeg is None:
+        use_ffmpeg = ffmpeg_available()
+    properties = get_video_properties(video_path)
+    if properties is None:
+        raise IOError(f"Could not open video: {video_path}")
+
+    if use_ffmpeg:
+        frames = _iter_gray_frames_ffmpeg(video_path, properties, start_frame, end_frame, size, sampling)
+    else:
+        frames = _iter_frames_opencv(video_path, start_frame, end_frame, gray=True, size=size, sampling=sampling)
+    if prefetch_depth > 0:
+        frames = prefetch(frames, prefetch_depth, stats)
+    yield from frames
+
+
+def iter_color_frames(video_path, start_frame=0, end_frame=None,
+                      prefetch_depth=PREFETCH_DEPTH, stats=None):
+    """
+    Yield BGR frames of a video, for analyzers that draw on or write out color frames
+
+    Args:
+        video_path: Path to the video
+        start_frame: First frame to yield
+        end_frame: Last frame to yield (inclusive), None for the end of the video
+        prefetch_depth: Frames decoded ahead on a background thread, 0 to decode inline
+        stats: Optional PrefetchStats collecting queue depth and stall times
+
+    Yields:
+        (frame_index, frame) tuples
+    """
+    if get_video_properties(video_path) is None:
+        raise IOError(f"Could not open video: {video_path}")
+    frames = _iter_frames_opencv(video_path, start_frame, end_frame, gray=False)
+    if prefetch_depth > 0:
+        frames = prefetch(frames, prefetch_depth, stats)
+    yield from frames
+
+
+def read_gray_frame(video_path, frame_index, use_ffmpeg=None):
+    """Read a single grayscale frame through the same decode path as iter_gray_frames."""
+    for _, gray in iter_gray_frames(video_path, frame_index, frame_index, use_ffmpeg, prefetch_depth=0):
+        return gray
+    return None
+
+
+def read_color_frame(video_path, frame_index):
+    """Read a single BGR frame, for backgrounds and overlays that need color."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    ret, frame = cap.retrieve() if _seek_opencv(cap, video_path, frame_index) else (False, None)
+    cap.release()
+    return frame if ret else None
+
+
+def _iter_gray_frames_ffmpeg(video_path, properties, start_frame, end_frame, size=None, sampling='area'):
+    width, height = size or (properties['width'], properties['height'])
+    fps = properties['fps']
+    frame_size = width * height
+
+    cmd = [FFMPEG_BIN, '-v', 'error']
+    skip = 0
+    index = load_seek_index(video_path) if start_frame > 0 else None
+    if index is not None:
+        # Seek to the keyframe itself (the seek time lies just before its
+        # timestamp) and count the remaining frames ourselves, which stays
+        # exact when the frame rate varies
+        keyframe, _, seek_time = keyframe_before(index, start_frame)
+        if keyframe > 0:
+            cmd += ['-ss', f"{seek_time:.6f}"]
+        skip = start_frame - keyframe
+    elif start_frame > 0 and fps > 0:
+        # No index: accurate input seek to the timestamp of start_frame
+        # (half a frame early to absorb timestamp rounding)
+        cmd += ['-ss', f"{(start_frame - 0.5) / fps:.6f}"]
+    cmd += ['-i', video_path, '-map', '0:v:0', '-vsync', '0']
+    if size:
+        cmd += ['-vf', f"scale={width}:{height}:flags={FFMPEG_SCALE_FLAGS[sampling]}"]
+    cmd += ['-f', 'rawvideo', '-pix_fmt', 'gray', '-']
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               bufsize=frame_size)
+    frame_index = start_frame
+    try:
+        for _ in range(skip):
+            if len(process.stdout.read(frame_size)) < frame_size:
+                return
+        while end_frame is None or frame_index <= end_frame:
+            buffer = process.stdout.read(frame_size)
+            if len(buffer) < frame_size:
+                break
+            yield frame_index, np.frombuffer(buffer, dtype=np.uint8).reshape(height, width)
+            frame_index += 1
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def _iter_frames_opencv(video_path, start_frame, end_frame, gray, size=None, sampling='area'):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        grabbed = _seek_opencv(cap, video_path, start_frame)
+        frame_index = start_frame
+        while grabbed and (end_frame is None or frame_index <= end_frame):
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            if gray:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if size:
+                frame = cv2.resize(frame, size, interpolation=OPENCV_INTERPOLATION[sampling])
+            yield frame_index, frame
+            frame_index += 1
+            grabbed = cap.grab()
+    finally:
+        cap.release()
+
+
+def _seek_opencv(cap, video_path, frame_index):
+    """
+    Grab frame_index, so cap.retrieve() returns it and read() the frames after it
+
+    OpenCV maps seek times to frames with the nominal frame rate, which
+    lands on the wrong frame (or past the end) when the rate varies, as in
+    WebM recordings. The seek therefore goes to the keyframe's timestamp
+    from the index and checks the timestamps of the decoded frames: frames
+    are grabbed until the keyframe is reached, seeking earlier when OpenCV
+    landed past it, and the remaining frames are counted as in
+    _iter_gray_frames_ffmpeg.
+
+    Returns:
+        True if the frame was grabbed, False if the video ends before it
+    """
+    index = load_seek_index(video_path) if frame_index > 0 else None
+    if index is None:
+        if frame_index > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        return cap.grab()
+    keyframe, keyframe_time, seek_time = keyframe_before(index, frame_index)
+    if keyframe > 0:
+        while not _seek_opencv_time(cap, seek_time, keyframe_time):
+            if seek_time == 0:
+                return False
+            seek_time = seek_time / 2 if seek_time > 1 else 0.0
+    elif not cap.grab():
+        return False
+    for _ in range(frame_index - keyframe):
+        if not cap.grab():
+            return False
+    return True
+
+
+def _seek_opencv_time(cap, seek_time, keyframe_time):
+    """Seek to seek_time and grab frames up to the keyframe at keyframe_time; False if it was not reached."""
+    cap.set(cv2.CAP_PROP_POS_MSEC, seek_time * 1000)
+    while cap.grab():
+        position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if position >= keyframe_time - SEEK_TIME_TOLERANCE:
+            return position <= keyframe_time + SEEK_TIME_TOLERANCE
+    return False
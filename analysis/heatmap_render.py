@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import cv2
+import numpy as np
+
+# Heatmap figures drawn with OpenCV and NumPy instead of matplotlib. The layout
+# follows matplotlib's default figure (12x8 inches at 100 dpi, subplot margins,
+# a colorbar taking 15% of the width with 5% padding, 10pt tick labels), so the
+# images keep their size and the heatmap and colorbar land on the same pixels.
+# Text is drawn with OpenCV's Hershey font, stretched to the widths of the
+# DejaVu Sans glyphs matplotlib uses, so text boxes (and cropping) stay the same.
+PT = 100 / 72.0  # Pixels per point at 100 dpi
+FIGURE_SIZE = (1200, 800)
+SUBPLOT_BOX = (0.125, 0.12, 0.9, 0.89)  # left, top, right, bottom (fractions, from the top)
+COLORBAR_FRACTION = 0.15
+COLORBAR_PAD = 0.05
+COLORBAR_ASPECT = 20
+TICK_LENGTH = 3.5 * PT
+TICK_PAD = 3.5 * PT
+TICK_FONT_SIZE = 10 * PT
+TITLE_FONT_SIZE = 12 * PT
+TITLE_PAD = 6 * PT
+LABEL_PAD = 4 * PT
+ANNOTATION_FONT_SIZE = 8 * PT
+BACKGROUND_ALPHA = 0.3
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+# Cap height and ascent of the font the layout was measured with, as a fraction of its size.
+# Multi-line text has a lower first line and wider line spacing, as laid out by matplotlib.
+CAP_HEIGHT = 0.73
+ASCENT = 0.76
+TITLE_ASCENT = 0.78  # 12pt glyphs are hinted taller
+MULTILINE_ASCENT = 0.66
+MULTILINE_SPACING = 1.45
+# DejaVu Sans advance widths of the printable ASCII characters (space to ~), in ems
+GLYPH_WIDTHS = dict(zip(map(chr, range(32, 127)), (
+    0.318, 0.401, 0.46, 0.838, 0.636, 0.95, 0.78, 0.275, 0.39, 0.39, 0.5, 0.838,
+    0.318, 0.361, 0.318, 0.337, 0.636, 0.636, 0.636, 0.636, 0.636, 0.636, 0.636, 0.636,
+    0.636, 0.636, 0.337, 0.337, 0.838, 0.838, 0.838, 0.531, 1.0, 0.684, 0.686, 0.698,
+    0.77, 0.632, 0.575, 0.775, 0.752, 0.295, 0.295, 0.656, 0.557, 0.863, 0.748, 0.787,
+    0.603, 0.787, 0.695, 0.635, 0.611, 0.732, 0.684, 0.989, 0.685, 0.611, 0.685, 0.39,
+    0.337, 0.39, 0.838, 0.5, 0.5, 0.613, 0.635, 0.55, 0.635, 0.615, 0.352, 0.635,
+    0.634, 0.278, 0.278, 0.579, 0.278, 0.974, 0.634, 0.612, 0.635, 0.635, 0.411, 0.521,
+    0.392, 0.634, 0.592, 0.818, 0.592, 0.592, 0.525, 0.636, 0.337, 0.636, 0.838,
+)))
+DEFAULT_GLYPH_WIDTH = 0.6
+
+# Colormaps as (position, red, green, blue) control points, from matplotlib's
+# colormap data. coolwarm is sampled at 33 equally spaced positions.
+_COOLWARM = np.array([
+    (0.22980570, 0.29871797, 0.75368315),
+    (0.26623388, 0.35309484, 0.80146676),
+    (0.30386891, 0.40653530, 0.84495867),
+    (0.34280448, 0.45875762, 0.88372590),
+    (0.38301334, 0.50941904, 0.91738782),
+    (0.42436961, 0.55814809, 0.94561959),
+    (0.46666708, 0.60456257, 0.96815491),
+    (0.50963520, 0.64828077, 0.98478814),
+    (0.55295316, 0.68892933, 0.99537561),
+    (0.59626216, 0.72614911, 0.99983620),
+    (0.63917621, 0.75959995, 0.99815118),
+    (0.68129128, 0.78896471, 0.99036323),
+    (0.72219329, 0.81395274, 0.97657471),
+    (0.76146495, 0.83430288, 0.95694527),
+    (0.79869164, 0.84978614, 0.93168865),
+    (0.83346656, 0.86020798, 0.90106884),
+    (0.86539520, 0.86541021, 0.86539556),
+    (0.89778718, 0.84893705, 0.82088055),
+    (0.92412759, 0.82738488, 0.77450847),
+    (0.94446852, 0.80092744, 0.72673615),
+    (0.95885295, 0.76976775, 0.67800794),
+    (0.96732803, 0.73413281, 0.62875176),
+    (0.96995414, 0.69426668, 0.57937545),
+    (0.96681118, 0.65042116, 0.53026376),
+    (0.95800306, 0.60284243, 0.48177591),
+    (0.94366087, 0.55175097, 0.43424368),
+    (0.92394492, 0.49730856, 0.38797023),
+    (0.89904617, 0.43955947, 0.34322960),
+    (0.86918685, 0.37831309, 0.30026718),
+    (0.83462054, 0.31287445, 0.25930120),
+    (0.79563175, 0.24128379, 0.22052563),
+    (0.75253493, 0.15724607, 0.18411512),
+    (0.70567316, 0.01555616, 0.15023281),
+])
+COLORMAPS = {
+    'coolwarm': [(np.linspace(0, 1, len(_COOLWARM)), _COOLWARM[:, channel]) for channel in range(3)],
+    'jet': [
+        ((0, 0.35, 0.66, 0.89, 1), (0, 0, 1, 1, 0.5)),
+        ((0, 0.125, 0.375, 0.64, 0.91, 1), (0, 0, 1, 1, 0, 0)),
+        ((0, 0.11, 0.34, 0.65, 1), (0.5, 1, 1, 0, 0)),
+    ],
+    'gray': [((0, 1), (0, 1))] * 3,
+}
+_LUTS = {}
+_BUFFERS = {}
+MAX_BUFFERS = 12
+
+
+def colormap_lut(name):
+    """
+    256-entry BGR lookup table of a colormap
+
+    Args:
+        name: 'coolwarm', 'jet' or 'gray'
+
+    Returns:
+        uint8 array of shape (256, 3)
+    """
+    if name not in _LUTS:
+        positions = np.arange(256)
+        lut = np.stack([np.interp(positions, np.asarray(x) * 255, y) for x, y in COLORMAPS[name]], axis=1)
+        # Truncated like matplotlib's 8-bit colormap lookup
+        _LUTS[name] = np.ascontiguousarray((np.clip(lut, 0, 1) * 255).astype(np.uint8)[:, ::-1])
+    return _LUTS[name]
+
+
+def _snap(value):
+    # Nearest pixel edge, rounding halves up
+    return int(np.floor(value + 0.5))
+
+
+def _buffer(name, shape, dtype=np.uint8):
+    # Render buffers are reused between figures of the same size; the oldest
+    # are dropped so a long-running worker does not keep a set per resolution
+    key = (name, shape, np.dtype(dtype))
+    if key not in _BUFFERS:
+        while len(_BUFFERS) >= MAX_BUFFERS:
+            _BUFFERS.pop(next(iter(_BUFFERS)))
+        _BUFFERS[key] = np.empty(shape, dtype=dtype)
+    return _BUFFERS[key]
+
+
+def colormap_indices(values, vmin, vmax):
+    """Map values to colormap entries 0..255 the way matplotlib's Normalize does."""
+    if vmax <= vmin:
+        return np.zeros(values.shape, dtype=np.uint8)
+    scaled = (values.astype(np.float64) - vmin) * (256.0 / (vmax - vmin))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def apply_colormap(values, name, vmin, vmax, out=None):
+    """
+    Color a 2D array with a colormap
+
+    Args:
+        values: 2D array
+        name: Colormap name (see COLORMAPS)
+        vmin: Value mapped to the first color
+        vmax: Value mapped to the last color
+        out: Optional uint8 (h, w, 3) array to write into
+
+    Returns:
+        BGR uint8 image
+    """
+    return np.take(colormap_lut(name), colormap_indices(values, vmin, vmax), axis=0, out=out)
+
+
+def nice_ticks(vmin, vmax, length):
+    """
+    Colorbar tick values, chosen like matplotlib's default tick locator
+
+    Args:
+        vmin: Bottom of the colorbar
+        vmax: Top of the colorbar
+        length: Colorbar length in pixels (longer bars get more ticks)
+
+    Returns:
+        List of tick values between vmin and vmax
+    """
+    if vmax <= vmin:
+        return [vmin]
+    nbins = int(np.clip(np.floor(length / PT / (2 * 10)), 1, 9))
+    raw_step = (vmax - vmin) / nbins
+    scale = 10 ** np.floor(np.log10(raw_step))
+    step = next(s * scale for s in (1, 2, 2.5, 5, 10) if s * scale >= raw_step * (1 - 1e-9))
+    first = np.ceil(vmin / step - 1e-9) * step
+    ticks = first + step * np.arange(int(np.floor((vmax - first) / step + 1e-9)) + 1)
+    return [0.0 if abs(t) < step * 1e-9 else float(t) for t in ticks]
+
+
+def format_ticks(ticks):
+    """Tick labels with the same number of decimals, plus an exponent label for large or tiny values."""
+    largest = max(abs(t) for t in ticks)
+    exponent = int(np.floor(np.log10(largest))) if largest else 0
+    if not -5 < exponent < 6:
+        ticks = [t / 10 ** exponent for t in ticks]
+        offset = f"1e{exponent}"
+    else:
+        offset = None
+    decimals = 0
+    for t in ticks:
+        while decimals < 6 and abs(round(t, decimals) - t) > 1e-9 * max(1.0, abs(t)):
+            decimals += 1
+    return [f"{t:.{decimals}f}" for t in ticks], offset
+
+
+def text_width(line, size):
+    """Width in pixels of one line of text at the given font size in pixels."""
+    return sum(GLYPH_WIDTHS.get(char, DEFAULT_GLYPH_WIDTH) for char in line) * size
+
+
+def _text_mask(text, size, ascent=ASCENT):
+    # Coverage mask of (possibly multi-line) text, the baseline of its last line and its box size
+    scale = CAP_HEIGHT * size / cv2.getTextSize('H', FONT, 1.0, 1)[0][1]
+    lines = text.split('\n')
+    # Rendered text covers whole pixels horizontally
+    box_width = max(1, int(np.ceil(max(text_width(line, size) for line in lines))))
+    ascent = (ascent if len(lines) == 1 else MULTILINE_ASCENT) * size
+    step = MULTILINE_SPACING * size
+    box_height = size + step * (len(lines) - 1)
+    height = int(np.ceil(box_height))
+    mask = np.zeros((height, box_width), dtype=np.uint8)
+    for i, line in enumerate(lines):
+        line_width = int(round(text_width(line, size)))
+        if not line.strip() or line_width < 1:
+            continue
+        (drawn_width, _), _ = cv2.getTextSize(line, FONT, scale, 1)
+        baseline = int(round(ascent + step * i))
+        line_mask = np.zeros((height, drawn_width + 2), dtype=np.uint8)
+        cv2.putText(line_mask, line, (1, baseline), FONT, scale, 255, 1, cv2.LINE_AA)
+        mask[:, :line_width] = np.maximum(mask[:, :line_width], cv2.resize(line_mask, (line_width, height),
+                                                                           interpolation=cv2.INTER_AREA))
+    return mask, ascent + step * (len(lines) - 1), (box_width, box_height)
+
+
+class Figure:
+    """
+    A white figure canvas with a margin, so text can run past the figure edge
+    before the figure is cropped to its content (like bbox_inches='tight')
+    """
+
+    def __init__(self, width, height, margin=64):
+        self.width = width
+        self.height = height
+        self.margin = margin
+        self.pixels = _buffer('figure', (height + 2 * margin, width + 2 * margin, 3))
+        self.pixels.fill(255)
+        self.extents = []
+
+    def _region(self, x, y, w, h):
+        # Canvas slices of a rectangle in figure pixels, clipped to the canvas
+        x0 = max(_snap(x) + self.margin, 0)
+        y0 = max(_snap(y) + self.margin, 0)
+        x1 = min(_snap(x + w) + self.margin, self.pixels.shape[1])
+        y1 = min(_snap(y + h) + self.margin, self.pixels.shape[0])
+        return slice(y0, max(y0, y1)), slice(x0, max(x0, x1))
+
+    def image(self, rect, image, extent=True):
+        """Draw a BGR image filling rect (x, y, w, h); image must already have the rect's pixel size."""
+        rows, cols = self._region(*rect)
+        self.pixels[rows, cols] = image[:rows.stop - rows.start, :cols.stop - cols.start]
+        if extent:
+            self.extents.append(rect)
+
+    def fill(self, rect, color):
+        rows, cols = self._region(*rect)
+        self.pixels[rows, cols] = color
+
+    def frame(self, rect, color=(0, 0, 0)):
+        x, y, w, h = rect
+        for edge in ((x, y, w, 1), (x, y + h - 1, w, 1), (x, y, 1, h), (x + w - 1, y, 1, h)):
+            self.fill(edge, color)
+
+    def text(self, text, x, y, size, color=(0, 0, 0), ha='left', va='baseline', rotate=False,
+             background=None, extent=True, ascent=ASCENT):
+        """
+        Draw text anchored at (x, y)
+
+        Args:
+            text: Text, may contain newlines
+            x, y: Anchor in figure pixels
+            size: Font size in pixels
+            color: BGR text color
+            ha: 'left', 'center' or 'right'
+            va: 'baseline' (of the last line), 'center', 'center_baseline'
+                (center of a line without its descent), 'bottom' or 'top'
+            rotate: Rotate by 90 degrees counter-clockwise
+            background: Optional BGR box color behind the text
+            extent: Count the text for the tight bounding box
+            ascent: Height of a single line above its baseline, as a fraction of size
+
+        Returns:
+            The text rectangle (x, y, w, h)
+        """
+        mask, baseline, (w, h) = _text_mask(text, size, ascent)
+        if rotate:
+            mask = np.rot90(mask)
+            w, h = h, w
+        x -= {'left': 0, 'center': w / 2, 'right': w}[ha]
+        y -= {'baseline': baseline, 'center': h / 2, 'center_baseline': baseline / 2, 'bottom': h, 'top': 0}[va]
+        if background is not None:
+            pad = 0.3 * size
+            self.fill((x - pad, y - pad, w + 2 * pad, h + 2 * pad), background)
+        rows, cols = self._region(_snap(x), _snap(y), mask.shape[1], mask.shape[0])
+        target = self.pixels[rows, cols]
+        alpha = mask[:target.shape[0], :target.shape[1], None].astype(np.float32) / 255
+        target[:] = (target * (1 - alpha) + np.asarray(color, np.float32) * alpha + 0.5).astype(np.uint8)
+        if extent:
+            self.extents.append((x, y, w, h))
+        return x, y, w, h
+
+    def save(self, path, tight_pad=None):
+        """
+        Write the figure as an image
+
+        Args:
+            path: Output path
+            tight_pad: None to write the whole figure, or crop it to the drawn
+                       content plus this many pixels of padding
+        """
+        if tight_pad is None:
+            x0, y1, width, height = 0, self.height, self.width, self.height
+        else:
+            x0 = min(x for x, _, _, _ in self.extents) - tight_pad
+            y0 = min(y for _, y, _, _ in self.extents) - tight_pad
+            x1 = max(x + w for x, _, w, _ in self.extents) + tight_pad
+            y1 = max(y + h for _, y, _, h in self.extents) + tight_pad
+            # Whole pixels only; like matplotlib, the fraction is cut from the right and top
+            width, height = int(x1 - x0), int(y1 - y0)
+        left = _snap(x0) + self.margin
+        bottom = _snap(y1) + self.margin
+        cv2.imwrite(path, self.pixels[max(bottom - height, 0):bottom, max(left, 0):left + width])
+        return path
+
+
+def colorbar_layout(box, image_width, image_height):
+    """
+    Split an axes box into the image and colorbar rectangles, like plt.colorbar()
+
+    Args:
+        box: (x, y, w, h) of the axes area in figure pixels (y from the top)
+        image_width, image_height: Image size, for the aspect ratio
+
+    Returns:
+        (image_rect, colorbar_rect)
+    """
+    x, y, w, h = box
+    parent = (x, y, w * (1 - COLORBAR_FRACTION - COLORBAR_PAD), h)
+    # The colorbar keeps its aspect ratio and sits at the left of its slot, vertically centered
+    bar_w = min(w * COLORBAR_FRACTION, h / COLORBAR_ASPECT)
+    bar_h = bar_w * COLORBAR_ASPECT
+    colorbar = (x + w * (1 - COLORBAR_FRACTION), y + (h - bar_h) / 2, bar_w, bar_h)
+    # The image keeps its aspect ratio and moves next to the colorbar
+    scale = min(parent[2] / image_width, parent[3] / image_height)
+    img_w, img_h = image_width * scale, image_height * scale
+    image = (parent[0] + parent[2] - img_w, y + (h - img_h) / 2, img_w, img_h)
+    return image, colorbar
+
+
+def _pixel_size(rect):
+    return max(1, _snap(rect[0] + rect[2]) - _snap(rect[0])), max(1, _snap(rect[1] + rect[3]) - _snap(rect[1]))
+
+
+def draw_colorbar(figure, rect, name, vmin, vmax, label=None):
+    """
+    Draw a vertical colorbar with ticks, tick labels and an optional label
+
+    Args:
+        figure: Figure to draw on
+        rect: Colorbar rectangle from colorbar_layout
+        name: Colormap name
+        vmin, vmax: Value range of the colormap
+        label: Optional label to the right of the tick labels
+    """
+    w, h = _pixel_size(rect)
+    # 256 color bands, the top band at the top
+    bands = np.minimum((np.arange(h)[::-1] + 0.5) * 256 // h, 255).astype(np.uint8)
+    gradient = _buffer('colorbar', (h, w, 3))
+    gradient[:] = colormap_lut(name)[bands][:, None, :]
+    figure.image(rect, gradient)
+    figure.frame((_snap(rect[0]), _snap(rect[1]), w, h))
+
+    ticks = nice_ticks(vmin, vmax, rect[3])
+    labels, offset = format_ticks(ticks)
+    right = rect[0] + rect[2]
+    label_right = right
+    for tick, text in zip(ticks, labels):
+        y = rect[1] + rect[3] * (1 - (tick - vmin) / (vmax - vmin) if vmax > vmin else 1)
+        figure.fill((right, y - 0.5, TICK_LENGTH, 1), (0, 0, 0))
+        tx, _, tw, _ = figure.text(text, right + TICK_LENGTH + TICK_PAD, y, TICK_FONT_SIZE,
+                                    va='center_baseline')
+        label_right = max(label_right, tx + tw)
+    if offset:
+        figure.text(offset, right, rect[1] - TICK_PAD, TICK_FONT_SIZE, ha='center', va='bottom')
+    if label:
+        figure.text(label, label_right + LABEL_PAD, rect[1] + rect[3] / 2, TICK_FONT_SIZE, va='center', rotate=True)
+
+
+def blend_background(colored, background, rect, alpha=BACKGROUND_ALPHA):
+    """
+    Blend a background frame over a colored heatmap, like imshow(background, cmap='gray', alpha=0.3)
+
+    Args:
+        colored: BGR heatmap image at display size (modified in place)
+        background: Grayscale (stretched from its min to max) or 3-channel frame
+        rect: Display rectangle, for the resampling direction
+        alpha: Background opacity
+    """
+    h, w = colored.shape[:2]
+    shrinking = w < background.shape[1]
+    resized = cv2.resize(background, (w, h), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+    if resized.ndim == 2:
+        resized = apply_colormap(resized, 'gray', float(background.min()), float(background.max()),
+                                 out=_buffer('background', (h, w, 3)))
+    else:
+        # Colour frames are shown with their channels as stored
+        resized = resized[:, :, ::-1]
+    cv2.addWeighted(colored, 1 - alpha, resized, alpha, 0, dst=colored)
+
+
+def render_overlay_heatmap(path, heatmap_uint8, background, title, annotation=None, tight=False):
+    """
+    Render a 0..255 heatmap in coolwarm, blended with its background frame
+
+    Matches the 12x8 inch matplotlib figure of imshow(coolwarm, nearest), colorbar,
+    title, imshow(background, gray, alpha=0.3) and an optional bottom-left annotation.
+
+    Args:
+        path: Output image path
+        heatmap_uint8: Heatmap normalized to 0..255
+        background: Background frame of the same size
+        title: Title above the heatmap
+        annotation: Optional text in a black box at the bottom-left corner
+        tight: Crop to the content with a 10 pixel margin (bbox_inches='tight', pad_inches=0.1)
+
+    Returns:
+        path
+    """
+    fig_w, fig_h = FIGURE_SIZE
+    left, top, right, bottom = SUBPLOT_BOX
+    figure = Figure(fig_w, fig_h)
+    box = (left * fig_w, top * fig_h, (right - left) * fig_w, (bottom - top) * fig_h)
+    image_rect, colorbar_rect = colorbar_layout(box, heatmap_uint8.shape[1], heatmap_uint8.shape[0])
+
+    w, h = _pixel_size(image_rect)
+    resized = cv2.resize(heatmap_uint8, (w, h), interpolation=cv2.INTER_NEAREST_EXACT)
+    colored = apply_colormap(resized, 'coolwarm', 0, 255, out=_buffer('image', (h, w, 3)))
+    blend_background(colored, background, image_rect)
+    figure.image(image_rect, colored)
+    draw_colorbar(figure, colorbar_rect, 'coolwarm', 0, 255)
+    figure.text(title, image_rect[0] + image_rect[2] / 2, image_rect[1] - TITLE_PAD, TITLE_FONT_SIZE, ha='center',
+                ascent=TITLE_ASCENT)
+    if annotation:
+        figure.text(annotation, 0.01 * fig_w, 0.99 * fig_h, ANNOTATION_FONT_SIZE, color=(255, 255, 255),
+                    background=(0, 0, 0))
+    return figure.save(path, tight_pad=10 if tight else None)
+
+
+def render_colorbar_heatmap(path, heatmap_data, name='jet', label=None):
+    """
+    Render a heatmap with a colorbar and no margins, in a figure the size of the heatmap
+
+    Matches imshow(cmap, interpolation='bilinear') with a labelled colorbar saved
+    with bbox_inches='tight' and pad_inches=0; the colors span the data range.
+
+    Args:
+        path: Output image path
+        heatmap_data: 2D heatmap (any range)
+        name: Colormap name
+        label: Optional colorbar label
+
+    Returns:
+        path
+    """
+    frame_h, frame_w = heatmap_data.shape
+    figure = Figure(frame_w, frame_h)
+    image_rect, colorbar_rect = colorbar_layout((0, 0, frame_w, frame_h), frame_w, frame_h)
+    vmin, vmax = float(heatmap_data.min()), float(heatmap_data.max())
+
+    w, h = _pixel_size(image_rect)
+    resized = cv2.resize(heatmap_data.astype(np.float32), (w, h), interpolation=cv2.INTER_LINEAR)
+    figure.image(image_rect, apply_colormap(resized, name, vmin, vmax, out=_buffer('image', (h, w, 3))))
+    draw_colorbar(figure, colorbar_rect, name, vmin, vmax, label=label)
+    return figure.save(path, tight_pad=0)
@@ -1,10 +1,11 @@
-import boto3
 import os
 import tempfile
 from analyse_m_s import analyze_screen
+import common_path  # puts ../common (shared modules) on the import path
+from media_cache import default_cache
+from s3_client import s3
 
 BUCKET = 'cs14-2-recordingtool'
-s3 = boto3.client('s3')
 
 def list_screen_files(prefix='recording_results/'):
     paginator = s3.get_paginator('list_objects_v2')
@@ -15,9 +16,7 @@ def list_screen_files(prefix='recording_results/'):
                 yield key
 
 def process_and_upload(key):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        local_path = os.path.join(tmpdir, 'screen.webm')
-        s3.download_file(BUCKET, key, local_path)
+    with tempfile.TemporaryDirectory() as tmpdir, default_cache().fetch(s3, BUCKET, key) as local_path:
         output_dir = os.path.join(tmpdir, 'result')
         os.makedirs(output_dir, exist_ok=True)
         analyze_screen(local_path, output_dir, "2025-05-21", "User494494")
@@ -4,17 +4,46 @@
 # In[ ]:
 
 
-import boto3
+import contextlib
+import json
 import os
+import sys
 import tempfile
+import time
 import subprocess
-from analyse_m_s import analyze_screen
 from datetime import datetime
 import getpass
+import common_path  # puts ../common (shared modules) on the import path
+from instrumentation import current_span, span
+from media_cache import default_cache
+from lazy_client import import_in_background
+from s3_client import s3
 
 
 BUCKET = 'cs14-2-recordingtool'
-s3 = boto3.client('s3')
+# The analysis modules (OpenCV, NumPy) are imported on first use, or in the
+# background by main() while the S3 client lists the recordings
+ANALYSIS_MODULES = ('analyse_m_s', 'aggregate')
+# Project-level heatmaps live next to the sessions, as Output/<project>/<AGGREGATE_FOLDER>/task_N/
+AGGREGATE_FOLDER = 'aggregate'
+# Workers update a task aggregate one at a time, holding the lock object
+# <aggregate prefix><AGGREGATE_LOCK> (created with a conditional put) ...
+AGGREGATE_LOCK = 'aggregate.lock'
+# ... which is taken over once it is this many seconds old (its worker died) ...
+AGGREGATE_LOCK_TIMEOUT = 600
+# ... and checked every AGGREGATE_LOCK_POLL seconds, for at most AGGREGATE_LOCK_WAIT seconds
+AGGREGATE_LOCK_POLL = 2
+AGGREGATE_LOCK_WAIT = 900
+# Daemon mode: seconds between scans of the bucket once no recording is waiting
+POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', '60'))
+# Daemon mode: a recording that failed this many times is not retried until the daemon restarts
+MAX_ATTEMPTS = 3
+# Queue mode: the work queue this worker consumes (see common/work_queue.py; the backend publishes every upload)
+WORK_QUEUE_NAME = os.environ.get('WORK_QUEUE_NAME', 'analysis')
+# Session mode: clips and screenshots of key frames go to <KEY_FRAMES_PREFIX>/<session>/, as
+# preprocessing/process_from_s3.py writes them, for the task it handles
+KEY_FRAMES_PREFIX = 'Output/Video Splitting'
+KEY_FRAMES_TASK = 'task_1'
 
 def convert_webm_to_mp4(input_path, output_path):
     """
@@ -81,21 +110,31 @@ def process_and_upload(key):
     
     Args:
         key: S3 key of the WebM file to process
+    
+    Returns:
+        bool: True if the results were uploaded, False otherwise
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
+    from analyse_m_s import analyze_screen
+
+    with span('session', key=key) as session, tempfile.TemporaryDirectory() as tmpdir, \
+            contextlib.ExitStack() as media:
         try:
-            # Step 1: Download the original WebM file
-            webm_path = os.path.join(tmpdir, 'screen.webm')
+            # Step 1: Download the original WebM file, or reuse the copy in the
+            # local media cache (shared with the other pipelines on this host)
             print(f"Downloading {key}...")
-            s3.download_file(BUCKET, key, webm_path)
+            with span('download', files=1):
+                webm_path = media.enter_context(default_cache().fetch(s3, BUCKET, key))
             
             # Step 2: Convert WebM to MP4
             mp4_path = os.path.join(tmpdir, 'screen.mp4')
             print(f"Converting {os.path.basename(key)} to MP4...")
             
-            if not convert_webm_to_mp4(webm_path, mp4_path):
+            with span('transcode', input_bytes=os.path.getsize(webm_path)) as stage:
+                converted = convert_webm_to_mp4(webm_path, mp4_path)
+                stage.set(ok=converted, bytes=os.path.getsize(mp4_path) if converted else 0)
+            if not converted:
                 print(f"Skipping {key} due to conversion failure")
-                return
+                return False
             
             # Step 3: Process the MP4 file (no changes to existing analysis)
             output_dir = os.path.join(tmpdir, 'result')
@@ -108,25 +147,283 @@ def process_and_upload(key):
             
             # Step 4: Upload all analysis results to S3
             print(f"Uploading results for {os.path.basename(key)}...")
-            upload_count = 0
+            rel_parent = os.path.dirname(key).replace('recording_results/', '', 1)
+            with span('upload', files=0, bytes=0):
+                upload_count = upload_folder(output_dir, 'Output/' + rel_parent)
             
-            for root, dirs, files in os.walk(output_dir):
-                for file in files:
-                    abs_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(abs_path, output_dir)
-                    rel_parent = os.path.dirname(key).replace('recording_results/', '', 1)
-                    output_key = 'Output/' + rel_parent + '/' + rel_path
-                    
-                    s3.upload_file(abs_path, BUCKET, output_key)
-                    upload_count += 1
-                    print(f"  Uploaded {output_key}")
+            print(f"Successfully processed {key} - uploaded {upload_count} files")
+            
+            # Step 5: Fold the session into the project-level heatmaps
+            try:
+                with span('aggregate'):
+                    update_task_aggregate(key, output_dir, tmpdir, current_date, current_user)
+            except Exception as e:
+                print(f"Error updating the project aggregate for {key}: {str(e)}")
+            return True
+            
+        except Exception as e:
+            print(f"Error processing {key}: {str(e)}")
+            session.set(error=str(e))
+            return False
+        
+        # Note: tmpdir is automatically cleaned up here (the WebM file stays in the media cache)
+
+def process_session_and_upload(key):
+    """
+    Run the unified session pipeline on a recording and upload all of its results
+    
+    The screen and audio recordings of the session are decoded once each
+    (see session_pipeline.py) to produce the heatmaps, the transcript and
+    the key frame clips and screenshots, which land where the separate
+    analysis and preprocessing jobs put them.
+    
+    Args:
+        key: S3 key of the session's screen.webm (audio.webm is next to it)
+    
+    Returns:
+        bool: True if the results were uploaded, False otherwise
+    """
+    from session_pipeline import run_session
+
+    rel_parent = os.path.dirname(key).replace('recording_results/', '', 1)
+    parts = rel_parent.split('/')
+    audio_key = os.path.dirname(key) + '/audio.webm'
+
+    with span('session', key=key, pipeline='unified') as session, tempfile.TemporaryDirectory() as tmpdir, \
+            contextlib.ExitStack() as media:
+        try:
+            print(f"Downloading {key}...")
+            with span('download', files=1):
+                webm_path = media.enter_context(default_cache().fetch(s3, BUCKET, key))
+            try:
+                with span('download', files=1):
+                    audio_path = media.enter_context(default_cache().fetch(s3, BUCKET, audio_key))
+            except s3.exceptions.ClientError:
+                print(f"  No audio recording at {audio_key}")
+                audio_path = None
+            
+            current_date = datetime.utcnow().strftime("%Y-%m-%d")
+            current_user = getpass.getuser()
+            result = run_session(webm_path, audio_path, tmpdir, current_date, current_user,
+                                 key_frames=len(parts) >= 3 and parts[-1] == KEY_FRAMES_TASK)
+            if result is None:
+                print(f"Skipping {key}: the recording could not be decoded")
+                return False
             
+            print(f"Uploading results for {os.path.basename(key)}...")
+            with span('upload', files=0, bytes=0):
+                upload_count = upload_folder(result['analysis'], 'Output/' + rel_parent)
+                if result['key_frames']:
+                    upload_count += upload_folder(result['key_frames'], f"{KEY_FRAMES_PREFIX}/{parts[1]}")
             print(f"Successfully processed {key} - uploaded {upload_count} files")
             
+            try:
+                with span('aggregate'):
+                    update_task_aggregate(key, result['analysis'], tmpdir, current_date, current_user)
+            except Exception as e:
+                print(f"Error updating the project aggregate for {key}: {str(e)}")
+            return True
+            
         except Exception as e:
             print(f"Error processing {key}: {str(e)}")
+            session.set(error=str(e))
+            return False
+
+def upload_folder(local_dir, prefix):
+    """
+    Upload every file under a local folder to <prefix>/<relative path>
+    
+    Args:
+        local_dir: Local folder
+        prefix: S3 key prefix (without a trailing slash)
+    
+    Returns:
+        int: Number of files uploaded
+    """
+    upload_count = 0
+    for root, dirs, files in os.walk(local_dir):
+        for file in files:
+            abs_path = os.path.join(root, file)
+            rel_path = os.path.relpath(abs_path, local_dir).replace(os.sep, '/')
+            output_key = prefix + '/' + rel_path
+            
+            s3.upload_file(abs_path, BUCKET, output_key)
+            upload_count += 1
+            current_span().add(files=1, bytes=os.path.getsize(abs_path))
+            print(f"  Uploaded {output_key}")
+    return upload_count
+
+def update_task_aggregate(key, output_dir, tmpdir, timestamp, user):
+    """
+    Add an analyzed session to the aggregate heatmaps of its project and task
+    
+    Only the aggregate's index and the accumulators of the screens the
+    session may have shown (see aggregate.candidate_screens) are downloaded,
+    and only the screens the session visited are uploaded again. The update
+    runs under the task's aggregate lock, so concurrent workers do not
+    overwrite each other's sessions; an update retried after a crash is not
+    counted twice, as every accumulator records the sessions merged into it.
+    
+    Args:
+        key: S3 key of the session's WebM file
+        output_dir: Local analysis results of the session
+        tmpdir: Scratch folder
+        timestamp: Current timestamp string
+        user: Current username
+    """
+    from accumulators import accumulator_path
+    from aggregate import AGGREGATE_INDEX, candidate_screens, load_aggregate_index, update_project_aggregate
+
+    rel_parent = os.path.dirname(key).replace('recording_results/', '', 1)
+    parts = rel_parent.split('/')
+    if len(parts) < 3:
+        print(f"  No project/session/task in {key}, skipping the project aggregate")
+        return
+    project, task = parts[0], parts[-1]
+    prefix = f"Output/{project}/{AGGREGATE_FOLDER}/{task}/"
+    aggregate_dir = os.path.join(tmpdir, 'aggregate')
+    
+    with aggregate_lock(prefix):
+        os.makedirs(aggregate_dir, exist_ok=True)
+        download_if_exists(prefix + AGGREGATE_INDEX, os.path.join(aggregate_dir, AGGREGATE_INDEX))
+        for screen in candidate_screens(load_aggregate_index(aggregate_dir), output_dir):
+            for kind in screen['frames']:
+                local_path = accumulator_path(os.path.join(aggregate_dir, screen['scene']), kind)
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                download_if_exists(prefix + screen['scene'] + '/' + os.path.basename(local_path), local_path)
         
-        # Note: tmpdir is automatically cleaned up here, including both WebM and MP4 files
+        changed = update_project_aggregate(aggregate_dir, output_dir, rel_parent, timestamp, user)
+        if not changed:
+            return
+        for folder in changed:
+            for file in os.listdir(folder):
+                s3.upload_file(os.path.join(folder, file), BUCKET, prefix + os.path.basename(folder) + '/' + file)
+        s3.upload_file(os.path.join(aggregate_dir, AGGREGATE_INDEX), BUCKET, prefix + AGGREGATE_INDEX)
+    print(f"  Updated the project aggregate at {prefix} ({len(changed)} screen(s))")
+
+def rebuild_task_aggregates(target):
+    """
+    Rebuild project aggregates from the sessions left, after sessions were deleted
+    
+    Every remaining session's accumulators are downloaded and summed again
+    (see aggregate.rebuild_project_aggregate), under the aggregate lock.
+    Screen folders the new aggregate no longer has are deleted.
+    
+    Args:
+        target: '<project>/' for every task of a project, or '<project>/<task>' for one task
+    
+    Returns:
+        bool: True once the aggregates were rebuilt
+    """
+    from accumulators import ACCUMULATOR_SUFFIX
+    from aggregate import AGGREGATE_INDEX, rebuild_project_aggregate
+
+    project, _, task = target.partition('/')
+    session_keys = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=f"Output/{project}/"):
+        for obj in page.get('Contents', []):
+            # Output/<project>/<session>/<task>/sceneN/<kind>.npz
+            parts = obj['Key'].split('/')
+            if (len(parts) == 6 and parts[2] != AGGREGATE_FOLDER and parts[5].endswith(ACCUMULATOR_SUFFIX)
+                    and (not task or parts[3] == task)):
+                session_keys.setdefault(parts[3], {}).setdefault('/'.join(parts[1:4]), []).append(obj['Key'])
+    tasks = [task] if task else sorted(set(session_keys) | set(list_aggregate_tasks(project)))
+    
+    timestamp = datetime.utcnow().strftime("%Y-%m-%d")
+    user = getpass.getuser()
+    for task_name in tasks:
+        prefix = f"Output/{project}/{AGGREGATE_FOLDER}/{task_name}/"
+        with tempfile.TemporaryDirectory() as tmpdir, aggregate_lock(prefix):
+            sessions = []
+            for session_id, keys in sorted(session_keys.get(task_name, {}).items()):
+                session_dir = os.path.join(tmpdir, 'sessions', *session_id.split('/'))
+                for key in keys:
+                    local_path = os.path.join(session_dir, *key.split('/')[4:])
+                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                    s3.download_file(BUCKET, key, local_path)
+                sessions.append((session_dir, session_id))
+            aggregate_dir = os.path.join(tmpdir, 'aggregate')
+            rebuild_project_aggregate(aggregate_dir, sessions, timestamp, user)
+            
+            kept = set()
+            for root, dirs, files in os.walk(aggregate_dir):
+                for file in files:
+                    rel_path = os.path.relpath(os.path.join(root, file), aggregate_dir).replace(os.sep, '/')
+                    if rel_path != AGGREGATE_INDEX:
+                        s3.upload_file(os.path.join(root, file), BUCKET, prefix + rel_path)
+                        kept.add(prefix + rel_path)
+            s3.upload_file(os.path.join(aggregate_dir, AGGREGATE_INDEX), BUCKET, prefix + AGGREGATE_INDEX)
+            stale = [obj['Key'] for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix)
+                     for obj in page.get('Contents', [])
+                     if obj['Key'] not in kept and obj['Key'] not in (prefix + AGGREGATE_INDEX, prefix + AGGREGATE_LOCK)]
+            for key in stale:
+                s3.delete_object(Bucket=BUCKET, Key=key)
+        print(f"Rebuilt the project aggregate at {prefix} from {len(sessions)} session(s)")
+    return True
+
+def list_aggregate_tasks(project):
+    """Task folders of a project's aggregates in S3."""
+    response = s3.list_objects_v2(Bucket=BUCKET, Prefix=f"Output/{project}/{AGGREGATE_FOLDER}/", Delimiter='/')
+    return [prefix['Prefix'].split('/')[-2] for prefix in response.get('CommonPrefixes', [])]
+
+def download_if_exists(key, local_path):
+    """Download an S3 object; returns False if there is no such object."""
+    try:
+        s3.download_file(BUCKET, key, local_path)
+    except s3.exceptions.ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+        return False
+    return True
+
+@contextlib.contextmanager
+def aggregate_lock(prefix, timeout=AGGREGATE_LOCK_TIMEOUT, wait=AGGREGATE_LOCK_WAIT):
+    """
+    Hold the lock of a task aggregate, so its read-modify-write is not interleaved with another worker's
+    
+    The lock is an S3 object created only if it does not exist (If-None-Match).
+    A lock older than timeout seconds is taken over by replacing exactly
+    that object (If-Match on its ETag), so of several waiting workers only
+    one gets it.
+    
+    Args:
+        prefix: S3 prefix of the task aggregate
+        timeout: Seconds after which a held lock counts as abandoned
+        wait: Seconds to wait for the lock before raising TimeoutError
+    """
+    key = prefix + AGGREGATE_LOCK
+    deadline = time.monotonic() + wait
+    while True:
+        body = json.dumps({'owner': f"{getpass.getuser()}@{os.uname().nodename}:{os.getpid()}",
+                           'expires': time.time() + timeout})
+        try:
+            etag = s3.put_object(Bucket=BUCKET, Key=key, Body=body.encode(), IfNoneMatch='*')['ETag']
+            break
+        except s3.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+        try:
+            held = s3.get_object(Bucket=BUCKET, Key=key)
+            if json.loads(held['Body'].read()).get('expires', 0) < time.time():
+                print(f"  Taking over the abandoned aggregate lock {key}")
+                etag = s3.put_object(Bucket=BUCKET, Key=key, Body=body.encode(), IfMatch=held['ETag'])['ETag']
+                break
+        except s3.exceptions.ClientError as e:
+            # Released or taken over meanwhile: try again
+            if e.response['Error']['Code'] not in ('NoSuchKey', 'PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Aggregate lock {key} is still held after {wait} seconds")
+        time.sleep(AGGREGATE_LOCK_POLL)
+    try:
+        yield
+    finally:
+        try:
+            s3.delete_object(Bucket=BUCKET, Key=key, IfMatch=etag)
+        except s3.exceptions.ClientError as e:
+            # Taken over after our lock expired: the new holder releases it
+            print(f"  Could not release the aggregate lock {key}: {str(e)}")
 
 def result_exists(key):
     """
@@ -150,9 +447,12 @@ def result_exists(key):
         print(f"Error checking if results exist for {key}: {str(e)}")
         return False
 
-def main():
+def main(job=process_and_upload):
     """
     Main processing loop: find all WebM files and process them
+    
+    Args:
+        job: process_and_upload (heatmaps only) or process_session_and_upload (unified session pipeline)
     """
     print("Starting video processing pipeline...")
     print(f"S3 Bucket: {BUCKET}")
@@ -160,6 +460,7 @@ def main():
     print(f"User: {getpass.getuser()}")
     print("-" * 50)
     
+    import_in_background(*ANALYSIS_MODULES)
     processed_count = 0
     skipped_count = 0
     
@@ -173,7 +474,7 @@ def main():
                 continue
             
             print(f"  → Processing {key}...")
-            process_and_upload(key)
+            job(key)
             processed_count += 1
             
     except KeyboardInterrupt:
@@ -186,7 +487,127 @@ def main():
     print(f"Videos processed: {processed_count}")
     print(f"Videos skipped: {skipped_count}")
 
+def run_daemon(poll_interval=POLL_INTERVAL, max_attempts=MAX_ATTEMPTS, job=process_and_upload):
+    """
+    Process new recordings indefinitely, in a worker process that is recycled when it grows
+    
+    The bucket is scanned again as soon as a scan found work, otherwise
+    every poll_interval seconds. Each recording is analyzed by a
+    RecyclingWorker (see worker_pool.py): the worker's RSS is logged after
+    every job and the worker is replaced once it exceeds WORKER_MAX_RSS_MB
+    or has run WORKER_MAX_JOBS jobs, so the daemon's memory stays bounded
+    however many recordings it handles.
+    
+    Args:
+        poll_interval: Seconds to wait after a scan that found nothing to do
+        max_attempts: Attempts per recording before it is left alone
+        job: Function run on every recording key, see main()
+    """
+    from worker_pool import RecyclingWorker
+
+    print("Starting video processing daemon...")
+    print(f"S3 Bucket: {BUCKET}, polling every {poll_interval:.0f}s")
+    print("-" * 50)
+    
+    failures = {}
+    with RecyclingWorker() as worker:
+        try:
+            while True:
+                processed = 0
+                for key in list_screen_files():
+                    if failures.get(key, 0) >= max_attempts or result_exists(key):
+                        continue
+                    print(f"\nProcessing {key}...")
+                    stats = worker.run(job, key)
+                    processed += 1
+                    if stats['result']:
+                        failures.pop(key, None)
+                    else:
+                        failures[key] = failures.get(key, 0) + 1
+                        if failures[key] >= max_attempts:
+                            print(f"  Giving up on {key} after {max_attempts} attempts")
+                if not processed:
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("\nDaemon stopped by user")
+        print(f"Jobs run: {worker.total_jobs}, worker processes recycled: {worker.recycled}")
+
+def run_queue_worker(queue_name=WORK_QUEUE_NAME, job=process_and_upload):
+    """
+    Process recordings as the backend publishes them to the work queue, without scanning the bucket
+    
+    Every message is the S3 key of an uploaded screen.webm; a new recording
+    is picked up within POLL_INTERVAL (work_queue.py) of its upload. The
+    backend also asks for aggregate rebuilds after deleting sessions
+    (AGGREGATE_REBUILD_PREFIX messages, run by rebuild_task_aggregates). Jobs
+    run in a RecyclingWorker as in run_daemon. Failed recordings are retried
+    by WorkQueue.consume (WORK_QUEUE_MAX_ATTEMPTS, WORK_QUEUE_RETRY_DELAY); a
+    worker that dies mid-job leaves its message to be delivered again after
+    the visibility timeout.
+    
+    Args:
+        queue_name: Queue to consume
+        job: Function run on every recording key, see main()
+    """
+    from work_queue import AGGREGATE_REBUILD_PREFIX, WorkQueue
+    from worker_pool import RecyclingWorker
+
+    queue = WorkQueue()
+    print(f"Starting queue worker on '{queue_name}' ({queue.path})...")
+    print(f"Waiting recordings: {queue.counts(queue_name)}")
+    print("-" * 50)
+    
+    with RecyclingWorker() as worker:
+        def handle(message):
+            key = message.body
+            print(f"\nProcessing {key} (attempt {message.attempts})...")
+            if key.startswith(AGGREGATE_REBUILD_PREFIX):
+                stats = worker.run(rebuild_task_aggregates, key[len(AGGREGATE_REBUILD_PREFIX):])
+            else:
+                stats = worker.run(job, key)
+            if not stats['result']:
+                return stats['error'] or "processing failed"
+
+        try:
+            queue.consume(queue_name, handle)
+        except KeyboardInterrupt:
+            print("\nQueue worker stopped by user")
+        print(f"Jobs run: {worker.total_jobs}, worker processes recycled: {worker.recycled}")
+
+def enqueue_unprocessed(queue_names=None):
+    """
+    Publish every recording without results to the work queue (one bucket scan, e.g. for uploads made before the queue existed)
+    
+    Args:
+        queue_names: Queues to publish to (default: work_queue.WORK_QUEUES)
+    
+    Returns:
+        int: Number of recordings published
+    """
+    from work_queue import WORK_QUEUES, WorkQueue
+
+    queue = WorkQueue()
+    published = 0
+    for key in list_screen_files():
+        if result_exists(key):
+            continue
+        for name in queue_names or WORK_QUEUES:
+            queue.put(name, key)
+        published += 1
+        print(f"Queued {key}")
+    print(f"Queued {published} recording(s) to {', '.join(queue_names or WORK_QUEUES)}")
+    return published
+
 if __name__ == "__main__":
-    main()
+    # python process_s3_videos_new.py [daemon | queue | backfill] [session]
+    job = process_session_and_upload if 'session' in sys.argv[1:] else process_and_upload
+    if 'queue' in sys.argv[1:]:
+        run_queue_worker(job=job)
+    elif 'backfill' in sys.argv[1:]:
+        enqueue_unprocessed()
+    elif 'daemon' in sys.argv[1:]:
+        run_daemon(job=job)
+    else:
+        main(job)
 
 
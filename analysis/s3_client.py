@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import common_path  # puts ../common (shared modules) on the import path
+from lazy_client import LazyClient
+
+# S3 client of the worker scripts, created on first use (see common/lazy_client.py)
+s3 = LazyClient('s3')
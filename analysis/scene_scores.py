@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+
+import numpy as np
+
+from frame_source import PrefetchStats, ffmpeg_available, get_video_properties, iter_gray_frames
+
+# Per-frame scores are cached next to the video as <video><SCORES_SUFFIX>,
+# with their metadata in <video><SCORES_META_SUFFIX>
+SCORES_SUFFIX = '.scenescores.npy'
+SCORES_META_SUFFIX = '.scenescores.json'
+SCORES_VERSION = 3
+SCORES_METRIC = 'sampled_absdiff_hist'
+
+# Frames are scored as point-sampled grayscale thumbnails of this (width, height).
+# A sample of pixels estimates the full-resolution mean absolute difference;
+# area-averaged thumbnails blur text pages into similar grays and underrate
+# the cut between them (6.4 instead of 28.6 on 64x36). 23 x (16, 9) is no
+# integer fraction of the common resolutions, so the samples do not fall on
+# the same rows of every evenly spaced text line
+THUMBNAIL_SIZE = (368, 207)
+THUMBNAIL_SAMPLING = 'point'
+# Thumbnails scored together in one NumPy batch
+SCORE_BATCH_SIZE = 32
+# Grayscale histogram bins of the histogram score
+HISTOGRAM_BINS = 32
+# Columns of the score array
+SCORE_DIFF, SCORE_HIST = 0, 1
+
+
+def batch_scene_scores(thumbnails):
+    """
+    Score every pair of consecutive thumbnails of a batch
+
+    Args:
+        thumbnails: uint8 array of shape (frames, height, width)
+
+    Returns:
+        float32 array of shape (frames - 1, 2): the mean absolute difference
+        (SCORE_DIFF, 0-255) and the histogram distance (SCORE_HIST, half the
+        L1 distance of the normalized histograms, 0-1) of each pair
+    """
+    frames = len(thumbnails)
+    scores = np.empty((max(frames - 1, 0), 2), dtype=np.float32)
+    if frames < 2:
+        return scores
+    pixels = thumbnails.reshape(frames, -1)
+
+    scores[:, SCORE_DIFF] = np.abs(np.diff(pixels.astype(np.int16), axis=0)).mean(axis=1)
+
+    # One bincount for the whole batch: every frame gets its own range of bins
+    bins = (pixels >> (8 - int(np.log2(HISTOGRAM_BINS)))).astype(np.intp)
+    bins += np.arange(frames)[:, None] * HISTOGRAM_BINS
+    histograms = np.bincount(bins.ravel(), minlength=frames * HISTOGRAM_BINS)
+    histograms = histograms.reshape(frames, HISTOGRAM_BINS) / pixels.shape[1]
+    scores[:, SCORE_HIST] = 0.5 * np.abs(np.diff(histograms, axis=0)).sum(axis=1)
+    return scores
+
+
+class SceneScoreBatcher:
+    """
+    Scores a stream of thumbnails in batches of SCORE_BATCH_SIZE
+
+        batcher = SceneScoreBatcher()
+        for thumbnail in thumbnails:
+            batcher.add(thumbnail)
+        scores = batcher.finish()
+    """
+
+    def __init__(self):
+        width, height = THUMBNAIL_SIZE
+        # Slot 0 carries the last thumbnail of the previous batch
+        self.batch = np.empty((SCORE_BATCH_SIZE + 1, height, width), dtype=np.uint8)
+        self.filled = 0
+        self.frames = 0
+        self.scores = []
+
+    def add(self, thumbnail):
+        """Add the next THUMBNAIL_SIZE grayscale thumbnail; returns True when a batch was scored."""
+        self.batch[self.filled] = thumbnail
+        self.filled += 1
+        self.frames += 1
+        if self.filled < len(self.batch):
+            return False
+        self.scores.append(batch_scene_scores(self.batch))
+        self.batch[0] = self.batch[-1]
+        self.filled = 1
+        return True
+
+    def finish(self):
+        """float16 scores of all thumbnails added (see compute_scene_scores), or None if there were none."""
+        if self.frames == 0:
+            return None
+        if self.filled > 1 or not self.scores:
+            self.scores.append(batch_scene_scores(self.batch[:self.filled]))
+        return np.concatenate(self.scores).astype(np.float16)
+
+
+def compute_scene_scores(video_path):
+    """
+    Decode a video once and compute its scene change scores between every pair of consecutive frames
+
+    Frames are point-sampled down to THUMBNAIL_SIZE thumbnails (by FFmpeg
+    when it decodes) and scored in batches, so scoring costs a small
+    fraction of decoding.
+
+    Args:
+        video_path: Path to the video
+
+    Returns:
+        float16 array of shape (frames - 1, 2) where row i scores frames i
+        and i + 1 (see batch_scene_scores), or None if the video cannot be read
+    """
+    properties = get_video_properties(video_path)
+    if properties is None:
+        return None
+    total_frames = properties['total_frames']
+
+    print(f"Computing scene scores for {total_frames} frames...")
+    decode_stats = PrefetchStats()
+    batcher = SceneScoreBatcher()
+    for frame_count, thumbnail in iter_gray_frames(video_path, stats=decode_stats, size=THUMBNAIL_SIZE,
+                                                   sampling=THUMBNAIL_SAMPLING):
+        if batcher.add(thumbnail):
+            print(f"  Analyzed {frame_count + 1}/{total_frames} frames ({(frame_count + 1)/total_frames*100:.1f}%)")
+    scores = batcher.finish()
+    if scores is not None:
+        print(f"  Frame prefetch: {decode_stats.summary()}")
+    return scores
+
+
+def scene_scores_meta(video_path):
+    """Cache metadata the scene scores of a video must match, or None if the video does not exist."""
+    try:
+        stat = os.stat(video_path)
+    except OSError:
+        return None
+    return {
+        'version': SCORES_VERSION,
+        'metric': SCORES_METRIC,
+        'decoder': 'ffmpeg' if ffmpeg_available() else 'opencv',
+        'source': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    }
+
+
+def save_scene_scores(video_path, scores, meta=None):
+    """
+    Cache the scene scores of a video next to it, for load_scene_scores
+
+    Scores computed while the video was written (see session_pipeline.py)
+    are saved this way, so scene detection does not decode it again.
+
+    Args:
+        video_path: Path to the video
+        scores: float16 scores as returned by compute_scene_scores
+        meta: scene_scores_meta() of the video, read again if None
+
+    Returns:
+        True if the scores were cached
+    """
+    meta = dict(meta or scene_scores_meta(video_path) or {}, frame_count=len(scores) + 1)
+    try:
+        np.save(video_path + SCORES_SUFFIX, scores)
+        with open(video_path + SCORES_META_SUFFIX, 'w') as f:
+            json.dump(meta, f, indent=2)
+        return True
+    except OSError as e:
+        print(f"Warning: Could not cache scene scores for {video_path}: {e}")
+        return False
+
+
+def load_scene_scores(video_path):
+    """
+    Return the scene scores of a video, computing and caching them on first use
+
+    The cache is invalidated when the video's size or modification time, or
+    the decoder used (FFmpeg or OpenCV), changes.
+
+    Args:
+        video_path: Path to the video
+
+    Returns:
+        float16 scores as returned by compute_scene_scores, or None if the video cannot be read
+    """
+    meta = scene_scores_meta(video_path)
+    if meta is None:
+        return None
+    scores_path = video_path + SCORES_SUFFIX
+    meta_path = video_path + SCORES_META_SUFFIX
+
+    try:
+        with open(meta_path) as f:
+            cached_meta = json.load(f)
+        if all(cached_meta.get(key) == value for key, value in meta.items()):
+            scores = np.load(scores_path)
+            if scores.shape == (cached_meta.get('frame_count', 0) - 1, 2):
+                print(f"Using cached scene scores from {scores_path}")
+                return scores
+    except (OSError, ValueError):
+        pass
+
+    scores = compute_scene_scores(video_path)
+    if scores is None:
+        return None
+    save_scene_scores(video_path, scores, meta)
+    return scores
+
+
+def segment_scene_scores(scores, threshold, min_duration, min_final_duration=1, hist_threshold=None):
+    """
+    Split a video into scenes from its scene scores, without decoding anything
+
+    A scene ends before frame i when the difference score of frames i - 1
+    and i exceeds threshold (and, if hist_threshold is given, so does their
+    histogram distance) and the current scene is at least min_duration
+    frames long.
+
+    Args:
+        scores: Scores as returned by load_scene_scores
+        threshold: Threshold for scene change detection
+        min_duration: Minimum scene duration in frames
+        min_final_duration: Minimum length of the last scene; shorter tails are dropped
+        hist_threshold: Optional histogram distance (0-1) a scene change must also exceed
+
+    Returns:
+        List of (start_frame, end_frame) tuples for each scene
+    """
+    total_frames = len(scores) + 1
+    changes = scores[:, SCORE_DIFF] > threshold
+    if hist_threshold is not None:
+        changes &= scores[:, SCORE_HIST] > hist_threshold
+    scene_boundaries = []
+    current_scene_start = 0
+    # Frames whose difference to the previous frame exceeds the threshold
+    for frame_count in np.flatnonzero(changes) + 1:
+        if frame_count - current_scene_start >= min_duration:
+            scene_boundaries.append((current_scene_start, int(frame_count) - 1))
+            current_scene_start = int(frame_count)
+
+    if total_frames - current_scene_start >= min_final_duration:
+        scene_boundaries.append((current_scene_start, total_frames - 1))
+    return scene_boundaries
+
+
+def write_scene_boundaries(path, video_path, threshold, min_duration, scene_boundaries):
+    """Write the scenes of a run, with the parameters that produced them, as JSON."""
+    with open(path, 'w') as f:
+        json.dump({
+            'video_info': {
+                'path': video_path,
+                'total_scenes': len(scene_boundaries),
+                'scores': os.path.basename(video_path + SCORES_SUFFIX)
+            },
+            'parameters': {'threshold': threshold, 'min_duration': min_duration},
+            'scene_boundaries': [{"start_frame": int(start), "end_frame": int(end)}
+                                 for start, end in scene_boundaries]
+        }, f, indent=2)
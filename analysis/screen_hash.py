@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import cv2
+import numpy as np
+
+
+# Two backgrounds show the same screen when their perceptual hashes differ in
+# at most this many of the 64 bits (same layout; a moving cursor or focus ring
+# flips a few bits) ...
+SCREEN_HASH_MAX_DISTANCE = 20
+# ... and their thumbnails differ by at most this mean absolute difference
+# (same appearance; pHash ignores pages that only differ in color). Kept well
+# below the scene detection threshold: merging two different screens would
+# draw one heatmap over the wrong background, while a missed match only costs
+# an extra scene
+SCREEN_THUMBNAIL_MAX_DIFF = 10.0
+# ... between area-averaged grayscale thumbnails of this (width, height)
+SCREEN_THUMBNAIL_SIZE = (64, 36)
+
+
+def perceptual_hash(frame):
+    """
+    Compute the 64-bit perceptual hash (pHash) of a frame
+
+    The frame is reduced to 32x32, and the signs of its lowest 8x8 DCT
+    frequencies relative to their median form the hash.
+
+    Args:
+        frame: Grayscale or BGR frame
+
+    Returns:
+        Hash as a Python int
+    """
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(frame, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(small)[:8, :8].ravel()
+    # The DC term only encodes overall brightness
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hash_distance(a, b):
+    """Number of differing bits between two perceptual hashes."""
+    return bin(a ^ b).count('1')
+
+
+def screen_signature(frame):
+    """
+    Summarize a background frame for screen matching
+
+    Args:
+        frame: Grayscale or BGR frame, or None if it could not be read
+
+    Returns:
+        (perceptual hash, grayscale thumbnail) tuple, or None for a missing frame
+    """
+    if frame is None:
+        return None
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return perceptual_hash(frame), cv2.resize(frame, SCREEN_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def same_screen(a, b, max_distance=SCREEN_HASH_MAX_DISTANCE, max_thumbnail_diff=SCREEN_THUMBNAIL_MAX_DIFF):
+    """Check whether two screen signatures show the same screen (missing signatures never match)."""
+    if a is None or b is None:
+        return False
+    if hash_distance(a[0], b[0]) > max_distance:
+        return False
+    return cv2.absdiff(a[1], b[1]).mean() <= max_thumbnail_diff
+
+
+def group_screens(signatures, max_distance=SCREEN_HASH_MAX_DISTANCE, max_thumbnail_diff=SCREEN_THUMBNAIL_MAX_DIFF):
+    """
+    Group items whose signatures match the first item of a group
+
+    Args:
+        signatures: screen_signature() of every item, in order
+        max_distance: Largest hash distance still counted as the same screen
+        max_thumbnail_diff: Largest thumbnail difference still counted as the same screen
+
+    Returns:
+        List of groups (lists of item indices) in order of first appearance
+    """
+    groups = []
+    for i, signature in enumerate(signatures):
+        for group in groups:
+            if same_screen(signatures[group[0]], signature, max_distance, max_thumbnail_diff):
+                group.append(i)
+                break
+        else:
+            groups.append([i])
+    return groups
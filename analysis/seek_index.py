@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+from bisect import bisect_left, bisect_right
+
+import cv2
+
+# The index is cached next to the video as <video><SEEK_INDEX_SUFFIX>
+SEEK_INDEX_SUFFIX = '.seekindex.json'
+SEEK_INDEX_VERSION = 1
+
+# Indexes built in this process, keyed by (path, size, mtime); only the most recent videos are kept
+_index_cache = {}
+INDEX_CACHE_SIZE = 8
+
+
+def build_seek_index(video_path):
+    """
+    Build the keyframe index of a video
+
+    The video is only demuxed (OpenCV raw stream mode), not decoded, so this
+    costs a fraction of a decode pass. Frame numbers come from the order of
+    the presentation timestamps, so they stay exact for variable frame rate
+    WebM recordings and streams with B-frames.
+
+    Args:
+        video_path: Path to the video
+
+    Returns:
+        Dict with frame_count and keyframes, a sorted list of
+        [frame_index, pts_seconds, seek_seconds] where seek_seconds lies
+        between the keyframe and the frame before it; None if the video
+        cannot be demuxed
+    """
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if not cap.isOpened():
+        return None
+    timestamps = []
+    keyframe_timestamps = []
+    try:
+        while cap.grab():
+            pts = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            timestamps.append(pts)
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframe_timestamps.append(pts)
+    finally:
+        cap.release()
+    if not timestamps:
+        return None
+
+    timestamps.sort()
+    keyframes = []
+    for pts in sorted(keyframe_timestamps):
+        frame_index = bisect_left(timestamps, pts)
+        seek = (timestamps[frame_index - 1] + pts) / 2 if frame_index > 0 else 0.0
+        keyframes.append([frame_index, round(pts, 6), round(seek, 6)])
+    if not keyframes or keyframes[0][0] != 0:
+        keyframes.insert(0, [0, timestamps[0], 0.0])
+
+    return {
+        'version': SEEK_INDEX_VERSION,
+        'frame_count': len(timestamps),
+        'keyframes': keyframes
+    }
+
+
+def load_seek_index(video_path):
+    """
+    Return the keyframe index of a video, building and caching it on first use
+
+    The cached file records the size and modification time of the video and
+    is rebuilt when they change. If the video's folder is read-only the
+    index is only kept in memory.
+
+    Args:
+        video_path: Path to the video
+
+    Returns:
+        Index dict as returned by build_seek_index, or None if it cannot be built
+    """
+    try:
+        stat = os.stat(video_path)
+    except OSError:
+        return None
+    source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    cache_key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+    if cache_key in _index_cache:
+        return _index_cache[cache_key]
+
+    index_path = video_path + SEEK_INDEX_SUFFIX
+    index = None
+    try:
+        with open(index_path) as f:
+            cached = json.load(f)
+        if cached.get('version') == SEEK_INDEX_VERSION and cached.get('source') == source:
+            index = cached
+    except (OSError, ValueError):
+        pass
+
+    if index is None:
+        index = build_seek_index(video_path)
+        if index is None:
+            return None
+        index['source'] = source
+        try:
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"Warning: Could not cache seek index for {video_path}: {e}")
+
+    while len(_index_cache) >= INDEX_CACHE_SIZE:
+        _index_cache.pop(next(iter(_index_cache)))
+    _index_cache[cache_key] = index
+    return index
+
+
+def keyframe_before(index, frame_index):
+    """
+    Find the last keyframe at or before a frame
+
+    Args:
+        index: Index dict from load_seek_index
+        frame_index: Frame to seek to
+
+    Returns:
+        (keyframe_index, pts_seconds, seek_seconds): the keyframe to start
+        decoding from, its timestamp and the time to seek to
+    """
+    keyframes = index['keyframes']
+    position = bisect_right([keyframe[0] for keyframe in keyframes], frame_index) - 1
+    keyframe = keyframes[max(position, 0)]
+    return keyframe[0], keyframe[1], keyframe[2]
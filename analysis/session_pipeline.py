@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+
+from analyse_m_s import analyze_screen
+from frame_source import FFMPEG_BIN, FFMPEG_SCALE_FLAGS, get_video_properties, read_color_frame
+import common_path  # puts ../common (shared modules) on the import path
+from instrumentation import current_span, span
+from scene_scores import THUMBNAIL_SAMPLING, THUMBNAIL_SIZE, SceneScoreBatcher, save_scene_scores
+from screen_hash import hash_distance, perceptual_hash
+
+# Heatmaps of a session are generated in this execution mode (see analyse_m_s.EXECUTION_MODE):
+# 'shared_memory' decodes the video once for both heatmap kinds
+SESSION_EXECUTION_MODE = os.environ.get('SESSION_EXECUTION_MODE', 'shared_memory')
+# Audio is decoded once, mono at the sample rate Whisper expects
+AUDIO_SAMPLE_RATE = 16000
+# Loudness is the RMS of windows of this many seconds, one every hop (the
+# librosa defaults of preprocessing/process_from_s3.py: 2048 and 512 samples at 22050 Hz)
+RMS_WINDOW_SECONDS = 2048 / 22050
+RMS_HOP_SECONDS = 512 / 22050
+# Windows louder than this percentile of the session are audio peaks
+AUDIO_PEAK_PERCENTILE = 90
+# Frames are compared for visual changes once per this many seconds ...
+VISUAL_CHANGE_INTERVAL = 1.0
+# ... and changed when at least this fraction of their perceptual hash bits differ
+VISUAL_CHANGE_THRESHOLD = 0.5
+# Key frames are at least this many seconds apart, at most KEY_FRAME_MAX per session
+KEY_FRAME_MIN_GAP = 20
+KEY_FRAME_MAX = 10
+# A clip starts this many seconds before its key frame and lasts CLIP_DURATION seconds
+CLIP_LEAD = 5
+CLIP_DURATION = 10
+# JPEG quality of the key frame screenshots
+SCREENSHOT_QUALITY = 95
+# Whisper model of the transcript (an empty string skips transcription)
+WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'base')
+TRANSCRIPT_FILENAME = 'transcript.json'
+# Subfolders of run_session's output folder: heatmaps (uploaded to Output/<project>/<session>/<task>/)
+# and key frames (uploaded to Output/Video Splitting/<session>/)
+ANALYSIS_FOLDER = 'analysis'
+KEY_FRAMES_FOLDER = 'key_frames'
+
+_whisper_model = None
+
+
+def decode_video(webm_path, mp4_path):
+    """
+    Decode a screen recording once into the analysis MP4, its scene scores and its frame hashes
+
+    One FFmpeg process decodes the WebM and writes two outputs: the H.264
+    MP4 the heatmap analyzers read (as convert_webm_to_mp4 does) and
+    THUMBNAIL_SIZE grayscale thumbnails on a pipe. Both outputs have the
+    same constant frame rate, so thumbnail i is frame i of the MP4. The
+    thumbnails are scored for scene detection (the scores are cached next
+    to the MP4, see save_scene_scores) and hashed for visual changes.
+
+    Args:
+        webm_path: Path to the recording
+        mp4_path: Path of the MP4 to write
+
+    Returns:
+        (scene scores, uint64 perceptual hash of every frame) tuple, or None if decoding failed
+    """
+    width, height = THUMBNAIL_SIZE
+    frame_size = width * height
+    cmd = [FFMPEG_BIN, '-v', 'error', '-nostdin', '-i', webm_path,
+           '-map', '0:v:0', '-map', '0:a?', '-c:v', 'libx264', '-c:a', 'aac', '-preset', 'fast',
+           '-movflags', '+faststart', '-y', mp4_path,
+           '-map', '0:v:0', '-vf', f"scale={width}:{height}:flags={FFMPEG_SCALE_FLAGS[THUMBNAIL_SAMPLING]},format=gray", '-f', 'rawvideo', '-']
+    batcher = SceneScoreBatcher()
+    hashes = []
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors, bufsize=frame_size)
+        try:
+            while True:
+                buffer = process.stdout.read(frame_size)
+                if len(buffer) < frame_size:
+                    break
+                thumbnail = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width)
+                batcher.add(thumbnail)
+                hashes.append(perceptual_hash(thumbnail))
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            print(f"FFmpeg could not decode {webm_path}: {errors.read().decode(errors='replace').strip()}")
+            return None
+    scores = batcher.finish()
+    if scores is None:
+        print(f"No video frames in {webm_path}")
+        return None
+    save_scene_scores(mp4_path, scores)
+    current_span().set(frames=len(hashes))
+    return scores, np.array(hashes, dtype=np.uint64)
+
+
+def visual_change_times(hashes, fps, interval=VISUAL_CHANGE_INTERVAL, threshold=VISUAL_CHANGE_THRESHOLD):
+    """
+    Times of large visual changes, comparing the frames closest to every interval seconds
+
+    Args:
+        hashes: Perceptual hash of every frame, see decode_video
+        fps: Frame rate of the video
+        interval: Seconds between the compared frames
+        threshold: Fraction of differing hash bits (0-1) of a change
+
+    Returns:
+        Array of change times in seconds (the time of the later frame)
+    """
+    if len(hashes) == 0 or fps <= 0:
+        return np.array([])
+    samples = np.arange(0, len(hashes) / fps, interval)
+    frames = np.minimum(np.round(samples * fps).astype(int), len(hashes) - 1)
+    times = [samples[i] for i in range(1, len(frames))
+             if hash_distance(int(hashes[frames[i - 1]]), int(hashes[frames[i]])) / 64 >= threshold]
+    return np.array(times)
+
+
+def decode_audio(audio_path, sample_rate=AUDIO_SAMPLE_RATE):
+    """
+    Decode the audio of a recording once, as mono float32 samples
+
+    Args:
+        audio_path: Path to the audio (or any file with an audio stream)
+        sample_rate: Sample rate to resample to
+
+    Returns:
+        float32 array of samples, empty if the file has no audio
+    """
+    cmd = [FFMPEG_BIN, '-v', 'error', '-nostdin', '-i', audio_path, '-map', '0:a:0',
+           '-ac', '1', '-ar', str(sample_rate), '-f', 'f32le', '-']
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        print(f"No audio decoded from {audio_path}: {result.stderr.decode(errors='replace').strip()}")
+        return np.zeros(0, dtype=np.float32)
+    samples = np.frombuffer(result.stdout, dtype=np.float32)
+    current_span().set(samples=len(samples), seconds_of_audio=round(len(samples) / sample_rate, 3))
+    return samples
+
+
+def audio_peak_times(samples, sample_rate=AUDIO_SAMPLE_RATE, percentile=AUDIO_PEAK_PERCENTILE):
+    """
+    Times of the loudest windows of a recording
+
+    Matches librosa.feature.rms on centered, zero-padded windows, as used by
+    preprocessing/process_from_s3.py, at any sample rate.
+
+    Args:
+        samples: Mono samples, see decode_audio
+        sample_rate: Sample rate of the samples
+        percentile: Windows louder than this percentile are peaks
+
+    Returns:
+        Array of window times in seconds
+    """
+    window = max(1, round(RMS_WINDOW_SECONDS * sample_rate))
+    hop = max(1, round(RMS_HOP_SECONDS * sample_rate))
+    padded = np.pad(samples.astype(np.float64), window // 2)
+    windows = 1 + (len(padded) - window) // hop
+    if len(samples) == 0 or windows < 1:
+        return np.array([])
+    energy = np.concatenate(([0.0], np.cumsum(padded ** 2)))
+    starts = np.arange(windows) * hop
+    rms = np.sqrt(np.maximum(energy[starts + window] - energy[starts], 0) / window)
+    peaks = np.flatnonzero(rms > np.percentile(rms, percentile))
+    return peaks * hop / sample_rate
+
+
+def final_key_frames(*times, min_gap=KEY_FRAME_MIN_GAP, max_clips=KEY_FRAME_MAX):
+    """
+    Pick key frames from candidate times, earliest first, at least min_gap seconds apart
+
+    Args:
+        times: Arrays of candidate times in seconds (audio peaks, visual changes, ...)
+        min_gap: Minimum seconds between key frames
+        max_clips: Maximum number of key frames
+
+    Returns:
+        List of key frame times in seconds
+    """
+    final = []
+    for t in np.sort(np.concatenate([np.asarray(t, dtype=float) for t in times])):
+        if all(abs(t - f) >= min_gap for f in final):
+            final.append(float(t))
+        if len(final) >= max_clips:
+            break
+    return final
+
+
+def extract_clips(video_path, times, output_folder):
+    """Cut a CLIP_DURATION second VP9 clip around every key frame, as clip_N.webm."""
+    os.makedirs(output_folder, exist_ok=True)
+    for i, t in enumerate(times):
+        clip_path = os.path.join(output_folder, f"clip_{i + 1}.webm")
+        cmd = [FFMPEG_BIN, '-v', 'error', '-nostdin', '-ss', str(max(t - CLIP_LEAD, 0)), '-i', video_path,
+               '-t', str(CLIP_DURATION), '-an', '-c:v', 'libvpx-vp9', '-crf', '30', '-b:v', '0', '-y', clip_path]
+        result = subprocess.run(cmd, capture_output=True)
+        if result.returncode != 0:
+            print(f"Could not cut clip {i + 1} at {t:.1f}s: {result.stderr.decode(errors='replace').strip()}")
+        else:
+            current_span().add(clips=1, bytes=os.path.getsize(clip_path))
+
+
+def save_screenshots(video_path, times, fps, output_folder):
+    """Save the frame at every key frame time as frame_N.jpg."""
+    os.makedirs(output_folder, exist_ok=True)
+    for i, t in enumerate(times):
+        frame = read_color_frame(video_path, int(round(t * fps)))
+        if frame is None:
+            print(f"Could not read the frame at {t:.1f}s")
+            continue
+        cv2.imwrite(os.path.join(output_folder, f"frame_{i + 1}.jpg"), frame,
+                    [cv2.IMWRITE_JPEG_QUALITY, SCREENSHOT_QUALITY])
+        current_span().add(screenshots=1)
+
+
+def transcribe(samples, model_name=WHISPER_MODEL):
+    """
+    Transcribe decoded audio with Whisper
+
+    Whisper (the openai-whisper package) is optional: without it, or with
+    an empty model name, there is no transcript.
+
+    Args:
+        samples: float32 samples at AUDIO_SAMPLE_RATE, see decode_audio
+        model_name: Whisper model
+
+    Returns:
+        Dict with the text, language and timed segments, or None
+    """
+    global _whisper_model
+    if not model_name or len(samples) == 0:
+        return None
+    try:
+        import whisper
+    except ImportError:
+        print("Whisper is not installed, skipping the transcript")
+        return None
+    if _whisper_model is None:
+        with span('model_load', model=model_name):
+            _whisper_model = whisper.load_model(model_name)
+    result = _whisper_model.transcribe(samples, fp16=False)
+    return {
+        'model': model_name,
+        'language': result.get('language'),
+        'text': result['text'].strip(),
+        'segments': [{'start': round(s['start'], 3), 'end': round(s['end'], 3), 'text': s['text'].strip()}
+                     for s in result.get('segments', [])]
+    }
+
+
+def run_session(screen_path, audio_path, output_dir, timestamp, user, key_frames=True):
+    """
+    Analyze one recording session, decoding the video and the audio once each
+
+    The video is decoded once by decode_video (the MP4, scene scores and
+    frame hashes) and the MP4 once more by the heatmap analyzers
+    (SESSION_EXECUTION_MODE). The decoded audio feeds both the audio peak
+    detector and the transcription. Audio peaks and visual changes give the
+    key frames, cut as clips and screenshots like preprocessing/process_from_s3.py.
+
+    Output layout:
+        <output_dir>/analysis/    heatmaps and manifest (see analyze_screen) plus transcript.json
+        <output_dir>/key_frames/  clips/clip_N.webm and screenshots/frame_N.jpg
+
+    Args:
+        screen_path: Path to the screen recording (WebM)
+        audio_path: Path to the audio recording, or None if there is none
+        output_dir: Folder for the results
+        timestamp: Current timestamp string
+        user: Current username
+        key_frames: Cut clips and screenshots (False skips them)
+
+    Returns:
+        Dict with the analysis and key frame folders, the key frame times and
+        the transcript path (None without one), or None if the video could not be decoded
+    """
+    analysis_dir = os.path.join(output_dir, ANALYSIS_FOLDER)
+    key_frames_dir = os.path.join(output_dir, KEY_FRAMES_FOLDER)
+    os.makedirs(analysis_dir, exist_ok=True)
+    mp4_path = os.path.join(output_dir, 'screen.mp4')
+
+    with span('video_decode', input_bytes=os.path.getsize(screen_path)) as stage:
+        decoded = decode_video(screen_path, mp4_path)
+        stage.set(ok=decoded is not None)
+    if decoded is None:
+        return None
+    _, hashes = decoded
+    fps = get_video_properties(mp4_path)['fps']
+
+    analyze_screen(mp4_path, analysis_dir, timestamp, user, execution_mode=SESSION_EXECUTION_MODE)
+
+    samples = np.zeros(0, dtype=np.float32)
+    if audio_path is not None:
+        with span('audio_decode', input_bytes=os.path.getsize(audio_path)):
+            samples = decode_audio(audio_path)
+
+    transcript_path = None
+    with span('transcription') as stage:
+        transcript = transcribe(samples)
+        stage.set(ok=transcript is not None)
+    if transcript is not None:
+        transcript_path = os.path.join(analysis_dir, TRANSCRIPT_FILENAME)
+        with open(transcript_path, 'w') as f:
+            json.dump(transcript, f, indent=2)
+
+    times = []
+    if key_frames:
+        with span('key_frames') as stage:
+            audio_peaks = audio_peak_times(samples)
+            visual_changes = visual_change_times(hashes, fps)
+            times = final_key_frames(audio_peaks, visual_changes)
+            stage.set(audio_peaks=len(audio_peaks), visual_changes=len(visual_changes), key_frames=len(times))
+        print(f"Key frames: {', '.join(f'{t:.1f}s' for t in times) or 'none'} "
+              f"({len(audio_peaks)} audio peaks, {len(visual_changes)} visual changes)")
+        if times:
+            with span('clips'):
+                extract_clips(screen_path, times, os.path.join(key_frames_dir, 'clips'))
+            with span('screenshots'):
+                save_screenshots(mp4_path, times, fps, os.path.join(key_frames_dir, 'screenshots'))
+
+    return {
+        'analysis': analysis_dir,
+        'key_frames': key_frames_dir if times else None,
+        'key_frame_times': times,
+        'transcript': transcript_path
+    }
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+
+import cv2
+import numpy as np
+
+# Synthetic screen recordings with known ground truth, for tests and benchmarks:
+# static UI pages switched at given frames (scene cuts), a focus ring hopping
+# between the page's items and a cursor following a scripted path.
+PAGE_COLORS = [(235, 235, 235), (40, 40, 40), (180, 120, 60), (20, 20, 120)]
+FOCUS_COLOR = (0, 120, 255)
+FOCUS_THICKNESS = 3
+FOCUS_HOP_FRAMES = 15
+CURSOR_RADIUS = 6
+ITEMS_PER_PAGE = 6
+# Scripted cursor paths move between random waypoints at this speed (pixels per frame) and pause up to
+# CURSOR_MAX_PAUSE frames at each
+CURSOR_SPEED = 9.0
+CURSOR_MAX_PAUSE = 20
+CURSOR_PATHS = ('lissajous', 'scripted')
+# Page styles: 'ui' pages differ in color and layout, 'text' pages are white
+# documents that only differ in their words (same histogram, fine detail)
+PAGE_KINDS = ('ui', 'text')
+TEXT_WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+              'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua')
+TEXT_LINE_SPACING = 18
+
+
+def render_pages(size, count=len(PAGE_COLORS)):
+    """
+    Draw the static UI pages: a header bar and a list of labelled items
+
+    Args:
+        size: (width, height) of the recording
+        count: Number of distinct pages
+
+    Returns:
+        List of BGR images
+    """
+    width, height = size
+    pages = []
+    for p in range(count):
+        page = np.full((height, width, 3), PAGE_COLORS[p % len(PAGE_COLORS)], np.uint8)
+        page[:40] = (90 + 40 * p, 60, 160 - 30 * p)
+        for k in range(ITEMS_PER_PAGE):
+            y = 70 + k * 45
+            cv2.rectangle(page, (40, y), (300 + 40 * p, y + 30), (200 - 30 * p, 210, 220), -1)
+            cv2.putText(page, f"Item {p}-{k}", (50, y + 22), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (20, 20, 20), 1)
+        pages.append(page)
+    return pages
+
+
+def render_text_pages(size, count=len(PAGE_COLORS)):
+    """
+    Draw text pages: a header bar over lines of random words, different on every page
+
+    Args:
+        size: (width, height) of the recording
+        count: Number of distinct pages
+
+    Returns:
+        List of BGR images
+    """
+    width, height = size
+    pages = []
+    for p in range(count):
+        rng = np.random.default_rng(p)
+        page = np.full((height, width, 3), 245, np.uint8)
+        page[:40] = (120, 80, 40)
+        for y in range(60, height - 4, TEXT_LINE_SPACING):
+            line = ' '.join(rng.choice(TEXT_WORDS, width // 30))
+            cv2.putText(page, line, (20, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (20, 20, 20), 1, cv2.LINE_AA)
+        pages.append(page)
+    return pages
+
+
+def focus_ring(frame, page):
+    """The focus ring rectangle (x, y, w, h) at a frame, including its line width."""
+    y = 70 + ((frame // FOCUS_HOP_FRAMES) % ITEMS_PER_PAGE) * 45
+    half = FOCUS_THICKNESS // 2 + 1
+    return 36 - half, y - 4 - half, 268 + 40 * page + 2 * half, 38 + 2 * half
+
+
+def cursor_path(frames, size, kind='lissajous', seed=0):
+    """
+    Cursor position at every frame
+
+    Args:
+        frames: Number of frames
+        size: (width, height) of the recording
+        kind: 'lissajous' (smooth, always moving) or 'scripted' (straight moves
+              between random waypoints, with pauses)
+        seed: Random seed of the scripted path
+
+    Returns:
+        int array of shape (frames, 2) with x, y
+    """
+    width, height = size
+    if kind == 'lissajous':
+        i = np.arange(frames)
+        return np.stack([(width / 2 + 0.4 * width * np.sin(i / 23.0)).astype(int),
+                         (height / 2 + 0.4 * height * np.cos(i / 31.0)).astype(int)], axis=1)
+    if kind != 'scripted':
+        raise ValueError(f"Unknown cursor path {kind!r}, expected one of {CURSOR_PATHS}")
+
+    rng = np.random.default_rng(seed)
+    margin = 2 * CURSOR_RADIUS
+    position = np.array([width / 2, height / 2])
+    points = []
+    while len(points) < frames:
+        target = rng.uniform((margin, margin), (width - margin, height - margin))
+        steps = max(1, int(np.ceil(np.linalg.norm(target - position) / CURSOR_SPEED)))
+        points.extend(position + (target - position) * (np.arange(1, steps + 1)[:, None] / steps))
+        points.extend([target] * int(rng.integers(0, CURSOR_MAX_PAUSE + 1)))
+        position = target
+    return np.rint(np.array(points[:frames])).astype(int)
+
+
+def write_screen_recording(path, cuts, frames=360, size=(640, 360), fps=30, cursor='lissajous', seed=0, pages='ui'):
+    """
+    Write a synthetic screen recording and return its ground truth
+
+    Args:
+        path: Output video path (.mp4)
+        cuts: Frames at which the next page is shown
+        frames: Number of frames
+        size: (width, height)
+        fps: Frame rate
+        cursor: Cursor path, see cursor_path
+        seed: Random seed of the cursor path
+        pages: Page style, one of PAGE_KINDS
+
+    Returns:
+        Dict with the video path, fps, size, cuts, scenes as (start_frame,
+        end_frame), the page shown at every frame, the cursor position (x, y)
+        at every frame and the focus ring (x, y, w, h) at every frame
+    """
+    width, height = size
+    if pages not in PAGE_KINDS:
+        raise ValueError(f"Unknown page style {pages!r}, expected one of {PAGE_KINDS}")
+    pages = render_pages(size) if pages == 'ui' else render_text_pages(size)
+    positions = cursor_path(frames, size, cursor, seed)
+    page_index = np.array([sum(1 for cut in cuts if i >= cut) % len(pages) for i in range(frames)])
+    focus = np.array([focus_ring(i, page_index[i]) for i in range(frames)]).reshape(-1, 4)
+
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for i in range(frames):
+        p = page_index[i]
+        frame = pages[p].copy()
+        y = 70 + ((i // FOCUS_HOP_FRAMES) % ITEMS_PER_PAGE) * 45
+        cv2.rectangle(frame, (36, y - 4), (304 + 40 * p, y + 34), FOCUS_COLOR, FOCUS_THICKNESS)
+        cv2.circle(frame, (int(positions[i][0]), int(positions[i][1])), CURSOR_RADIUS, (0, 0, 0), -1)
+        out.write(frame)
+    out.release()
+
+    boundaries = [0] + sorted(cut for cut in set(cuts) if 0 < cut < frames) + [frames]
+    return {
+        'path': path,
+        'fps': fps,
+        'size': [width, height],
+        'frames': frames,
+        'cuts': boundaries[1:-1],
+        'scenes': [(start, end - 1) for start, end in zip(boundaries, boundaries[1:])],
+        'pages': page_index,
+        'cursor': positions,
+        'focus': focus,
+    }
+
+
+def save_ground_truth(path, truth):
+    """Write the ground truth of write_screen_recording as JSON."""
+    with open(path, 'w') as f:
+        json.dump({key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in truth.items()}, f)
+    return path
+
+
+def load_ground_truth(path):
+    """Read ground truth written by save_ground_truth (arrays are NumPy arrays again)."""
+    with open(path) as f:
+        truth = json.load(f)
+    for key in ('pages', 'cursor', 'focus'):
+        truth[key] = np.array(truth[key])
+    truth['scenes'] = [tuple(scene) for scene in truth['scenes']]
+    return truth
@@ -0,0 +1,204 @@
+import io
+import json
+import os
+import threading
+
+import botocore.exceptions
+import numpy as np
+import pytest
+
+import accumulators
+import aggregate
+import analyse_m_s
+import process_s3_videos_new
+from conftest import write_screen_recording
+
+def test_accumulator_roundtrip_1(tmp_path):
+    heatmap = np.zeros((90, 160), np.float32)
+    heatmap[20:40, 30:60] = np.linspace(0.01, 250000.0, 600, dtype=np.float32).reshape(20, 30)
+    background = np.full((90, 160, 3), 200, np.uint8)
+    path = accumulators.save_accumulator(str(tmp_path / 'mousecursor.npz'), heatmap, background, frames=42)
+
+    loaded = accumulators.load_accumulator(path)
+    # Sums beyond the float16 range survive with float16 precision
+    np.testing.assert_allclose(loaded['heatmap'], heatmap, rtol=1e-3)
+    assert loaded['frame_size'] == (90, 160)
+    assert loaded['frames'] == 42 and loaded['sessions'] == 1
+    assert 'heatmap' not in accumulators.load_accumulator(path, heatmap=False)
+
+# Sessions are summed per screen, once each, and match across videos with different page orders
+def test_update_project_aggregate_1(tmp_path):
+    sessions = []
+    for name, cuts in (('a', [40, 80]), ('b', [60])):
+        video_path = write_screen_recording(str(tmp_path / f'{name}.mp4'), cuts=cuts, frames=120, size=(320, 180))
+        session_dir = tmp_path / name
+        session_dir.mkdir()
+        analyse_m_s.process_video_with_scenes(video_path, str(session_dir), '2025-01-01', 'tester')
+        sessions.append(str(session_dir))
+    aggregate_dir = str(tmp_path / 'aggregate')
+
+    assert len(aggregate.update_project_aggregate(aggregate_dir, sessions[0], 'a', '2025-01-01', 'tester')) == 3
+    assert aggregate.update_project_aggregate(aggregate_dir, sessions[0], 'a', '2025-01-01', 'tester') == []
+    assert len(aggregate.update_project_aggregate(aggregate_dir, sessions[1], 'b', '2025-01-01', 'tester')) == 2
+
+    index = aggregate.load_aggregate_index(aggregate_dir)
+    assert index['sessions'] == ['a', 'b']
+    assert [screen['sessions'] for screen in index['screens']] == [2, 2, 1]
+    assert [screen['frames']['keyboard'] for screen in index['screens']] == [40 + 60, 40 + 60, 40]
+    assert os.path.exists(os.path.join(aggregate_dir, 'scene1', 'mousecursor.png'))
+
+    total = accumulators.load_accumulator(os.path.join(aggregate_dir, 'scene1', 'mousecursor.npz'))
+    expected = sum(accumulators.load_accumulator(os.path.join(session, 'scene1', 'mousecursor.npz'))['heatmap']
+                   for session in sessions)
+    np.testing.assert_allclose(total['heatmap'], expected, rtol=2e-3, atol=1e-3 * expected.max())
+
+def analyzed_sessions(tmp_path, cuts_by_name):
+    sessions = []
+    for name, cuts in cuts_by_name:
+        video_path = write_screen_recording(str(tmp_path / f'{name}.mp4'), cuts=cuts, frames=120, size=(320, 180))
+        session_dir = tmp_path / name
+        session_dir.mkdir()
+        analyse_m_s.process_video_with_scenes(video_path, str(session_dir), '2025-01-01', 'tester')
+        sessions.append((str(session_dir), name))
+    return sessions
+
+# A merge that stopped before writing the index is not counted twice when it is retried
+def test_update_project_aggregate_retry_1(tmp_path):
+    (session_a, _), (session_b, _) = analyzed_sessions(tmp_path, (('a', [40, 80]), ('b', [60])))
+    aggregate_dir = str(tmp_path / 'aggregate')
+    aggregate.update_project_aggregate(aggregate_dir, session_a, 'a', '2025-01-01', 'tester')
+    index_path = os.path.join(aggregate_dir, aggregate.AGGREGATE_INDEX)
+    with open(index_path) as f:
+        index_after_a = f.read()
+
+    aggregate.update_project_aggregate(aggregate_dir, session_b, 'b', '2025-01-01', 'tester')
+    with open(index_path, 'w') as f:
+        f.write(index_after_a)
+    assert len(aggregate.update_project_aggregate(aggregate_dir, session_b, 'b', '2025-01-01', 'tester')) == 2
+
+    index = aggregate.load_aggregate_index(aggregate_dir)
+    assert index['sessions'] == ['a', 'b']
+    assert [screen['sessions'] for screen in index['screens']] == [2, 2, 1]
+    assert [screen['frames']['keyboard'] for screen in index['screens']] == [40 + 60, 40 + 60, 40]
+    total = accumulators.load_accumulator(os.path.join(aggregate_dir, 'scene1', 'keyboard.npz'))
+    assert total['session_ids'] == ('a', 'b')
+
+    # Only screens close to the session's ones in the index are needed to merge it
+    assert {'scene1', 'scene2'} <= {screen['scene'] for screen in aggregate.candidate_screens(index, session_b)}
+    video_path = write_screen_recording(str(tmp_path / 'c.mp4'), cuts=[], frames=30, size=(640, 360))
+    (tmp_path / 'c').mkdir()
+    analyse_m_s.process_video_with_scenes(video_path, str(tmp_path / 'c'), '2025-01-01', 'tester')
+    assert aggregate.candidate_screens(index, str(tmp_path / 'c')) == []
+
+# After a session is deleted, the aggregate is rebuilt from the remaining sessions
+def test_rebuild_project_aggregate_1(tmp_path):
+    sessions = analyzed_sessions(tmp_path, (('a', [40, 80]), ('b', [60])))
+    aggregate_dir = str(tmp_path / 'aggregate')
+    for session_dir, session_id in sessions:
+        aggregate.update_project_aggregate(aggregate_dir, session_dir, session_id, '2025-01-01', 'tester')
+
+    index = aggregate.rebuild_project_aggregate(aggregate_dir, sessions[1:], '2025-01-01', 'tester')
+    assert index['sessions'] == ['b']
+    assert [(screen['scene'], screen['sessions']) for screen in index['screens']] == [('scene1', 1), ('scene2', 1)]
+    assert sorted(os.listdir(aggregate_dir)) == [aggregate.AGGREGATE_INDEX, 'scene1', 'scene2']
+    total = accumulators.load_accumulator(os.path.join(aggregate_dir, 'scene1', 'mousecursor.npz'))
+    alone = accumulators.load_accumulator(os.path.join(sessions[1][0], 'scene1', 'mousecursor.npz'))
+    np.testing.assert_allclose(total['heatmap'], alone['heatmap'], rtol=2e-3, atol=1e-3 * alone['heatmap'].max())
+    assert aggregate.rebuild_project_aggregate(aggregate_dir, [], '2025-01-01', 'tester')['screens'] == []
+
+class MemoryS3:
+    """S3 stand-in with conditional puts, for the aggregate lock; downloaded keys are logged."""
+
+    def __init__(self):
+        self.objects = {}
+        self.versions = {}
+        self.downloads = []
+        self.lock = threading.Lock()
+        self.exceptions = botocore.exceptions
+
+    def error(self, code):
+        return botocore.exceptions.ClientError({'Error': {'Code': code}}, 'S3')
+
+    def etag(self, key):
+        return f'"{self.versions[key]}"'
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, IfMatch=None):
+        with self.lock:
+            if (IfNoneMatch and Key in self.objects) or (IfMatch and (Key not in self.objects or
+                                                                      self.etag(Key) != IfMatch)):
+                raise self.error('PreconditionFailed')
+            self.objects[Key] = bytes(Body)
+            self.versions[Key] = self.versions.get(Key, 0) + 1
+            return {'ETag': self.etag(Key)}
+
+    def get_object(self, Bucket, Key):
+        with self.lock:
+            if Key not in self.objects:
+                raise self.error('NoSuchKey')
+            return {'Body': io.BytesIO(self.objects[Key]), 'ETag': self.etag(Key)}
+
+    def delete_object(self, Bucket, Key, IfMatch=None):
+        with self.lock:
+            if IfMatch and (Key not in self.objects or self.etag(Key) != IfMatch):
+                raise self.error('PreconditionFailed')
+            self.objects.pop(Key, None)
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, 'rb') as f:
+            self.put_object(Bucket, Key, f.read())
+
+    def download_file(self, Bucket, Key, Filename):
+        with self.lock:
+            if Key not in self.objects:
+                raise self.error('404')
+            self.downloads.append(Key)
+            with open(Filename, 'wb') as f:
+                f.write(self.objects[Key])
+
+# Workers merging sessions of one task at the same time take turns, and fetch only the screens they need
+def test_update_task_aggregate_1(tmp_path, monkeypatch):
+    bucket = MemoryS3()
+    monkeypatch.setattr(process_s3_videos_new, 's3', bucket)
+    monkeypatch.setattr(process_s3_videos_new, 'AGGREGATE_LOCK_POLL', 0.01)
+    sessions = analyzed_sessions(tmp_path, (('a', [40, 80]), ('b', [60])))
+
+    def merge(session_dir, name):
+        scratch = tmp_path / f'scratch_{name}'
+        scratch.mkdir()
+        process_s3_videos_new.update_task_aggregate(f'recording_results/P/{name}/task_1/screen.webm', session_dir,
+                                                    str(scratch), '2025-01-01', 'tester')
+    threads = [threading.Thread(target=merge, args=session) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    prefix = 'Output/P/aggregate/task_1/'
+    index = json.loads(bucket.objects[prefix + aggregate.AGGREGATE_INDEX])
+    assert sorted(index['sessions']) == ['P/a/task_1', 'P/b/task_1']
+    assert sorted(screen['sessions'] for screen in index['screens']) == [1, 2, 2]
+    assert prefix + process_s3_videos_new.AGGREGATE_LOCK not in bucket.objects
+
+    # A screen of another size needs none of the aggregate's accumulators
+    video_path = write_screen_recording(str(tmp_path / 'c.mp4'), cuts=[], frames=30, size=(640, 360))
+    (tmp_path / 'c').mkdir()
+    analyse_m_s.process_video_with_scenes(video_path, str(tmp_path / 'c'), '2025-01-01', 'tester')
+    bucket.downloads.clear()
+    merge(str(tmp_path / 'c'), 'c')
+    assert bucket.downloads == [prefix + aggregate.AGGREGATE_INDEX]
+
+def test_aggregate_lock_1(monkeypatch):
+    bucket = MemoryS3()
+    monkeypatch.setattr(process_s3_videos_new, 's3', bucket)
+    monkeypatch.setattr(process_s3_videos_new, 'AGGREGATE_LOCK_POLL', 0.01)
+    with process_s3_videos_new.aggregate_lock('agg/'):
+        with pytest.raises(TimeoutError):
+            with process_s3_videos_new.aggregate_lock('agg/', wait=0.05):
+                pass
+    assert bucket.objects == {}
+
+    # A lock left behind by a dead worker is taken over once it expired
+    bucket.put_object('bucket', 'agg/aggregate.lock', json.dumps({'expires': 0}).encode())
+    with process_s3_videos_new.aggregate_lock('agg/', wait=0):
+        assert json.loads(bucket.objects['agg/aggregate.lock'])['expires'] > 0
+    assert bucket.objects == {}
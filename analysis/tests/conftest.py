@@ -0,0 +1,30 @@
+# analysis/tests/conftest.py
+import os, sys
+
+import pytest
+
+# find and import the analysis modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import common_path  # and the modules shared with the other services
+
+import synthetic_recording
+
+def write_screen_recording(path, cuts, frames=360, size=(640, 360), fps=30, pages='ui'):
+    """Write a synthetic screen recording: pages switched at the given frames, a moving cursor and a hopping focus ring."""
+    synthetic_recording.write_screen_recording(path, cuts, frames=frames, size=size, fps=fps, pages=pages)
+    return path
+
+@pytest.fixture(scope='session')
+def reference_videos(tmp_path_factory):
+    """The scene detection reference set: synthetic recordings with known page changes."""
+    folder = tmp_path_factory.mktemp('reference_videos')
+    return [
+        write_screen_recording(str(folder / 'three_cuts.mp4'), cuts=[90, 180, 270]),
+        write_screen_recording(str(folder / 'quick_cuts.mp4'), cuts=[30, 38, 200], frames=240),
+        write_screen_recording(str(folder / 'no_cuts.mp4'), cuts=[], frames=120),
+        write_screen_recording(str(folder / 'hd.mp4'), cuts=[50, 51, 140], frames=180, size=(1280, 720)),
+        # White text pages: only fine detail changes at the cuts
+        write_screen_recording(str(folder / 'text.mp4'), cuts=[60, 120], frames=180, pages='text'),
+        write_screen_recording(str(folder / 'text_hd.mp4'), cuts=[40, 100, 101], frames=150, size=(1280, 720),
+                               pages='text'),
+    ]
@@ -0,0 +1,92 @@
+import math
+
+import cv2
+import numpy as np
+import pytest
+
+from cursor_tracker import CursorHeatTracker
+
+HEIGHT, WIDTH = 360, 640
+
+def difference_frames(seed, count=150):
+    """Thresholded difference frames cycling through the cases the tracker handles differently."""
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        thresh = np.zeros((HEIGHT, WIDTH), np.uint8)
+        kind = i % 6
+        if kind == 0:
+            # More separate changed areas than MAX_REGIONS
+            for row in range(4):
+                for column in range(6):
+                    x, y = 20 + column * 110 + rng.integers(0, 10), 20 + row * 95 + rng.integers(0, 10)
+                    thresh[y:y + 3, x:x + 3] = 255
+        elif kind == 1:
+            # A few separate areas, blurred one by one
+            for column in range(5):
+                x, y = 40 + column * 130 + rng.integers(0, 20), rng.integers(0, HEIGHT - 8)
+                thresh[y:y + 8, x:x + 6] = 255
+        elif kind == 3:
+            # Changes touching the edges and corners
+            thresh[0:3, :5] = 255
+            thresh[-4:, WIDTH - 6:] = 255
+            thresh[HEIGHT // 2:HEIGHT // 2 + 5, 0:2] = 255
+            thresh[0:2, WIDTH // 2:WIDTH // 2 + 9] = 255
+            thresh[100:110, WIDTH - 1:] = 255
+        elif kind != 2:
+            # The cursor moving (kind 2: nothing changed)
+            x, y = rng.integers(0, WIDTH - 12), rng.integers(0, HEIGHT - 12)
+            thresh[y:y + 12, x:x + 12] = 255
+        yield thresh
+
+# The tracker finds the same maximum as the full-frame heat map, blur and minMaxLoc of the original loop
+@pytest.mark.parametrize('seed', [0, 1])
+def test_cursor_heat_tracker_1(seed):
+    heat_decay, blur_kernel = 0.85, (21, 21)
+    tracker = CursorHeatTracker((HEIGHT, WIDTH), heat_decay, blur_kernel)
+    heat_map = np.zeros((HEIGHT, WIDTH), np.float32)
+    frames = list(difference_frames(seed))
+    renormalized = 0
+
+    for i, thresh in enumerate(frames):
+        heat_map = heat_map * heat_decay + thresh.astype(np.float32)
+        blurred = cv2.GaussianBlur(heat_map, blur_kernel, 0)
+        _, max_val, _, max_loc = cv2.minMaxLoc(blurred)
+
+        scale = tracker._scale
+        val, loc = tracker.update(thresh)
+        renormalized += tracker._scale > scale
+        assert val == pytest.approx(max_val, rel=1e-5), i
+        # The same pixel, unless another one ties with it up to float rounding
+        assert loc == max_loc or blurred[loc[1], loc[0]] >= max_val * (1 - 1e-5), i
+    # The lazy decay was folded back into the map every time it dropped below RENORMALIZE_BELOW
+    assert renormalized == len(frames) // math.ceil(math.log(CursorHeatTracker.RENORMALIZE_BELOW) / math.log(heat_decay))
+    assert renormalized >= 3
+
+def test_cursor_heat_tracker_regions_1():
+    tracker = CursorHeatTracker((HEIGHT, WIDTH))
+    frames = difference_frames(0)
+    many, few = next(frames), next(frames)
+    # Too many separate areas: one box around all of them
+    assert len(tracker._dirty_regions(many)) == 1
+    assert len(tracker._dirty_regions(few)) == 5
+    assert tracker._dirty_regions(np.zeros((HEIGHT, WIDTH), np.uint8)) == []
+    # Regions are disjoint and clipped to the frame
+    regions = tracker._dirty_regions(next(frames) | next(frames))
+    for i, (x0, y0, x1, y1) in enumerate(regions):
+        assert 0 <= x0 < x1 <= WIDTH and 0 <= y0 < y1 <= HEIGHT
+        for other in regions[i + 1:]:
+            assert not (x0 < other[2] and other[0] < x1 and y0 < other[3] and other[1] < y1)
+
+def test_cursor_heat_tracker_ties_1():
+    # Two identical changed areas: like minMaxLoc, the first one in row-major order wins
+    for first, second in (((50, 100), (400, 100)), ((400, 40), (50, 300))):
+        tracker = CursorHeatTracker((HEIGHT, WIDTH))
+        thresh = np.zeros((HEIGHT, WIDTH), np.uint8)
+        for x, y in (first, second):
+            thresh[y:y + 5, x:x + 5] = 255
+        # A weaker third area makes the bounding box large enough to be split
+        thresh[200:202, 220:222] = 255
+        assert len(tracker._dirty_regions(thresh)) == 3
+        _, max_val, _, max_loc = cv2.minMaxLoc(cv2.GaussianBlur(thresh.astype(np.float32), (21, 21), 0))
+        assert tracker.update(thresh) == (pytest.approx(max_val), max_loc)
+        assert max_loc == (first[0] + 2, first[1] + 2)
@@ -0,0 +1,35 @@
+import cv2
+import numpy as np
+
+from analyse_m_s import scene_find_valid_regions
+
+def focus_ring(mask, x, y, w, h):
+    cv2.rectangle(mask, (x, y), (x + w - 1, y + h - 1), 255, 1)
+
+def test_scene_find_valid_regions_1():
+    # A 1 px hollow focus ring: few pixels, but its outline encloses a large area
+    mask = np.zeros((120, 160), np.uint8)
+    focus_ring(mask, 20, 30, 26, 26)
+    assert np.count_nonzero(mask) == 100
+    boxes, areas = scene_find_valid_regions(mask)
+    assert boxes.tolist() == [[20, 30, 26, 26]]
+    assert areas.tolist() == [625.0]
+
+    # Small specks stay below the limit
+    mask[100:105, 100:105] = 255
+    boxes, areas = scene_find_valid_regions(mask)
+    assert len(boxes) == 1
+
+def test_scene_find_valid_regions_2():
+    # A ring around a list of six items is one region, with the items inside its area
+    mask = np.zeros((240, 320), np.uint8)
+    focus_ring(mask, 10, 10, 200, 180)
+    for i in range(6):
+        mask[20 + i * 28:40 + i * 28, 30:190] = 255
+    boxes, areas = scene_find_valid_regions(mask)
+    assert boxes.tolist() == [[10, 10, 200, 180]]
+    assert areas[0] == 199 * 179
+    # Regions side by side stay separate
+    mask[200:230, 250:300] = 255
+    boxes, areas = scene_find_valid_regions(mask)
+    assert sorted(boxes.tolist()) == [[10, 10, 200, 180], [250, 200, 50, 30]]
@@ -0,0 +1,47 @@
+import subprocess
+
+import cv2
+import numpy as np
+import pytest
+
+import frame_source
+from frame_source import FFMPEG_BIN, ffmpeg_available
+from seek_index import load_seek_index
+
+def write_vfr_recording(path, frames=60, size=(160, 96)):
+    """WebM whose frames are 1/30 s apart for the first second and 0.1 s apart after it, each showing its number."""
+    width, height = size
+    images = []
+    for i in range(frames):
+        shade = i * 4 % 256
+        image = np.full((height, width, 3), shade, np.uint8)
+        cv2.putText(image, str(i), (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255) if shade < 128 else (0, 0, 0), 3)
+        images.append(image)
+    subprocess.run([FFMPEG_BIN, '-v', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', '30',
+                    '-i', '-', '-vf', "setpts='if(lt(N,30),N/30,1+(N-30)*0.1)/TB'", '-fps_mode', 'passthrough',
+                    '-c:v', 'libvpx', '-g', '10', '-b:v', '1M', '-y', path],
+                   input=b''.join(image.tobytes() for image in images), check=True)
+    return path
+
+# Seeks land on the right frame when the frame rate varies (OpenCV numbers frames by timestamp)
+@pytest.mark.skipif(not ffmpeg_available(), reason="needs FFmpeg")
+def test_seek_variable_frame_rate_1(tmp_path):
+    path = write_vfr_recording(str(tmp_path / 'screen.webm'))
+    cap = cv2.VideoCapture(path)
+    decoded = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        decoded.append(frame)
+    cap.release()
+    assert len(decoded) == 60
+    # Keyframes on both sides of the frame rate change
+    assert any(keyframe[0] > 30 for keyframe in load_seek_index(path)['keyframes'])
+
+    for frame_index in range(0, 60, 3):
+        assert np.array_equal(frame_source.read_color_frame(path, frame_index), decoded[frame_index]), frame_index
+    frames = list(frame_source.iter_color_frames(path, start_frame=45, end_frame=50, prefetch_depth=0))
+    assert [index for index, _ in frames] == list(range(45, 51))
+    assert all(np.array_equal(frame, decoded[index]) for index, frame in frames)
+    assert frame_source.read_color_frame(path, 60) is None
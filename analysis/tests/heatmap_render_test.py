@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+import pytest
+
+import heatmap_render
+
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+def test_colormap_lut_1():
+    values = np.arange(256, dtype=np.uint8)
+    for name in ('coolwarm', 'jet', 'gray'):
+        expected = matplotlib.colormaps[name](matplotlib.colors.Normalize(0, 255)(values), bytes=True)[:, :3]
+        assert np.array_equal(heatmap_render.apply_colormap(values[None], name, 0, 255)[0], expected[:, ::-1])
+
+# Same image size and heatmap pixels as the matplotlib figure it replaces, for landscape and portrait frames
+@pytest.mark.parametrize('frame_size', [(360, 640), (900, 600)])
+def test_render_overlay_heatmap_1(tmp_path, frame_size):
+    h, w = frame_size
+    heatmap = np.zeros(frame_size, np.uint8)
+    heatmap[h // 4:h // 2, w // 5:w // 2] = 200
+    heatmap[h // 2:, w // 2:] = 90
+    background = np.tile(np.linspace(40, 220, w).astype(np.uint8), (h, 1))
+    title, annotation = "Keyboard Focus Heatmap (Scene frames 0-89)", "Generated: 2025-01-01\nUser: tester"
+
+    plt.figure(figsize=(12, 8))
+    plt.imshow(heatmap, cmap='coolwarm', interpolation='nearest', vmin=0, vmax=255)
+    plt.colorbar()
+    plt.title(title)
+    plt.imshow(background, cmap='gray', alpha=0.3)
+    plt.axis('off')
+    plt.annotate(annotation, xy=(0.01, 0.01), xycoords='figure fraction', color='white', backgroundcolor='black',
+                 fontsize=8)
+    plt.savefig(str(tmp_path / 'matplotlib.png'), bbox_inches='tight', pad_inches=0.1, dpi=100)
+    plt.close()
+    heatmap_render.render_overlay_heatmap(str(tmp_path / 'opencv.png'), heatmap, background, title,
+                                          annotation=annotation, tight=True)
+
+    expected = cv2.imread(str(tmp_path / 'matplotlib.png')).astype(int)
+    rendered = cv2.imread(str(tmp_path / 'opencv.png')).astype(int)
+    assert rendered.shape == expected.shape
+    # Only the text (drawn with a different font) differs noticeably
+    difference = np.abs(rendered - expected).max(axis=2)
+    assert np.mean(difference) < 3
+    assert np.mean(difference > 40) < 0.02
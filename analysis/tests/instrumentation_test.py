@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+import instrumentation
+from analyse_m_s import analyze_screen
+from conftest import write_screen_recording
+
+@pytest.fixture
+def instrumentation_log(tmp_path):
+    path = str(tmp_path / 'spans.jsonl')
+    instrumentation.configure(log=path)
+    yield path
+    instrumentation.configure(log='')
+
+def test_span_1(instrumentation_log):
+    with instrumentation.span('session', key='a/screen.webm') as session:
+        with instrumentation.span('download') as stage:
+            stage.add(bytes=100).add(bytes=20)
+        instrumentation.current_span().set(frames=3)
+        with pytest.raises(ValueError):
+            with instrumentation.span('upload'):
+                raise ValueError("no bucket")
+    # Outside any span, counters are dropped
+    instrumentation.current_span().add(bytes=1)
+
+    download, upload, root = instrumentation.read_records(instrumentation_log)
+    assert [download['span'], upload['span'], root['span']] == ['download', 'upload', 'session']
+    assert download['bytes'] == 120 and root['frames'] == 3 and root['key'] == 'a/screen.webm'
+    assert download['parent'] == upload['parent'] == root['id'] == session.id
+    assert download['root'] == upload['root'] == root['root'] == root['id'] and root['parent'] is None
+    assert upload['error'] == "ValueError: no bucket" and 'error' not in root
+    assert root['seconds'] >= download['seconds'] >= 0 and root['rss'] > 0 and root['peak_rss'] >= root['rss'] // 2
+
+def test_analysis_spans_1(tmp_path, instrumentation_log):
+    video = write_screen_recording(str(tmp_path / 'screen.mp4'), cuts=[40], frames=80)
+    output_dir = tmp_path / 'result'
+    output_dir.mkdir()
+    analyze_screen(video, str(output_dir), '2025-01-01', 'tester')
+
+    records = instrumentation.read_records(instrumentation_log)
+    spans = {}
+    for record in records:
+        spans.setdefault(record['span'], []).append(record)
+    assert spans['analysis'][0]['frames'] == 80
+    assert spans['scene_detection'][0]['frames'] == 80 and spans['scene_detection'][0]['scenes'] == 2
+    assert len(spans['cursor_tracking']) == len(spans['focus_tracking']) == 2
+    assert sum(record['frames'] for record in spans['cursor_tracking']) == 80
+    assert len(spans['render']) == 4
+    assert {record['root'] for record in records} == {spans['analysis'][0]['id']}
+
+def test_sampling_profiler_1(tmp_path):
+    output = str(tmp_path / 'profile.folded')
+    instrumentation.configure(profile_interval=0.002, profile_output=output)
+    try:
+        with instrumentation.span('busy'):
+            deadline = time.perf_counter() + 0.2
+            while time.perf_counter() < deadline:
+                pass
+    finally:
+        instrumentation.configure(profile_interval=0)
+    stacks = open(output).read().splitlines()
+    assert any(line.startswith('span:busy;') and 'test_sampling_profiler_1' in line for line in stacks)
@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+ANALYSIS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The worker starts without importing boto3, OpenCV or NumPy; they load on first use
+def test_worker_startup_1():
+    code = ("import sys, process_s3_videos_new; "
+            "print(sorted(m for m in ('boto3', 'cv2', 'numpy') if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ANALYSIS_DIR, capture_output=True, text=True,
+                            check=True).stdout
+    assert output.strip() == '[]'
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+import pytest
+
+import analyse_m_s
+import frame_source
+import scene_scores
+
+def full_resolution_scene_boundaries(video_path, threshold, min_duration, min_final_duration):
+    """The original detector: mean absolute difference of full-resolution grayscale frames."""
+    frames = [gray for _, gray in frame_source.iter_gray_frames(video_path, prefetch_depth=0)]
+    scores = np.array([[cv2.absdiff(gray, prev).mean(), 0] for prev, gray in zip(frames, frames[1:])])
+    return scene_scores.segment_scene_scores(scores, threshold, min_duration, min_final_duration)
+
+# Thumbnail scene detection must find the same scenes as the full-resolution detector
+@pytest.mark.parametrize('threshold, min_duration', [(22.0, 10), (22.0, 1), (30.0, 10), (10.0, 50)])
+def test_detect_scenes_matches_full_resolution_1(reference_videos, threshold, min_duration):
+    for video_path in reference_videos:
+        expected = full_resolution_scene_boundaries(video_path, threshold, min_duration, 2)
+        assert analyse_m_s.detect_scenes(video_path, threshold, min_duration) == expected
+
+@pytest.mark.parametrize('threshold, min_scene_duration', [(22.0, 100), (22.0, 10)])
+def test_detect_scene_changes_matches_full_resolution_1(reference_videos, threshold, min_scene_duration):
+    for video_path in reference_videos:
+        expected = full_resolution_scene_boundaries(video_path, threshold, min_scene_duration, min_scene_duration)
+        assert analyse_m_s.detect_scene_changes(video_path, threshold, min_scene_duration) == expected
+
+# Scores are cached next to the video and re-segmented without decoding
+def test_scene_scores_cache_1(reference_videos, monkeypatch):
+    video_path = reference_videos[0]
+    scores = scene_scores.load_scene_scores(video_path)
+    assert scores.dtype == np.float16
+    assert scores.shape == (359, 2)
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("scene scores were recomputed")
+    monkeypatch.setattr(scene_scores, 'compute_scene_scores', no_decode)
+    assert analyse_m_s.detect_scenes(video_path, 22.0, 10) == [(0, 89), (90, 179), (180, 269), (270, 359)]
+    assert analyse_m_s.detect_scenes(video_path, 22.0, 120) == [(0, 179), (180, 359)]
+
+def test_batch_scene_scores_1():
+    thumbnails = np.zeros((3, 36, 64), dtype=np.uint8)
+    thumbnails[1] = 255
+    thumbnails[2, :18] = 255
+    scores = scene_scores.batch_scene_scores(thumbnails)
+    assert scores[:, scene_scores.SCORE_DIFF].tolist() == [255.0, 127.5]
+    assert scores[:, scene_scores.SCORE_HIST].tolist() == [1.0, 0.5]
+
+# Cuts between text pages hardly change area-averaged thumbnails, but are found like at full resolution
+def test_detect_scenes_text_pages_1(reference_videos):
+    for video_path in reference_videos[-2:]:
+        scenes = analyse_m_s.detect_scenes(video_path, 22.0, 1)
+        assert len(scenes) > 1
+        assert scenes == full_resolution_scene_boundaries(video_path, 22.0, 1, 2)
@@ -0,0 +1,21 @@
+import analyse_m_s
+import frame_source
+import screen_hash
+from conftest import write_screen_recording
+
+# Revisiting a page maps its scenes onto one screen
+def test_group_scenes_by_screen_1(tmp_path):
+    video_path = write_screen_recording(str(tmp_path / 'revisit.mp4'), cuts=[40, 80, 120, 160], frames=200)
+    scenes = analyse_m_s.detect_scenes(video_path, 22.0, 10)
+    assert len(scenes) == 5
+    assert analyse_m_s.group_scenes_by_screen(video_path, scenes) == [[0, 4], [1], [2], [3]]
+
+def test_same_screen_1(tmp_path):
+    video_path = write_screen_recording(str(tmp_path / 'pages.mp4'), cuts=[90, 180, 270], frames=360)
+    # The same page with the cursor and focus ring elsewhere matches, other pages (same layout) do not
+    signatures = [screen_hash.screen_signature(frame_source.read_gray_frame(video_path, f))
+                  for f in (10, 50, 85, 130, 220, 310)]
+    assert screen_hash.same_screen(signatures[0], signatures[1])
+    assert screen_hash.same_screen(signatures[0], signatures[2])
+    assert screen_hash.group_screens(signatures) == [[0, 1, 2], [3], [4], [5]]
+    assert screen_hash.group_screens([signatures[0], None, signatures[1]]) == [[0, 2], [1]]
@@ -0,0 +1,58 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+
+import numpy as np
+import pytest
+
+from frame_source import FFMPEG_BIN, ffmpeg_available, get_video_properties
+from scene_scores import SCORES_SUFFIX
+from session_pipeline import AUDIO_SAMPLE_RATE, audio_peak_times, final_key_frames, run_session
+from synthetic_recording import write_screen_recording
+
+def tone_bursts(seconds, bursts, sample_rate=AUDIO_SAMPLE_RATE):
+    """Quiet noise with a loud tone in every (start, end) burst."""
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 0.01, int(seconds * sample_rate)).astype(np.float32)
+    for start, end in bursts:
+        t = np.arange(int(start * sample_rate), int(end * sample_rate))
+        samples[t] += 0.5 * np.sin(2 * np.pi * 440 * t / sample_rate)
+    return samples
+
+def test_audio_peak_times_1():
+    # The loudest tenth of the windows are peaks: all inside the bursts (2.5 s of 20 s)
+    peaks = audio_peak_times(tone_bursts(20, [(3.0, 4.0), (12.0, 13.5)]))
+    assert len(peaks) > 0
+    assert all(2.9 <= t <= 4.1 or 11.9 <= t <= 13.6 for t in peaks)
+    assert final_key_frames(peaks, [5.0]) == [pytest.approx(peaks[0])]
+    assert len(audio_peak_times(np.zeros(0, np.float32))) == 0
+
+@pytest.mark.skipif(not ffmpeg_available(), reason="needs FFmpeg")
+def test_run_session_1(tmp_path):
+    recording = write_screen_recording(str(tmp_path / 'source.mp4'), cuts=[60, 150], frames=240)
+    screen_path = str(tmp_path / 'screen.webm')
+    audio_path = str(tmp_path / 'audio.webm')
+    subprocess.run([FFMPEG_BIN, '-v', 'error', '-i', recording['path'], '-c:v', 'libvpx-vp9', '-deadline', 'realtime',
+                    '-y', screen_path], check=True)
+    subprocess.run([FFMPEG_BIN, '-v', 'error', '-f', 'f32le', '-ar', str(AUDIO_SAMPLE_RATE), '-ac', '1', '-i', '-',
+                    '-c:a', 'libopus', '-y', audio_path], input=tone_bursts(8, [(6.0, 6.5)]).tobytes(), check=True)
+
+    output_dir = str(tmp_path / 'out')
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run_session(screen_path, audio_path, output_dir, '2025-01-01', 'tester')
+
+    # Scene detection used the scores computed while transcoding, frame for frame
+    mp4_path = os.path.join(output_dir, 'screen.mp4')
+    assert get_video_properties(mp4_path)['total_frames'] == recording['frames']
+    assert np.load(mp4_path + SCORES_SUFFIX).shape == (recording['frames'] - 1, 2)
+    with open(os.path.join(result['analysis'], 'scene_boundaries.json')) as f:
+        scenes = [(s['start_frame'], s['end_frame']) for s in json.load(f)['scene_boundaries']]
+    assert scenes == [tuple(scene) for scene in recording['scenes']]
+    assert os.path.exists(os.path.join(result['analysis'], 'scene3', 'mousecursor.png'))
+
+    # The first page change (2 s) and the tone (6 s) are candidates, 20 s apart at least
+    assert len(result['key_frame_times']) == 1 and result['key_frame_times'][0] <= 2.1
+    assert os.listdir(os.path.join(result['key_frames'], 'clips')) == ['clip_1.webm']
+    assert os.listdir(os.path.join(result['key_frames'], 'screenshots')) == ['frame_1.jpg']
@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+
+import synthetic_recording
+from analyse_m_s import detect_scenes
+
+def test_write_screen_recording_1(tmp_path):
+    path = str(tmp_path / 'scripted.mp4')
+    truth = synthetic_recording.write_screen_recording(path, cuts=[40, 100], frames=150, cursor='scripted', seed=4)
+    assert truth['scenes'] == [(0, 39), (40, 99), (100, 149)]
+    assert detect_scenes(path) == truth['scenes']
+    assert np.array_equal(truth['cursor'], synthetic_recording.cursor_path(150, (640, 360), 'scripted', seed=4))
+
+    # The ground truth matches what was drawn: the cursor is dark, the focus ring surrounds the orange pixels
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 70)
+    ok, frame = cap.read()
+    cap.release()
+    assert ok
+    x, y = truth['cursor'][70]
+    assert frame[y, x].max() < 60
+    orange = np.argwhere((frame[:, :, 2] > 200) & (frame[:, :, 1] > 80) & (frame[:, :, 1] < 160) & (frame[:, :, 0] < 60))
+    rx, ry, rw, rh = truth['focus'][70]
+    assert rx <= orange[:, 1].min() and orange[:, 1].max() < rx + rw
+    assert ry <= orange[:, 0].min() and orange[:, 0].max() < ry + rh
+
+def test_ground_truth_json_1(tmp_path):
+    truth = synthetic_recording.write_screen_recording(str(tmp_path / 'video.mp4'), cuts=[10], frames=30)
+    loaded = synthetic_recording.load_ground_truth(synthetic_recording.save_ground_truth(str(tmp_path / 'truth.json'), truth))
+    assert loaded['scenes'] == truth['scenes']
+    for key in ('pages', 'cursor', 'focus'):
+        assert np.array_equal(loaded[key], truth[key])
@@ -0,0 +1,47 @@
+import json
+
+import numpy as np
+
+import analyse_m_s
+import trajectory
+from conftest import write_screen_recording
+
+def test_trajectory_roundtrip_1(tmp_path):
+    builder = trajectory.TrajectoryBuilder(capacity=4)
+    for frame in range(100):
+        builder.append(frame, frame / 30.0, frame * 3, 200 - frame, 12.5)
+    path = trajectory.save_trajectory(str(tmp_path / trajectory.TRAJECTORY_FILENAME), builder.array())
+
+    loaded = trajectory.load_trajectory(path)
+    assert isinstance(loaded, np.memmap)
+    assert len(loaded) == 100 and loaded['x'][-1] == 297 and loaded['y'][-1] == 101
+    window = trajectory.trajectory_time_range(loaded, 1.0, 2.0)
+    assert window['frame'].tolist() == list(range(30, 61))
+
+    json_path = trajectory.export_trajectory_json(loaded, str(tmp_path / 'cursor_data.json'),
+                                                  {'scene_start_frame': 10})
+    with open(json_path) as f:
+        positions = json.load(f)['cursor_positions']
+    assert positions[20] == {'global_frame': 20, 'scene_frame': 10, 'time': float(np.float32(20 / 30.0)),
+                             'x': 60, 'y': 180, 'intensity': 12.5}
+
+# Every screen folder gets the trajectory of all its visits, in frame order
+def test_screen_trajectory_1(tmp_path):
+    video_path = write_screen_recording(str(tmp_path / 'revisit.mp4'), cuts=[40, 80], frames=120, size=(320, 180))
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    analyse_m_s.process_video_with_scenes(video_path, str(output_dir), '2025-01-01', 'tester')
+
+    with open(output_dir / 'manifest.json') as f:
+        scenes = json.load(f)['scenes']
+    for scene in scenes:
+        loaded = trajectory.load_trajectory(str(output_dir / scene['trajectory']))
+        # The last frame of the video has no next frame to difference against
+        expected = [frame for visit in scene['visits'] for frame in range(visit['start_frame'], visit['end_frame'] + 1)
+                    if frame < 119]
+        assert loaded['frame'].tolist() == expected
+        assert np.all(np.diff(loaded['time']) > 0)
+
+        focus_boxes = trajectory.load_trajectory(str(output_dir / scene['focus_boxes']), dtype=trajectory.FOCUS_BOX_DTYPE)
+        assert len(focus_boxes) > 0
+        assert set(focus_boxes['frame'].tolist()) <= set(expected + [119])
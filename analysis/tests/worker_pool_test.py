@@ -0,0 +1,69 @@
+import contextlib
+import io
+import shutil
+import statistics
+import tempfile
+
+import numpy as np
+
+from conftest import write_screen_recording
+from worker_pool import RecyclingWorker
+
+_held = []
+
+def analysis_job(video_path):
+    from analyse_m_s import analyze_screen
+    output_dir = tempfile.mkdtemp()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze_screen(video_path, output_dir, '2025-01-01', 'tester')
+        return True
+    finally:
+        shutil.rmtree(output_dir)
+
+def leaky_job(megabytes):
+    _held.append(np.ones(megabytes * 2 ** 20, np.uint8))
+    return len(_held)
+
+def failing_job():
+    raise ValueError("bad recording")
+
+def test_recycling_worker_1():
+    with RecyclingWorker(max_rss_mb=0, max_jobs=0) as worker:
+        first = worker.run(leaky_job, 40)
+        second = worker.run(leaky_job, 40)
+        assert (first['result'], second['result']) == (1, 2) and first['pid'] == second['pid']
+        assert second['rss_after'] - first['rss_after'] > 30 * 2 ** 20
+        assert second['peak_rss'] >= second['rss_after']
+
+        # Past the RSS limit the worker is replaced and starts from scratch
+        worker.max_rss = (second['rss_after'] - 2 ** 20) / 2 ** 20
+        third = worker.run(leaky_job, 1)
+        assert third['recycled'] and worker.recycled == 1
+        fourth = worker.run(leaky_job, 1)
+        assert fourth['result'] == 1 and fourth['pid'] != third['pid']
+
+        failed = worker.run(failing_job)
+        assert failed['result'] is None and failed['error'] == "ValueError: bad recording"
+
+def test_recycling_worker_2():
+    with RecyclingWorker(max_rss_mb=0, max_jobs=2) as worker:
+        pids = [worker.run(leaky_job, 1)['pid'] for _ in range(5)]
+    assert pids[0] == pids[1] != pids[2] == pids[3] != pids[4]
+    assert worker.recycled == 2
+
+# Soak test: 100 analysis jobs in one worker process, on recordings of different sizes, without memory growth
+def test_worker_soak_1(tmp_path):
+    videos = [write_screen_recording(str(tmp_path / f"{width}.mp4"), cuts=[20], frames=40, size=(width, height))
+              for width, height in [(320, 180), (256, 144), (384, 216)]]
+    rss = []
+    with RecyclingWorker(max_rss_mb=0, max_jobs=0) as worker:
+        for job in range(100):
+            stats = worker.run(analysis_job, videos[job % len(videos)])
+            assert stats['result'] is True and not stats['recycled']
+            rss.append(stats['rss_after'])
+    assert worker.recycled == 0
+    # After warming up (imports, caches, allocator pools), RSS stays flat
+    warm = statistics.median(rss[10:20])
+    assert statistics.median(rss[-10:]) - warm < 8 * 2 ** 20
+    assert max(rss[20:]) - warm < 24 * 2 ** 20
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+
+import numpy as np
+
+# Cursor trajectories are structured arrays with one 16-byte record per frame
+TRAJECTORY_DTYPE = np.dtype([
+    ('frame', '<i4'),
+    ('time', '<f4'),
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('intensity', '<f4')
+])
+# Keyboard focus timelines have one record per focus box kept by the keyboard analyzer
+FOCUS_BOX_DTYPE = np.dtype([
+    ('frame', '<i4'),
+    ('time', '<f4'),
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('w', '<i2'),
+    ('h', '<i2')
+])
+# Both are written next to the heatmaps as plain .npy files, which np.load can memory-map
+TRAJECTORY_FILENAME = 'cursor_trajectory.npy'
+FOCUS_BOXES_FILENAME = 'focus_boxes.npy'
+# Also write the trajectory as cursor_data.json (set CURSOR_JSON_EXPORT=1)
+CURSOR_JSON_EXPORT = os.environ.get('CURSOR_JSON_EXPORT', '0') == '1'
+
+
+class TrajectoryBuilder:
+    """
+    Collect timeline records (cursor positions by default) into a preallocated array
+
+    Grows by doubling, so scenes of unknown length cost amortized O(1) per record.
+    """
+
+    def __init__(self, capacity=1024, dtype=TRAJECTORY_DTYPE):
+        self._records = np.empty(max(1, capacity), dtype=dtype)
+        self._size = 0
+
+    def _reserve(self, count):
+        if self._size + count > len(self._records):
+            self._records = np.resize(self._records, max(2 * len(self._records), self._size + count))
+
+    def append(self, *record):
+        """Add one record, e.g. append(frame, time, x, y, intensity) for a cursor trajectory."""
+        self._reserve(1)
+        self._records[self._size] = record
+        self._size += 1
+
+    def extend(self, records):
+        """Add an array of records with the builder's dtype."""
+        self._reserve(len(records))
+        self._records[self._size:self._size + len(records)] = records
+        self._size += len(records)
+
+    def __len__(self):
+        return self._size
+
+    def array(self):
+        """The collected trajectory (a view, valid until the next append)."""
+        return self._records[:self._size]
+
+
+def focus_box_records(frame, time, boxes):
+    """
+    Turn the focus boxes of one frame into FOCUS_BOX_DTYPE records
+
+    Args:
+        frame: Frame index
+        time: Frame time in seconds
+        boxes: int array of (x, y, w, h) boxes, see scene_find_valid_regions
+
+    Returns:
+        Array with FOCUS_BOX_DTYPE, one record per box
+    """
+    records = np.empty(len(boxes), dtype=FOCUS_BOX_DTYPE)
+    records['frame'] = frame
+    records['time'] = time
+    for i, field in enumerate(('x', 'y', 'w', 'h')):
+        records[field] = boxes[:, i]
+    return records
+
+
+def save_trajectory(path, trajectory):
+    """
+    Write a trajectory or focus timeline as a .npy file (atomically)
+
+    Args:
+        path: Output path
+        trajectory: Array with TRAJECTORY_DTYPE or FOCUS_BOX_DTYPE, sorted by frame
+
+    Returns:
+        path
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(trajectory))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_trajectory(path, mmap=True, dtype=TRAJECTORY_DTYPE):
+    """
+    Read a trajectory written by save_trajectory
+
+    Args:
+        path: Path to the .npy file
+        mmap: Memory-map the file instead of reading it (columns are then
+              only paged in as they are accessed)
+        dtype: Expected record type (FOCUS_BOX_DTYPE for focus timelines)
+
+    Returns:
+        Array with the given dtype
+    """
+    trajectory = np.load(path, mmap_mode='r' if mmap else None)
+    if trajectory.dtype != dtype:
+        raise ValueError(f"{path} does not hold {dtype} records (dtype {trajectory.dtype})")
+    return trajectory
+
+
+def trajectory_time_range(trajectory, start_time=None, end_time=None):
+    """Slice the records with start_time <= time <= end_time (binary search, the trajectory is sorted)."""
+    times = trajectory['time']
+    start = 0 if start_time is None else int(np.searchsorted(times, start_time, side='left'))
+    end = len(trajectory) if end_time is None else int(np.searchsorted(times, end_time, side='right'))
+    return trajectory[start:end]
+
+
+def export_trajectory_json(trajectory, path, video_info):
+    """
+    Write a trajectory in the cursor_data.json layout, for tools that read the old format
+
+    Args:
+        trajectory: Array with TRAJECTORY_DTYPE
+        path: Output path
+        video_info: Dict stored as video_info (video path, scene frames, ...)
+
+    Returns:
+        path
+    """
+    start_frame = video_info.get('scene_start_frame', 0)
+    with open(path, 'w') as f:
+        json.dump({
+            'video_info': video_info,
+            'cursor_positions': [
+                {
+                    'global_frame': int(frame),
+                    'scene_frame': int(frame) - start_frame,
+                    'time': float(time),
+                    'x': int(x),
+                    'y': int(y),
+                    'intensity': float(intensity)
+                }
+                for frame, time, x, y, intensity in trajectory.tolist()
+            ]
+        }, f)
+    return path
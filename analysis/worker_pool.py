@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import multiprocessing
+import os
+import time
+
+import common_path  # puts ../common (shared modules) on the import path
+from instrumentation import current_rss, peak_rss, span
+
+# The worker process is replaced once its RSS after a job exceeds this many MB (0: never)
+WORKER_MAX_RSS_MB = float(os.environ.get('WORKER_MAX_RSS_MB', '1500'))
+# ... or after this many jobs (0: no limit)
+WORKER_MAX_JOBS = int(os.environ.get('WORKER_MAX_JOBS', '0'))
+# Seconds a stopping worker process gets to exit before it is terminated
+WORKER_STOP_TIMEOUT = 10
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process (Linux), so job_peak_rss() measures from now on."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def job_peak_rss():
+    """Peak RSS in bytes since the last reset_peak_rss() (the process's peak where it cannot be reset)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return peak_rss()
+
+
+def _worker_main(connection):
+    # Runs jobs sent by RecyclingWorker.run until it sends None or goes away
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        func, args, kwargs = job
+        reset_peak_rss()
+        rss_before = current_rss()
+        started = time.perf_counter()
+        try:
+            result, error = func(*args, **kwargs), None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        # Frames, figures and captures of the job should be garbage now
+        gc.collect()
+        connection.send({
+            'result': result,
+            'error': error,
+            'seconds': time.perf_counter() - started,
+            'rss_before': rss_before,
+            'rss_after': current_rss(),
+            'peak_rss': job_peak_rss(),
+        })
+    connection.close()
+
+
+class RecyclingWorker:
+    """
+    Runs jobs one at a time in a child process that is replaced when it grows
+
+    The child is started with the 'spawn' method, so it begins from a clean
+    interpreter rather than a copy of this one. After every job the child
+    reports its RSS; once that exceeds max_rss_mb, or the child has run
+    max_jobs jobs, it is stopped and the next job starts a new one. A child
+    that dies during a job (crash, out of memory) is replaced as well.
+    """
+
+    def __init__(self, max_rss_mb=WORKER_MAX_RSS_MB, max_jobs=WORKER_MAX_JOBS):
+        self.max_rss = max_rss_mb * 2 ** 20
+        self.max_jobs = max_jobs
+        self.process = None
+        self.jobs = 0
+        self.total_jobs = 0
+        self.recycled = 0
+        self._connection = None
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the worker process
+
+        func and its arguments must be picklable (module-level functions).
+
+        Returns:
+            Dict with the job's result, error (None or a message), seconds,
+            rss_before, rss_after and peak_rss in bytes, the worker's pid and
+            whether the worker was recycled after the job
+        """
+        if self.process is None:
+            self._start()
+        pid = self.process.pid
+        with span('worker_job', pid=pid, job=self.jobs + 1) as stage:
+            try:
+                self._connection.send((func, args, kwargs))
+                stats = self._connection.recv()
+            except (EOFError, OSError):
+                self.process.join(WORKER_STOP_TIMEOUT)
+                stats = {'result': None, 'error': f"Worker process exited with code {self.process.exitcode}",
+                         'seconds': None, 'rss_before': None, 'rss_after': None, 'peak_rss': None}
+                self._stop()
+                self.recycled += 1
+            self.jobs += 1
+            self.total_jobs += 1
+            stats['pid'] = pid
+            stats['recycled'] = self.process is None or self._should_recycle(stats)
+            stage.set(error=stats['error'], recycled=stats['recycled'], worker_rss_before=stats['rss_before'],
+                      worker_rss_after=stats['rss_after'], worker_peak_rss=stats['peak_rss'])
+        print(format_job_stats(self.total_jobs, stats))
+        if stats['recycled'] and self.process is not None:
+            self.recycle()
+        return stats
+
+    def _should_recycle(self, stats):
+        if self.max_rss and stats['rss_after'] is not None and stats['rss_after'] > self.max_rss:
+            return True
+        return bool(self.max_jobs) and self.jobs >= self.max_jobs
+
+    def recycle(self):
+        """Stop the worker process; the next job starts a new one."""
+        print(f"Recycling worker process {self.process.pid} after {self.jobs} job(s)")
+        self._stop()
+        self.recycled += 1
+
+    def _start(self):
+        context = multiprocessing.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_connection,), name='recycling-worker',
+                                       daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.jobs = 0
+
+    def _stop(self):
+        if self.process is None:
+            return
+        try:
+            self._connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(WORKER_STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self._connection.close()
+        self.process = None
+        self._connection = None
+
+    def close(self):
+        """Stop the worker process."""
+        self._stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def format_job_stats(job, stats):
+    """One log line with the duration and memory of a job."""
+    if stats['rss_after'] is None:
+        return f"Job {job} (worker {stats['pid']}): {stats['error']}"
+    mb = 2 ** 20
+    line = (f"Job {job} (worker {stats['pid']}): {stats['seconds']:.1f}s, RSS {stats['rss_after'] / mb:.0f} MB "
+            f"({(stats['rss_after'] - stats['rss_before']) / mb:+.1f} MB), peak {stats['peak_rss'] / mb:.0f} MB")
+    if stats['error']:
+        line += f", failed: {stats['error']}"
+    return line
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Accuracy and speed benchmark of the screen analysis on synthetic recordings
+# with known ground truth (see analysis/synthetic_recording.py). Every stage
+# (scene detection, cursor tracking, focus tracking) runs in a fresh process so
+# its peak RSS is its own; scene detection starts without cached scores.
+#
+#   python benchmarks/analysis_benchmark.py [quick|full] [OUTPUT_JSON]
+
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, 'analysis'))
+
+from synthetic_recording import load_ground_truth, save_ground_truth, write_screen_recording
+
+# Recording name -> write_screen_recording arguments
+QUICK_SUITE = {
+    'three-cuts-360p': dict(cuts=[90, 180, 270], frames=360, size=(640, 360)),
+    'quick-cuts-360p': dict(cuts=[30, 38, 200], frames=240, size=(640, 360), cursor='scripted', seed=1),
+}
+FULL_SUITE = dict(QUICK_SUITE, **{
+    'scripted-720p': dict(cuts=[100, 101, 250, 400], frames=450, size=(1280, 720), cursor='scripted', seed=2),
+    'scripted-1080p': dict(cuts=[120, 240], frames=300, size=(1920, 1080), cursor='scripted', seed=3),
+})
+SUITES = {'quick': QUICK_SUITE, 'full': FULL_SUITE}
+STAGES = ('scenes', 'cursor', 'focus')
+# A detected scene start within this many frames of a cut counts as found
+BOUNDARY_TOLERANCE = 2
+# A focus box counts as found when it overlaps the focus ring by at least this IoU
+FOCUS_MIN_IOU = 0.5
+
+
+def clear_cached_scores(video_path):
+    """Remove the scene scores and seek index cached next to a video."""
+    from scene_scores import SCORES_META_SUFFIX, SCORES_SUFFIX
+    from seek_index import SEEK_INDEX_SUFFIX
+    for suffix in (SCORES_SUFFIX, SCORES_META_SUFFIX, SEEK_INDEX_SUFFIX):
+        if os.path.exists(video_path + suffix):
+            os.remove(video_path + suffix)
+
+
+def run_stage(stage, video_path, truth_path):
+    """
+    Run one analysis stage on a recording (in a worker process)
+
+    Args:
+        stage: 'scenes', 'cursor' or 'focus'
+        video_path: Path to the synthetic recording
+        truth_path: Path to its ground truth JSON
+
+    Returns:
+        Dict with the elapsed seconds, the peak RSS in bytes and the stage's
+        output: detected scenes, or the cursor trajectory / focus boxes as lists
+    """
+    import analyse_m_s
+
+    truth = load_ground_truth(truth_path)
+    if stage == 'scenes':
+        clear_cached_scores(video_path)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage == 'scenes':
+            output = [list(scene) for scene in analyse_m_s.detect_scenes(video_path)]
+        else:
+            # Track within the true scenes, so tracking errors are not mixed with scene detection errors
+            timelines = []
+            kind = 'mousecursor' if stage == 'cursor' else 'keyboard'
+            for start_frame, end_frame in truth['scenes']:
+                analyse_m_s.accumulate_scene_heatmap(kind, video_path, start_frame, end_frame, trajectories=timelines)
+            records = np.concatenate(timelines) if timelines else np.empty(0)
+            output = {name: records[name].tolist() for name in records.dtype.names or ()}
+    elapsed = time.perf_counter() - start
+    return {
+        'seconds': elapsed,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'output': output,
+    }
+
+
+def boundary_precision_recall(scenes, cuts, tolerance=BOUNDARY_TOLERANCE):
+    """
+    Precision and recall of detected scene boundaries
+
+    Args:
+        scenes: Detected (start_frame, end_frame) scenes
+        cuts: True scene cut frames
+        tolerance: Maximum distance in frames between a detected start and a cut
+
+    Returns:
+        (precision, recall); 1.0 when there is nothing to find or nothing found
+    """
+    detected = [start for start, _ in scenes if start > 0]
+    unmatched = list(cuts)
+    found = 0
+    for start in detected:
+        nearest = min(unmatched, key=lambda cut: abs(cut - start), default=None)
+        if nearest is not None and abs(nearest - start) <= tolerance:
+            unmatched.remove(nearest)
+            found += 1
+    precision = found / len(detected) if detected else 1.0
+    recall = found / len(cuts) if cuts else 1.0
+    return precision, recall
+
+
+def cursor_errors(trajectory, truth):
+    """
+    Distance in pixels between tracked and true cursor positions, for every
+    trajectory record (compared with the cursor drawn in the record's frame)
+    """
+    frames = np.asarray(trajectory['frame'], dtype=int)
+    tracked = np.stack([trajectory['x'], trajectory['y']], axis=1)
+    return np.linalg.norm(tracked - truth['cursor'][frames], axis=1)
+
+
+def box_iou(boxes, box):
+    """IoU of (n, 4) x, y, w, h boxes with one box."""
+    x1 = np.maximum(boxes[:, 0], box[0])
+    y1 = np.maximum(boxes[:, 1], box[1])
+    x2 = np.minimum(boxes[:, 0] + boxes[:, 2], box[0] + box[2])
+    y2 = np.minimum(boxes[:, 1] + boxes[:, 3], box[1] + box[3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    return intersection / (boxes[:, 2] * boxes[:, 3] + box[2] * box[3] - intersection)
+
+
+def focus_scores(focus_boxes, truth, min_iou=FOCUS_MIN_IOU):
+    """
+    How well the focus boxes follow the focus ring
+
+    Returns:
+        (recall, mean_iou): the fraction of frames with a box matching the
+        ring, and the mean best IoU over frames that have boxes
+    """
+    frames = np.asarray(focus_boxes['frame'], dtype=int)
+    boxes = np.stack([focus_boxes[name] for name in ('x', 'y', 'w', 'h')], axis=1) if len(frames) else None
+    best = []
+    for frame in np.unique(frames):
+        best.append(box_iou(boxes[frames == frame], truth['focus'][frame]).max())
+    best = np.array(best)
+    recall = float(np.sum(best >= min_iou)) / truth['frames']
+    return recall, float(best.mean()) if len(best) else 0.0
+
+
+def benchmark_recording(name, video_path, truth_path):
+    """Run all stages on one recording and score them against its ground truth."""
+    truth = load_ground_truth(truth_path)
+    results = {'recording': name, 'frames': truth['frames'], 'size': truth['size']}
+    for stage in STAGES:
+        # A new process per stage, so ru_maxrss is the stage's own peak
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            result = pool.submit(run_stage, stage, video_path, truth_path).result()
+        scores = {
+            'fps': truth['frames'] / result['seconds'],
+            'seconds': result['seconds'],
+            'peak_rss_mb': result['peak_rss'] / 2 ** 20,
+        }
+        if stage == 'scenes':
+            scores['detected'] = len(result['output'])
+            scores['precision'], scores['recall'] = boundary_precision_recall(result['output'], truth['cuts'])
+        elif stage == 'cursor':
+            errors = cursor_errors(result['output'], truth)
+            scores['median_error_px'] = float(np.median(errors)) if len(errors) else None
+            scores['p90_error_px'] = float(np.percentile(errors, 90)) if len(errors) else None
+        else:
+            scores['recall'], scores['mean_iou'] = focus_scores(result['output'], truth)
+        results[stage] = scores
+    return results
+
+
+def format_result(results):
+    """One table row per stage of a recording."""
+    rows = []
+    for stage in STAGES:
+        scores = results[stage]
+        if stage == 'scenes':
+            accuracy = f"precision {scores['precision']:.2f} recall {scores['recall']:.2f}"
+        elif stage == 'cursor':
+            accuracy = (f"error median {scores['median_error_px']:.1f}px p90 {scores['p90_error_px']:.1f}px"
+                        if scores['median_error_px'] is not None else "no trajectory")
+        else:
+            accuracy = f"recall {scores['recall']:.2f} mean IoU {scores['mean_iou']:.2f}"
+        rows.append(f"{results['recording']:<18} {stage:<7} {scores['fps']:>8.0f} {scores['peak_rss_mb']:>8.0f}MB  "
+                    f"{accuracy}")
+    return '\n'.join(rows)
+
+
+def main():
+    suite = sys.argv[1] if len(sys.argv) > 1 else 'quick'
+    output_path = sys.argv[2] if len(sys.argv) > 2 else None
+    if suite not in SUITES:
+        print(f"Unknown suite {suite!r}, expected one of {', '.join(SUITES)}")
+        sys.exit(1)
+
+    results = []
+    print(f"{'recording':<18} {'stage':<7} {'fps':>8} {'peak RSS':>10}  accuracy")
+    with tempfile.TemporaryDirectory(prefix='analysis_benchmark_') as folder:
+        for name, arguments in SUITES[suite].items():
+            video_path = os.path.join(folder, f"{name}.mp4")
+            truth_path = save_ground_truth(os.path.join(folder, f"{name}.json"),
+                                           write_screen_recording(video_path, **arguments))
+            results.append(benchmark_recording(name, video_path, truth_path))
+            print(format_result(results[-1]))
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump({'suite': suite, 'results': results}, f, indent=2)
+        print(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Import-time benchmark of the pipeline entry points. Every entry point is
+# imported (not run) in fresh interpreters, the way a short-lived worker
+# container starts, and the slowest imports are listed from -X importtime.
+#
+#   python benchmarks/import_time.py [RUNS] [ENTRY_POINT...]
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Entry point name -> (folder, file)
+ENTRY_POINTS = {
+    'analysis': ('analysis', 'analyse_m_s.py'),
+    'analysis-worker': ('analysis', 'process_s3_videos_new.py'),
+    'aggregate': ('analysis', 'aggregate.py'),
+    'backend': (os.path.join('Recording', 'backend'), 'app.py'),
+    'sentiment': ('sentiment', 'Sentiment analysis.py'),
+    'preprocessing': ('preprocessing', 'process_from_s3.py'),
+}
+DEFAULT_RUNS = 5
+TOP_IMPORTS = 5
+
+# Imports one file as a module (without running its __main__ block) and prints the elapsed time
+IMPORT_SNIPPET = """
+import importlib.util, json, sys, time
+folder, path = sys.argv[1], sys.argv[2]
+sys.path.insert(0, folder)
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('entry_point', path)
+module = importlib.util.module_from_spec(spec)
+try:
+    spec.loader.exec_module(module)
+    error = None
+except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+print(json.dumps({'seconds': time.perf_counter() - start, 'error': error, 'modules': len(sys.modules)}))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Top-level packages by cumulative import time, from python -X importtime output
+
+    Args:
+        stderr: Standard error of the interpreter
+
+    Returns:
+        List of (package, seconds), slowest first
+    """
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # Only count packages imported directly (not nested under another import)
+        if name.startswith('  '):
+            continue
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(cumulative) / 1e6
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def time_entry_point(name, runs=DEFAULT_RUNS):
+    """
+    Import an entry point in `runs` fresh interpreters
+
+    Args:
+        name: Key of ENTRY_POINTS
+        runs: Number of interpreters to start
+
+    Returns:
+        Dict with the median, min and max import time in seconds, the import
+        error if the entry point cannot be imported here, and its slowest imports
+    """
+    folder, filename = ENTRY_POINTS[name]
+    folder = os.path.join(REPO, folder)
+    times, slowest, result = [], [], {}
+    for run in range(runs):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', IMPORT_SNIPPET, folder, os.path.join(folder, filename)],
+            cwd=folder, capture_output=True, text=True
+        )
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        times.append(result['seconds'])
+        if run == 0:
+            slowest = parse_importtime(process.stderr)[:TOP_IMPORTS]
+    return {
+        'entry_point': name,
+        'median': statistics.median(times),
+        'min': min(times),
+        'max': max(times),
+        'modules': result['modules'],
+        'error': result['error'],
+        'slowest': slowest,
+    }
+
+
+def interpreter_start_time(runs=DEFAULT_RUNS):
+    """Median wall time of starting and stopping an empty interpreter, for reference."""
+    import time
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS
+    names = sys.argv[2:] or list(ENTRY_POINTS)
+    print(f"Python {sys.version.split()[0]}, {runs} runs per entry point, "
+          f"empty interpreter {interpreter_start_time(runs) * 1000:.0f} ms")
+    print(f"{'entry point':<16} {'median':>9} {'min':>9} {'max':>9} {'modules':>8}  slowest imports")
+    for name in names:
+        result = time_entry_point(name, runs)
+        slowest = ', '.join(f"{package} {seconds * 1000:.0f}ms" for package, seconds in result['slowest'])
+        print(f"{name:<16} {result['median'] * 1000:>7.0f}ms {result['min'] * 1000:>7.0f}ms "
+              f"{result['max'] * 1000:>7.0f}ms {result['modules']:>8}  {slowest}")
+        if result['error']:
+            print(f"{'':<16} import failed: {result['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Every finished span is appended to this file as one JSON line (unset: spans are timed but not written)
+INSTRUMENTATION_LOG = os.environ.get('INSTRUMENTATION_LOG')
+# Seconds between the sampling profiler's stack samples (0 disables the profiler)
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0'))
+# Folded stacks of the profiler (flamegraph.pl / speedscope format), written at exit; {pid} is the process ID
+PROFILE_OUTPUT = os.environ.get('PROFILE_OUTPUT', 'profile-{pid}.folded')
+
+_config = {'log': INSTRUMENTATION_LOG, 'profile_interval': PROFILE_INTERVAL, 'profile_output': PROFILE_OUTPUT}
+_write_lock = threading.Lock()
+_local = threading.local()
+# Open spans of every thread that has any, read by the profiler
+_thread_spans = {}
+_profiler = None
+
+
+def configure(log=None, profile_interval=None, profile_output=None):
+    """
+    Override the INSTRUMENTATION_LOG, PROFILE_INTERVAL and PROFILE_OUTPUT settings
+
+    Args:
+        log: JSONL path, '' to stop writing spans
+        profile_interval: Seconds between profiler samples, 0 to stop the profiler
+        profile_output: Folded stacks path ({pid} is replaced by the process ID)
+    """
+    global _profiler
+    if log is not None:
+        _config['log'] = log or None
+    if profile_output is not None:
+        _config['profile_output'] = profile_output
+    if profile_interval is not None:
+        _config['profile_interval'] = profile_interval
+        if not profile_interval and _profiler is not None:
+            atexit.unregister(_write_profile)
+            _write_profile(_profiler)
+            _profiler = None
+
+
+def current_rss():
+    """Resident set size of this process in bytes (None where /proc is not available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Span:
+    """
+    A timed pipeline stage, see span()
+
+    Counters added with add() and fields set with set() are written with the
+    span's duration, CPU time and memory when it closes.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.id = os.urandom(8).hex()
+        self.parent = None
+        self.root = self.id
+
+    def add(self, **counters):
+        """Add to numeric counters, e.g. frames=1 or bytes=size."""
+        for key, value in counters.items():
+            self.fields[key] = self.fields.get(key, 0) + value
+        return self
+
+    def set(self, **fields):
+        """Set fields of the record."""
+        self.fields.update(fields)
+        return self
+
+    def __enter__(self):
+        stack = _span_stack()
+        if stack:
+            self.parent = stack[-1].id
+            self.root = stack[-1].root
+        stack.append(self)
+        _thread_spans[threading.get_ident()] = stack
+        _start_profiler()
+        self._start = time.time()
+        self._times = os.times()
+        self._perf = time.perf_counter()
+        self._rss = current_rss()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._perf
+        times = os.times()
+        stack = _span_stack()
+        if self in stack:
+            stack.remove(self)
+        if not stack:
+            _thread_spans.pop(threading.get_ident(), None)
+        if not _config['log']:
+            return False
+        rss = current_rss()
+        record = {
+            'span': self.name,
+            'id': self.id,
+            'parent': self.parent,
+            'root': self.root,
+            'pid': os.getpid(),
+            'start': round(self._start, 6),
+            'seconds': round(seconds, 6),
+            'cpu_seconds': round(times.user + times.system - self._times.user - self._times.system, 3),
+            # CPU time of finished subprocesses, e.g. FFmpeg
+            'child_cpu_seconds': round(times.children_user + times.children_system
+                                       - self._times.children_user - self._times.children_system, 3),
+            'rss': rss,
+            'rss_delta': rss - self._rss if rss is not None and self._rss is not None else None,
+            'peak_rss': peak_rss(),
+        }
+        if exc_type is not None:
+            record['error'] = f"{exc_type.__name__}: {exc}"
+        record.update(self.fields)
+        write_record(record)
+        return False
+
+
+class _NoSpan(Span):
+    """Stand-in returned by current_span() outside any span: counters are dropped."""
+
+    def __init__(self):
+        super().__init__(None, {})
+
+    def add(self, **counters):
+        return self
+
+    def set(self, **fields):
+        return self
+
+
+def span(name, **fields):
+    """
+    Time a pipeline stage
+
+        with span('download', key=key) as stage:
+            ...
+            stage.add(bytes=os.path.getsize(path))
+
+    Spans nest: a span opened inside another records it as its parent, and
+    all spans opened under the same outermost span share its root ID.
+
+    Args:
+        name: Stage name
+        **fields: Fields written with the record (JSON-serializable)
+
+    Returns:
+        Span context manager
+    """
+    return Span(name, dict(fields))
+
+
+def current_span():
+    """The innermost open span of this thread, or a stand-in that ignores counters."""
+    stack = _span_stack()
+    return stack[-1] if stack else _NoSpan()
+
+
+def write_record(record):
+    """Append one record to the instrumentation log."""
+    path = _config['log']
+    if not path:
+        return
+    line = json.dumps(record, default=str) + '\n'
+    try:
+        with _write_lock, open(path, 'a') as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Warning: Could not write instrumentation record to {path}: {e}")
+
+
+def read_records(path):
+    """Read the records of an instrumentation log."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _span_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of all threads on a background thread
+
+    Every sample is prefixed with the sampled thread's open spans, so the
+    profile can be split by pipeline stage.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = {}
+        self.pid = os.getpid()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                spans = [f"span:{s.name}" for s in list(_thread_spans.get(thread_id, ()))]
+                key = ';'.join(spans + stack[::-1])
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def write(self, path):
+        """Write the samples as folded stacks, one 'frame;frame;... count' line per stack."""
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def _profiler_output():
+    return _config['profile_output'].replace('{pid}', str(os.getpid()))
+
+
+def _start_profiler():
+    global _profiler
+    # A forked child inherits the parent's profiler object but not its thread
+    if not _config['profile_interval'] or (_profiler is not None and _profiler.pid == os.getpid()):
+        return
+    _profiler = SamplingProfiler(_config['profile_interval']).start()
+    atexit.register(_write_profile, _profiler)
+
+
+def _write_profile(profiler):
+    profiler.stop()
+    if profiler.samples and profiler.pid == os.getpid():
+        print(f"Profile written to {profiler.write(_profiler_output())}")
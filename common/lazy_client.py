@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import importlib
+import threading
+
+
+class LazyClient:
+    """
+    A boto3 client that is created on first use
+
+    Importing boto3 and building a client is a large part of the start-up
+    time of the services and workers, so it is deferred until the client is
+    first needed (a worker that finds nothing to do never pays it), or done
+    in the background by warm_up() while the service starts.
+    """
+
+    def __init__(self, service_name, **config):
+        self._service_name = service_name
+        self._config = config
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        """The underlying boto3 client (created on the first call)."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    self._client = boto3.client(self._service_name, **self._config)
+        return self._client
+
+    def warm_up(self):
+        """Create the client on a background thread."""
+        thread = threading.Thread(target=self.client, name=f"{self._service_name}-client-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def __getattr__(self, name):
+        return getattr(self.client(), name)
+
+
+def import_in_background(*module_names):
+    """
+    Import modules on a background thread, so their first use does not wait for them
+
+    Args:
+        module_names: Names of the modules to import, in order
+
+    Returns:
+        The started thread
+    """
+    def _import():
+        for name in module_names:
+            importlib.import_module(name)
+    thread = threading.Thread(target=_import, name='import-warmup', daemon=True)
+    thread.start()
+    return thread
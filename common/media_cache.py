@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking between processes
+    fcntl = None
+
+from instrumentation import current_span
+
+# Downloaded recordings are kept here, shared by every pipeline on the host (same folder and user)
+MEDIA_CACHE_DIR = os.environ.get('MEDIA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'media-cache'))
+# Least recently used recordings are evicted once the cache holds more than this many MB
+MEDIA_CACHE_MAX_MB = float(os.environ.get('MEDIA_CACHE_MAX_MB', '10240'))
+# Unfinished downloads older than this (seconds) are left over from a crash and removed on eviction
+STALE_DOWNLOAD_SECONDS = 3600
+# Entry names are SHA-256 hex digests
+ENTRY_NAME_LENGTH = 64
+
+
+def entry_name(bucket, key, etag):
+    """Name of the cache entry of one version of an S3 object."""
+    etag = etag.strip('"')
+    return hashlib.sha256(f"{bucket}\0{key}\0{etag}".encode()).hexdigest()
+
+
+class MediaCache:
+    """
+    Read-through on-disk cache of S3 objects, keyed by bucket, key and ETag
+
+    A new upload to the same key has a new ETag, so it is a new entry. While
+    a pipeline uses a cached file it holds a shared lock on the entry, which
+    eviction skips and other readers share; downloads hold an exclusive
+    lock, so processes fetching the same object at the same time download
+    it once.
+    """
+
+    def __init__(self, root=MEDIA_CACHE_DIR, max_mb=MEDIA_CACHE_MAX_MB):
+        self.root = root
+        self.max_bytes = max_mb * 2 ** 20
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'locks'), exist_ok=True)
+
+    def object_path(self, name, key):
+        # Keep the extension, FFmpeg and the audio libraries look at it
+        return os.path.join(self.root, 'objects', name[:2], name + os.path.splitext(key)[1].lower())
+
+    @contextlib.contextmanager
+    def fetch(self, s3, bucket, key, etag=None):
+        """
+        Local path of an S3 object, downloaded on the first fetch
+
+            with cache.fetch(s3, BUCKET, key) as path:
+                ...
+
+        The file must only be read, and only inside the with block.
+
+        Args:
+            s3: boto3 S3 client
+            bucket: Bucket name
+            key: Object key
+            etag: The object's ETag if known (e.g. from a listing), otherwise read with head_object
+
+        Yields:
+            Path of the cached file
+        """
+        if etag is None:
+            etag = s3.head_object(Bucket=bucket, Key=key)['ETag']
+        name = entry_name(bucket, key, etag)
+        path = self.object_path(name, key)
+        downloaded = False
+        while True:
+            # Cached files are read under a shared lock, so pipelines using the
+            # same recording run side by side; only a download takes the
+            # exclusive lock, then the entry is looked up again under the
+            # shared one (in case it was evicted in between)
+            lock = self._lock_entry(name, exclusive=False)
+            if os.path.exists(path):
+                break
+            lock.close()
+            with self._lock_entry(name, exclusive=True):
+                if not os.path.exists(path):
+                    self._download(s3, bucket, key, path)
+                    downloaded = True
+        try:
+            if downloaded:
+                self.misses += 1
+            else:
+                self.hits += 1
+                os.utime(path)
+            current_span().set(cache_hit=not downloaded, bytes=os.path.getsize(path))
+            self.evict()
+            yield path
+        finally:
+            lock.close()
+
+    def _download(self, s3, bucket, key, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.part"
+        try:
+            s3.download_file(bucket, key, partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        print(f"Media cache: downloaded s3://{bucket}/{key} ({os.path.getsize(path) / 2 ** 20:.1f} MB)")
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_mb
+
+        An entry is the cached object plus any files the pipelines wrote next
+        to it (e.g. scene scores). Entries in use (locked by any process) are kept.
+
+        Returns:
+            Number of bytes removed
+        """
+        with self._lock_file(os.path.join(self.root, 'cache.lock'), exclusive=True):
+            entries = {}
+            now = time.time()
+            for folder in os.scandir(os.path.join(self.root, 'objects')):
+                if not folder.is_dir():
+                    continue
+                for file in os.scandir(folder.path):
+                    # Downloads in progress are renamed into place without the cache lock
+                    try:
+                        stat = file.stat()
+                    except FileNotFoundError:
+                        continue
+                    if file.name.endswith('.part'):
+                        if now - stat.st_mtime > STALE_DOWNLOAD_SECONDS:
+                            _remove(file.path)
+                        continue
+                    entry = entries.setdefault(file.name[:ENTRY_NAME_LENGTH], {'used': 0, 'size': 0, 'files': []})
+                    entry['used'] = max(entry['used'], stat.st_mtime)
+                    entry['size'] += stat.st_size
+                    entry['files'].append(file.path)
+            total = sum(entry['size'] for entry in entries.values())
+            removed = 0
+            for name, entry in sorted(entries.items(), key=lambda item: item[1]['used']):
+                if total - removed <= self.max_bytes:
+                    break
+                lock = self._try_lock_entry(name)
+                if lock is None:
+                    continue
+                try:
+                    for path in entry['files']:
+                        _remove(path)
+                    _remove(self._entry_lock_path(name))
+                    removed += entry['size']
+                finally:
+                    lock.close()
+            return removed
+
+    def _entry_lock_path(self, name):
+        return os.path.join(self.root, 'locks', name + '.lock')
+
+    def _lock_entry(self, name, exclusive):
+        return self._lock_file(self._entry_lock_path(name), exclusive)
+
+    def _try_lock_entry(self, name):
+        try:
+            return self._lock_file(self._entry_lock_path(name), exclusive=True, blocking=False)
+        except BlockingIOError:
+            return None
+
+    def _lock_file(self, path, exclusive, blocking=True):
+        # Returns the open lock file; closing it releases the lock. Eviction
+        # removes lock files, so retry if ours was removed while we waited.
+        while True:
+            lock = open(path, 'a+')
+            if fcntl is None:
+                return lock
+            try:
+                flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+                fcntl.flock(lock, flags if blocking else flags | fcntl.LOCK_NB)
+            except BaseException:
+                lock.close()
+                raise
+            try:
+                if os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino:
+                    return lock
+            except FileNotFoundError:
+                pass
+            lock.close()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_default_cache = None
+
+
+def default_cache():
+    """The MediaCache at MEDIA_CACHE_DIR (created on first use)."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = MediaCache()
+    return _default_cache
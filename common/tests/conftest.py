@@ -0,0 +1,5 @@
+# common/tests/conftest.py
+import os, sys
+
+# find and import the shared modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,31 @@
+import sys
+
+import boto3
+
+import lazy_client
+from lazy_client import LazyClient
+
+# The client is only created when it is first used, once
+def test_lazy_client_1(monkeypatch):
+    created = []
+
+    class Client:
+        def list_buckets(self):
+            return {'Buckets': []}
+
+    def client(service_name, **config):
+        created.append((service_name, config))
+        return Client()
+    monkeypatch.setattr(boto3, 'client', client)
+
+    lazy = LazyClient('s3', region_name='test-region')
+    assert created == []
+    assert lazy.list_buckets() == {'Buckets': []}
+    lazy.warm_up().join()
+    assert isinstance(lazy.client(), Client)
+    assert created == [('s3', {'region_name': 'test-region'})]
+
+def test_import_in_background_1():
+    sys.modules.pop('csv', None)
+    lazy_client.import_in_background('json', 'csv').join()
+    assert 'csv' in sys.modules
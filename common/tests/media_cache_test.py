@@ -0,0 +1,99 @@
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from media_cache import MediaCache
+
+class FolderS3:
+    """S3 stand-in serving the files of a folder; every download is logged to a file, across processes."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.log = os.path.join(folder, 'downloads.log')
+
+    def head_object(self, Bucket, Key):
+        stat = os.stat(os.path.join(self.folder, Key))
+        return {'ETag': f'"{stat.st_size}-{stat.st_mtime_ns}"'}
+
+    def download_file(self, bucket, key, path):
+        time.sleep(0.05)
+        shutil.copyfile(os.path.join(self.folder, key), path)
+        with open(self.log, 'a') as f:
+            f.write(key + '\n')
+
+    def downloads(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            return f.read().split()
+
+@pytest.fixture
+def bucket(tmp_path):
+    folder = tmp_path / 'bucket'
+    folder.mkdir()
+    for name, size in (('a.webm', 300), ('b.webm', 300), ('c.webm', 300)):
+        (folder / name).write_bytes(os.urandom(size * 1024))
+    return FolderS3(str(folder))
+
+def test_media_cache_1(tmp_path, bucket):
+    cache = MediaCache(str(tmp_path / 'cache'), max_mb=1)
+    with cache.fetch(bucket, 'bucket', 'a.webm') as path:
+        assert path.endswith('.webm') and open(path, 'rb').read() == open(os.path.join(bucket.folder, 'a.webm'), 'rb').read()
+    with cache.fetch(bucket, 'bucket', 'a.webm') as again:
+        assert again == path
+    assert (cache.hits, cache.misses) == (1, 1) and bucket.downloads() == ['a.webm']
+
+    # A new upload under the same key has a new ETag
+    with open(os.path.join(bucket.folder, 'a.webm'), 'ab') as f:
+        f.write(b'more')
+    with cache.fetch(bucket, 'bucket', 'a.webm') as new_path:
+        assert new_path != path and os.path.getsize(new_path) == 300 * 1024 + 4
+    assert bucket.downloads() == ['a.webm', 'a.webm']
+
+def test_media_cache_eviction_1(tmp_path, bucket):
+    cache = MediaCache(str(tmp_path / 'cache'), max_mb=0.7)
+    with cache.fetch(bucket, 'bucket', 'a.webm') as a:
+        pass
+    with cache.fetch(bucket, 'bucket', 'b.webm') as b:
+        # Sidecar files belong to the entry
+        open(b + '.scenescores.npy', 'wb').close()
+    time.sleep(0.01)
+    with cache.fetch(bucket, 'bucket', 'a.webm'):
+        pass
+    # Over the limit: b is the least recently used
+    with cache.fetch(bucket, 'bucket', 'c.webm') as c:
+        assert os.path.exists(a) and os.path.exists(c)
+        assert not os.path.exists(b) and not os.path.exists(b + '.scenescores.npy')
+
+        # Entries in use are never evicted, even over the limit
+        cache.max_bytes = 0
+        assert cache.evict() == 300 * 1024
+        assert os.path.exists(c) and not os.path.exists(a)
+
+def fetch_size(root, bucket, key):
+    with MediaCache(root, max_mb=100).fetch(bucket, 'bucket', key) as path:
+        time.sleep(0.05)
+        return os.path.getsize(path)
+
+def test_media_cache_processes_1(tmp_path, bucket):
+    root = str(tmp_path / 'cache')
+    with ProcessPoolExecutor(max_workers=6) as pool:
+        sizes = list(pool.map(fetch_size, [root] * 12, [bucket] * 12, ['a.webm', 'b.webm'] * 6))
+    assert sizes == [300 * 1024] * 12
+    assert sorted(bucket.downloads()) == ['a.webm', 'b.webm']
+
+def test_media_cache_readers_1(tmp_path, bucket):
+    root = str(tmp_path / 'cache')
+    cache = MediaCache(root, max_mb=100)
+    with cache.fetch(bucket, 'bucket', 'a.webm'):
+        pass
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        # Start the worker first, so it does not inherit the lock taken below
+        pool.submit(os.getpid).result()
+        with cache.fetch(bucket, 'bucket', 'a.webm'):
+            # Another process reads the cached recording while this one still uses it
+            assert pool.submit(fetch_size, root, bucket, 'a.webm').result(timeout=10) == 300 * 1024
+    assert bucket.downloads() == ['a.webm']
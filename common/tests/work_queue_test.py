@@ -0,0 +1,86 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from work_queue import WorkQueue
+
+def test_work_queue_1(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite3'))
+    assert queue.put('analysis', 'a/screen.webm') and queue.put('analysis', 'b/screen.webm')
+    # Already pending; other queues are independent
+    assert not queue.put('analysis', 'a/screen.webm')
+    assert queue.put('preprocessing', 'a/screen.webm')
+
+    first = queue.receive('analysis')
+    assert (first.body, first.attempts) == ('a/screen.webm', 1)
+    assert queue.receive('analysis').body == 'b/screen.webm'
+    assert queue.receive('analysis') is None
+    assert queue.counts('analysis') == {'visible': 0, 'in_flight': 2, 'failed': 0}
+
+    queue.ack(first)
+    assert queue.counts('analysis')['in_flight'] == 1
+    # Processed messages can be published again
+    assert queue.put('analysis', 'a/screen.webm')
+
+def test_work_queue_redelivery_1(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite3'))
+    queue.put('analysis', 'a/screen.webm')
+
+    # Not acknowledged in time (crashed worker): delivered again
+    message = queue.receive('analysis', visibility_timeout=0.05)
+    assert queue.receive('analysis') is None
+    time.sleep(0.1)
+    message = queue.receive('analysis')
+    assert message.attempts == 2
+
+    # Published again while in flight: delivered once more after the ack
+    queue.put('analysis', 'a/screen.webm')
+    queue.ack(message)
+    again = queue.wait('analysis', timeout=1)
+    assert again.body == 'a/screen.webm' and again.attempts == 1
+
+    queue.release(again, "ValueError: bad recording", delay=60)
+    assert queue.receive('analysis') is None
+    queue.dead_letter(again, "ValueError: bad recording")
+    assert queue.counts('analysis') == {'visible': 0, 'in_flight': 0, 'failed': 1}
+    assert queue.wait('analysis', timeout=0.1) is None
+
+def consume(path):
+    queue = WorkQueue(path)
+    bodies = []
+    while True:
+        message = queue.wait('analysis', timeout=0.5)
+        if message is None:
+            return bodies
+        bodies.append(message.body)
+        queue.ack(message)
+
+def test_work_queue_processes_1(tmp_path):
+    path = str(tmp_path / 'queue.sqlite3')
+    queue = WorkQueue(path)
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        consumers = [pool.submit(consume, path) for _ in range(4)]
+        for n in range(200):
+            queue.put('analysis', f"session{n}/screen.webm")
+        received = [body for consumer in consumers for body in consumer.result()]
+    # Every message is delivered exactly once
+    assert sorted(received) == sorted(f"session{n}/screen.webm" for n in range(200))
+
+def test_work_queue_consume_1(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite3'))
+    for body in ('ok', 'flaky', 'broken'):
+        queue.put('analysis', body)
+    calls = []
+
+    def handle(message):
+        calls.append(message.body)
+        if message.body == 'broken':
+            raise ValueError("bad recording")
+        if message.body == 'flaky' and message.attempts == 1:
+            return "timed out"
+
+    assert queue.consume('analysis', handle, max_attempts=2, retry_delay=0, timeout=0.2) == 5
+    # Retried until handled, or until it failed max_attempts times
+    assert sorted(calls) == ['broken', 'broken', 'flaky', 'flaky', 'ok']
+    assert queue.counts('analysis') == {'visible': 0, 'in_flight': 0, 'failed': 1}
+    failed = queue._conn.execute("SELECT body, last_error FROM messages WHERE queue = 'analysis:failed'").fetchall()
+    assert failed == [('broken', "ValueError: bad recording")]
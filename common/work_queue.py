@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import collections
+import contextlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Durable queue of new recordings, written by the backend when a recording is
+# uploaded and consumed by the pipelines on the same host (a stand-in for SQS
+# or S3 event notifications)
+WORK_QUEUE_PATH = os.environ.get('WORK_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'work-queue.sqlite3'))
+# Queues every uploaded recording is published to, one per consuming pipeline
+WORK_QUEUES = tuple(name for name in os.environ.get('WORK_QUEUES', 'analysis,preprocessing').split(',') if name)
+# A received message is delivered again if it is not acknowledged within this many seconds (crashed worker)
+VISIBILITY_TIMEOUT = float(os.environ.get('WORK_QUEUE_VISIBILITY_TIMEOUT', '3600'))
+# Seconds between checks for new messages while a consumer waits
+POLL_INTERVAL = 0.5
+# Seconds a connection waits for another process's write lock
+BUSY_TIMEOUT = 30
+# Messages that failed too often are moved to the queue named <queue><FAILED_SUFFIX>
+FAILED_SUFFIX = ':failed'
+# Consumers (WorkQueue.consume) make this many attempts per message before moving it to the failed queue ...
+MAX_ATTEMPTS = int(os.environ.get('WORK_QUEUE_MAX_ATTEMPTS', '3'))
+# ... and retry a failed message after this many seconds
+RETRY_DELAY = float(os.environ.get('WORK_QUEUE_RETRY_DELAY', '60'))
+# Bodies are S3 keys of uploaded recordings, except for messages of the form
+# <AGGREGATE_REBUILD_PREFIX><project>/[<task>], which ask the analysis workers to
+# rebuild the project aggregates after sessions were deleted
+AGGREGATE_REBUILD_PREFIX = 'aggregate-rebuild:'
+
+# A message is pending until it is acknowledged (deleted). Bodies are unique
+# per queue, so publishing a recording that is already pending is a no-op.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    queue TEXT NOT NULL,
+    body TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    visible_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    UNIQUE (queue, body)
+);
+CREATE INDEX IF NOT EXISTS messages_visible ON messages (queue, visible_at);
+"""
+
+Message = collections.namedtuple('Message', ['id', 'queue', 'body', 'enqueued_at', 'attempts'])
+
+
+class WorkQueue:
+    """
+    At-least-once work queue in a SQLite file, safe to share between processes
+
+    Consumers receive a message, process it and acknowledge it; a message
+    that is not acknowledged within the visibility timeout is delivered
+    again. Publishing a body that is already pending (e.g. a recording
+    uploaded again) does not add a second message, but a message published
+    again while it is being processed is delivered once more afterwards.
+    """
+
+    def __init__(self, path=WORK_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def put(self, queue, body):
+        """
+        Publish a message
+
+        Args:
+            queue: Queue name
+            body: Message body (e.g. an S3 key)
+
+        Returns:
+            True if a new message was added, False if the body was already pending
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            pending = conn.execute('SELECT id FROM messages WHERE queue = ? AND body = ?', (queue, body)).fetchone()
+            if pending is None:
+                conn.execute('INSERT INTO messages (queue, body, enqueued_at, visible_at) VALUES (?, ?, ?, ?)',
+                             (queue, body, now, now))
+                return True
+            # Published again: acknowledging the delivery in progress (older enqueued_at) keeps it
+            conn.execute('UPDATE messages SET enqueued_at = ? WHERE id = ?', (now, pending[0]))
+            return False
+
+    def receive(self, queue, visibility_timeout=VISIBILITY_TIMEOUT):
+        """
+        Take the oldest visible message of a queue, hiding it from other consumers for visibility_timeout seconds
+
+        Returns:
+            Message, or None if the queue has no visible message
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT id, queue, body, enqueued_at, attempts FROM messages '
+                               'WHERE queue = ? AND visible_at <= ? ORDER BY id LIMIT 1',
+                               (queue, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE messages SET visible_at = ?, attempts = attempts + 1 WHERE id = ?',
+                         (now + visibility_timeout, row[0]))
+            return Message(row[0], row[1], row[2], row[3], row[4] + 1)
+
+    def wait(self, queue, timeout=None, visibility_timeout=VISIBILITY_TIMEOUT):
+        """
+        Receive the next message, waiting for one to be published
+
+        Args:
+            queue: Queue name
+            timeout: Seconds to wait at most (None: forever)
+            visibility_timeout: See receive
+
+        Returns:
+            Message, or None if none arrived within timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            message = self.receive(queue, visibility_timeout)
+            if message is not None:
+                return message
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL if deadline is None else max(0, min(POLL_INTERVAL, deadline - time.monotonic())))
+
+    def ack(self, message):
+        """Remove a processed message (or make it visible again if it was published again meanwhile)."""
+        with self._transaction() as conn:
+            deleted = conn.execute('DELETE FROM messages WHERE id = ? AND enqueued_at = ?',
+                                   (message.id, message.enqueued_at)).rowcount
+            if not deleted:
+                conn.execute('UPDATE messages SET visible_at = ?, attempts = 0 WHERE id = ?',
+                             (time.time(), message.id))
+
+    def release(self, message, error=None, delay=0):
+        """Make a message that could not be processed visible again after delay seconds."""
+        with self._transaction() as conn:
+            conn.execute('UPDATE messages SET visible_at = ?, last_error = ? WHERE id = ?',
+                         (time.time() + delay, error, message.id))
+
+    def dead_letter(self, message, error=None):
+        """Move a message that failed too often to <queue>:failed, where it stays until published again."""
+        failed_queue = message.queue + FAILED_SUFFIX
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM messages WHERE queue = ? AND body = ?', (failed_queue, message.body))
+            conn.execute('UPDATE messages SET queue = ?, last_error = ? WHERE id = ?',
+                         (failed_queue, error, message.id))
+
+    def consume(self, queue, handle, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY, timeout=None):
+        """
+        Process the messages of a queue as they are published
+
+        A message is acknowledged once handled, released to be retried after
+        retry_delay seconds when handling fails, and moved to the failed queue
+        after max_attempts attempts.
+
+        Args:
+            queue: Queue name
+            handle: Function called with every Message; returns None once it is
+                processed, or an error message (an exception is an error too)
+            max_attempts: Attempts per message before it is moved to the failed queue
+            retry_delay: Seconds before a failed message is delivered again
+            timeout: Return once no message arrived for this many seconds (None: run forever)
+
+        Returns:
+            Number of messages received
+        """
+        received = 0
+        while True:
+            message = self.wait(queue, timeout)
+            if message is None:
+                return received
+            received += 1
+            try:
+                error = handle(message)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            if error is None:
+                self.ack(message)
+                continue
+            print(f"  {message.body} failed (attempt {message.attempts}): {error}")
+            if message.attempts >= max_attempts:
+                print(f"  Giving up on {message.body} after {message.attempts} attempts")
+                self.dead_letter(message, error)
+            else:
+                self.release(message, error, delay=retry_delay)
+
+    def counts(self, queue):
+        """Number of visible, in-flight and failed messages of a queue."""
+        now = time.time()
+        with self._lock:
+            visible, in_flight = self._conn.execute(
+                'SELECT COALESCE(SUM(visible_at <= ?), 0), COALESCE(SUM(visible_at > ?), 0) '
+                'FROM messages WHERE queue = ?', (now, now, queue)).fetchone()
+            failed = self._conn.execute('SELECT COUNT(*) FROM messages WHERE queue = ?',
+                                        (queue + FAILED_SUFFIX,)).fetchone()[0]
+        return {'visible': visible, 'in_flight': in_flight, 'failed': failed}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent
+        # consumers never receive the same message
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
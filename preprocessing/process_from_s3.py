@@ -1,21 +1,33 @@
 import os
-import boto3
+import sys
 import subprocess
-import librosa
 import numpy as np
 import csv
+import tempfile
 import time
-from PIL import Image
-import imagehash
+from contextlib import ExitStack
 from io import BytesIO
+import common_path  # puts ../common (shared modules) on the import path
+from instrumentation import current_span, span
+from media_cache import default_cache
+from lazy_client import LazyClient, import_in_background
 
-s3 = boto3.client("s3")
+# Created on first use: importing boto3 is a large part of the start-up time
+s3 = LazyClient("s3")
 bucket_name = "cs14-2-recordingtool"
 output_prefix = "Output/Video Splitting"
-
-def download_file_from_s3(s3_path, local_path):
-    s3.download_file(bucket_name, s3_path, local_path)
-    print(f"✅ download: {s3_path} -> {local_path}")
+# librosa (with numba) takes seconds to import; it is imported on first use,
+# or in the background while the first recordings download
+HEAVY_MODULES = ("librosa", "imagehash", "PIL.Image")
+# Queue mode: the work queue of uploaded recordings this worker consumes (see common/work_queue.py;
+# failed recordings are retried as set by WORK_QUEUE_MAX_ATTEMPTS and WORK_QUEUE_RETRY_DELAY)
+WORK_QUEUE_NAME = os.environ.get("WORK_QUEUE_NAME", "preprocessing")
+
+def fetch_from_s3(s3_path):
+    # Context manager giving the path of the recording in the media cache
+    # shared with the analysis and sentiment pipelines (downloaded on first use)
+    print(f"✅ download: {s3_path}")
+    return default_cache().fetch(s3, bucket_name, s3_path)
 
 def upload_folder_to_s3(local_folder, s3_folder_prefix):
     for root, _, files in os.walk(local_folder):
@@ -24,6 +36,7 @@ def upload_folder_to_s3(local_folder, s3_folder_prefix):
             relative_path = os.path.relpath(local_file_path, local_folder)
             s3_key = f"{s3_folder_prefix}/{relative_path}"
             s3.upload_file(local_file_path, bucket_name, s3_key)
+            current_span().add(files=1, bytes=os.path.getsize(local_file_path))
             print(f"⬆️ upload: {local_file_path} -> s3://{bucket_name}/{s3_key}")
 
 def extract_audio(video_path, audio_path):
@@ -31,6 +44,7 @@ def extract_audio(video_path, audio_path):
     subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
 def get_audio_peaks(audio_path, sr=22050):
+    import librosa
     y, sr = librosa.load(audio_path, sr=sr)
     rms = librosa.feature.rms(y=y)[0]
     peaks = np.where(rms > np.percentile(rms, 90))[0]
@@ -48,26 +62,27 @@ def get_mouse_click_times(csv_path):
         reader = csv.reader(file)
         next(reader)
         return np.array([float(row[0]) for row in reader if row])
-def get_visual_change_times(video_path, threshold=0.5, frame_rate=1, save_folder="visual_changes"):
-    os.makedirs(save_folder, exist_ok=True)
-    temp_folder = "temp_frames"
-    os.makedirs(temp_folder, exist_ok=True)
-    command = [
-        "ffmpeg", "-i", video_path, "-vf", f"fps={frame_rate}",
-        os.path.join(temp_folder, "frame_%04d.jpg"), "-hide_banner", "-loglevel", "error", "-y"
-    ]
-    subprocess.run(command)
-    timestamps = []
-    prev_hash = None
-    for i, fname in enumerate(sorted(os.listdir(temp_folder))):
-        img_path = os.path.join(temp_folder, fname)
-        with Image.open(img_path) as img:
-            img_hash = imagehash.phash(img)
-        if prev_hash is not None:
-            diff = (prev_hash - img_hash) / len(img_hash.hash)**2
-            if diff >= threshold:
-                timestamps.append(i / frame_rate)
-        prev_hash = img_hash
+def get_visual_change_times(video_path, threshold=0.5, frame_rate=1):
+    import imagehash
+    from PIL import Image
+    # The sampled frames of each recording go to their own temporary folder
+    with tempfile.TemporaryDirectory(prefix="frames-") as temp_folder:
+        command = [
+            "ffmpeg", "-i", video_path, "-vf", f"fps={frame_rate}",
+            os.path.join(temp_folder, "frame_%04d.jpg"), "-hide_banner", "-loglevel", "error", "-y"
+        ]
+        subprocess.run(command)
+        timestamps = []
+        prev_hash = None
+        for i, fname in enumerate(sorted(os.listdir(temp_folder))):
+            img_path = os.path.join(temp_folder, fname)
+            with Image.open(img_path) as img:
+                img_hash = imagehash.phash(img)
+            if prev_hash is not None:
+                diff = (prev_hash - img_hash) / len(img_hash.hash)**2
+                if diff >= threshold:
+                    timestamps.append(i / frame_rate)
+            prev_hash = img_hash
     return np.array(timestamps)
 
 def get_final_key_frames(audio_peaks, mouse_clicks, visual_changes, min_gap=20, max_clips=10):
@@ -103,7 +118,45 @@ def extract_screenshots(video_path, timestamps, output_folder):
         ]
         subprocess.run(command)
 
+def process_task(screen_key, audio_key, prefix2):
+    # Each job writes its audio, click log and clips to its own temporary
+    # folder, so workers sharing a directory do not overwrite each other
+    with ExitStack() as media:
+        work_dir = media.enter_context(tempfile.TemporaryDirectory(prefix="preprocessing-"))
+        with span("download", files=1):
+            local_screen = media.enter_context(fetch_from_s3(screen_key))
+        with span("download", files=1):
+            local_audio = media.enter_context(fetch_from_s3(audio_key))
+
+        audio_path = os.path.join(work_dir, "output_audio.wav")
+        with span("audio_extraction", input_bytes=os.path.getsize(local_audio)):
+            extract_audio(local_audio, audio_path)
+
+        mouse_clicks_path = os.path.join(work_dir, "mouse_clicks.csv")
+        record_mouse_clicks(local_screen, mouse_clicks_path)
+
+        with span("audio_peaks") as stage:
+            audio_peaks = get_audio_peaks(audio_path)
+            stage.set(peaks=len(audio_peaks))
+        mouse_clicks = get_mouse_click_times(mouse_clicks_path)
+        with span("visual_changes") as stage:
+            visual_changes = get_visual_change_times(local_screen)
+            stage.set(changes=len(visual_changes))
+
+        final_key_frames = get_final_key_frames(audio_peaks, mouse_clicks, visual_changes)
+
+        if final_key_frames:
+            uuid = prefix2.strip("/").split("/")[-1]
+            output_folder = os.path.join(work_dir, "output", uuid)
+            with span("clips", clips=len(final_key_frames)):
+                extract_video_clips(local_screen, final_key_frames, os.path.join(output_folder, "clips"))
+            with span("screenshots", screenshots=len(final_key_frames)):
+                extract_screenshots(local_screen, final_key_frames, os.path.join(output_folder, "screenshots"))
+            with span("upload"):
+                upload_folder_to_s3(output_folder, f"{output_prefix}/{uuid}")
+
 def process_all_folders():
+    import_in_background(*HEAVY_MODULES)
     paginator = s3.get_paginator("list_objects_v2")
     response_iterator = paginator.paginate(Bucket=bucket_name, Prefix="recording_results/", Delimiter="/")
 
@@ -119,28 +172,31 @@ def process_all_folders():
                 screen_key = task_path + "screen.webm"
                 audio_key = task_path + "audio.webm"
 
-                local_screen = "screen.webm"
-                local_audio = "audio.webm"
-                download_file_from_s3(screen_key, local_screen)
-                download_file_from_s3(audio_key, local_audio)
-
-                audio_path = "output_audio.wav"
-                extract_audio(local_audio, audio_path)
-
-                record_mouse_clicks(local_screen, "mouse_clicks.csv")
+                with span("session", prefix=task_path):
+                    process_task(screen_key, audio_key, prefix2)
 
-                audio_peaks = get_audio_peaks(audio_path)
-                mouse_clicks = get_mouse_click_times("mouse_clicks.csv")
-                visual_changes = get_visual_change_times(local_screen)
+def run_queue_worker():
+    # Process recordings as the backend publishes them (the S3 key of each
+    # uploaded screen.webm), instead of listing the whole bucket
+    from work_queue import WorkQueue
+    import_in_background(*HEAVY_MODULES)
+    queue = WorkQueue()
+    print(f"Waiting for recordings on queue '{WORK_QUEUE_NAME}' ({queue.path})")
 
-                final_key_frames = get_final_key_frames(audio_peaks, mouse_clicks, visual_changes)
+    def handle(message):
+        task_path = os.path.dirname(message.body) + "/"
+        # Like process_all_folders, only the first task of a session is split
+        if not task_path.endswith("/task_1/"):
+            return None
+        prefix2 = os.path.dirname(task_path.rstrip("/")) + "/"
+        with span("session", prefix=task_path):
+            process_task(task_path + "screen.webm", task_path + "audio.webm", prefix2)
 
-                if final_key_frames:
-                    uuid = prefix2.strip("/").split("/")[-1]
-                    output_folder = f"output/{uuid}"
-                    extract_video_clips(local_screen, final_key_frames, os.path.join(output_folder, "clips"))
-                    extract_screenshots(local_screen, final_key_frames, os.path.join(output_folder, "screenshots"))
-                    upload_folder_to_s3(output_folder, f"{output_prefix}/{uuid}")
+    queue.consume(WORK_QUEUE_NAME, handle)
 
 if __name__ == "__main__":
-    process_all_folders()
+    # python process_from_s3.py [queue]
+    if len(sys.argv) > 1 and sys.argv[1] == "queue":
+        run_queue_worker()
+    else:
+        process_all_folders()
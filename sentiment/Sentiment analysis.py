@@ -1,14 +1,20 @@
-from flask import Flask, request, jsonify
-import whisper, boto3, os, time
-import matplotlib.pyplot as plt
-import pandas as pd
-from textblob import TextBlob
+from flask import Flask, request, jsonify, g
+import os, threading, time
+from contextlib import ExitStack
+import common_path  # puts ../common (shared modules) on the import path
+from instrumentation import current_span, span
+from media_cache import default_cache
+from lazy_client import LazyClient
 
 app = Flask(__name__)
 
-# Initialize Whisper model and S3 client
-whisper_model = whisper.load_model("base")
-s3 = boto3.client("s3")
+# The Whisper model and the S3 client are created on first use; the Whisper
+# model (and PyTorch) takes seconds to load, so __main__ starts loading it in
+# the background and Flask serves /health in the meantime
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "base")
+_whisper_model = None
+_load_lock = threading.Lock()
+s3 = LazyClient("s3")
 BUCKET = "cs14-2-nlp"
 PREFIX = "videos_with_high_info/"
 
@@ -16,6 +22,41 @@ PREFIX = "videos_with_high_info/"
 AUDIO_EXTS = [".wav", ".mp3", ".m4a", ".flac"]
 VIDEO_EXTS = [".mp4", ".mkv", ".mov"]
 
+def get_whisper_model():
+    """Load the Whisper model on first use (later calls return the loaded model)."""
+    global _whisper_model
+    if _whisper_model is None:
+        with _load_lock:
+            if _whisper_model is None:
+                with span("model_load", model=WHISPER_MODEL):
+                    import whisper
+                    _whisper_model = whisper.load_model(WHISPER_MODEL)
+    return _whisper_model
+
+def warm_up():
+    """Load the Whisper model and the S3 client on a background thread."""
+    def _load():
+        s3.client()
+        get_whisper_model()
+    thread = threading.Thread(target=_load, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# Every request except /health is timed as a "request" span (see instrumentation.py)
+@app.before_request
+def start_request_span():
+    if request.endpoint != "health":
+        g.request_span = ExitStack()
+        g.request_span.enter_context(span("request", path=request.path))
+
+@app.teardown_request
+def end_request_span(error=None):
+    request_span = g.pop("request_span", None)
+    if request_span is not None:
+        if error is not None:
+            current_span().set(error=str(error))
+        request_span.close()
+
 # Extract audio from video using ffmpeg
 def extract_audio(video_path, audio_path):
     os.system(f'ffmpeg -i "{video_path}" -ac 1 -ar 16000 -vn -loglevel error -y "{audio_path}"')
@@ -26,6 +67,11 @@ def analyze_all_in_prefix():
     Automatically list and process all supported audio/video files 
     under the videos_with_high_info/ prefix in S3.
     """
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    from textblob import TextBlob
+
+    whisper_model = get_whisper_model()
     response = s3.list_objects_v2(Bucket=BUCKET, Prefix=PREFIX)
     if "Contents" not in response:
         return jsonify({"error": "No files found in the specified S3 prefix."}), 404
@@ -34,31 +80,38 @@ def analyze_all_in_prefix():
         obj["Key"] for obj in response["Contents"]
         if not obj["Key"].endswith("/")
     ]
+    etags = {obj["Key"]: obj.get("ETag") for obj in response["Contents"]}
 
     records = []
+    current_span().set(files=len(all_keys))
 
     for key in all_keys:
         try:
             base, ext = os.path.splitext(os.path.basename(key))
             ext = ext.lower()
-            local_input = f"/tmp/{base}{ext}"
             local_audio = f"/tmp/{base}.wav"
 
             if ext not in AUDIO_EXTS + VIDEO_EXTS:
                 records.append({"file": key, "error": f"Unsupported file type: {ext}"})
                 continue
 
-            # Download from S3
-            s3.download_file(BUCKET, key, local_input)
-
-            # Audio or video handling
-            if ext in AUDIO_EXTS:
-                local_audio = local_input
-            else:
-                extract_audio(local_input, local_audio)
-
-            # Transcribe and analyze
-            text = whisper_model.transcribe(local_audio)["text"]
+            with ExitStack() as media:
+                # Download from S3, or reuse the copy in the local media cache
+                # (shared with the other pipelines on this host)
+                with span("download", key=key, files=1):
+                    local_input = media.enter_context(default_cache().fetch(s3, BUCKET, key, etags.get(key)))
+
+                # Audio or video handling
+                if ext in AUDIO_EXTS:
+                    local_audio = local_input
+                else:
+                    with span("audio_extraction", key=key):
+                        extract_audio(local_input, local_audio)
+
+                # Transcribe and analyze
+                with span("transcription", key=key, bytes=os.path.getsize(local_audio)) as stage:
+                    text = whisper_model.transcribe(local_audio)["text"]
+                    stage.set(characters=len(text))
             tb = TextBlob(text)
             polarity = tb.sentiment.polarity
             subjectivity = tb.sentiment.subjectivity
@@ -69,8 +122,7 @@ def analyze_all_in_prefix():
                 "subjectivity": subjectivity
             })
 
-            # Clean up temp files
-            if os.path.exists(local_input): os.remove(local_input)
+            # Clean up temp files (the input stays in the media cache)
             if os.path.exists(local_audio) and local_audio != local_input:
                 os.remove(local_audio)
 
@@ -96,14 +148,16 @@ def analyze_all_in_prefix():
         plt.savefig(path)
         plt.close()
 
-    _bar("polarity", "Sentiment Polarity", pol_png, (-1, 1))
-    _bar("subjectivity", "Subjectivity", sub_png, (0, 1))
+    with span("charts"):
+        _bar("polarity", "Sentiment Polarity", pol_png, (-1, 1))
+        _bar("subjectivity", "Subjectivity", sub_png, (0, 1))
 
     # Upload images to S3
     pol_key = f"output/polarity_{ts}.png"
     sub_key = f"output/subjectivity_{ts}.png"
-    s3.upload_file(pol_png, BUCKET, pol_key)
-    s3.upload_file(sub_png, BUCKET, sub_key)
+    with span("upload", files=2, bytes=os.path.getsize(pol_png) + os.path.getsize(sub_png)):
+        s3.upload_file(pol_png, BUCKET, pol_key)
+        s3.upload_file(sub_png, BUCKET, sub_key)
 
     # Clean up generated images
     os.remove(pol_png)
@@ -122,7 +176,8 @@ def analyze_all_in_prefix():
 # Health check endpoint
 @app.route("/health")
 def health():
-    return jsonify({"status": "running"})
+    return jsonify({"status": "running", "model_loaded": _whisper_model is not None})
 
 if __name__ == "__main__":
+    warm_up()
     app.run(host="0.0.0.0", port=5000)
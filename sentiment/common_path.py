@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sys
+
+# The modules shared by the services (instrumentation, media cache, work queue, S3 client)
+# live in <repo>/common; importing this module puts that folder on the import
+# path (processes started by multiprocessing inherit it)
+COMMON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common')
+if COMMON_DIR not in sys.path:
+    sys.path.append(COMMON_DIR)